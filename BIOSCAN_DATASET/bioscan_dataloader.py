@@ -8,37 +8,58 @@ BIOSCAN-5M PyTorch Dataset.
 :License: MIT
 """
 
+import copy
+import io
+import itertools
+import json
 import os
 
+import numpy as np
 import pandas as pd
 import PIL
+import torch
+from torch.utils.data import IterableDataset
 from torchvision.datasets.vision import VisionDataset
 
-df_dtypes = {
-    "processid": str,
-    "sampleid": str,
-    "taxon": "category",
-    "phylum": "category",
-    "class": "category",
-    "order": "category",
-    "family": "category",
-    "subfamily": "category",
-    "genus": "category",
-    "species": "category",
-    "dna_bin": "category",
-    "dna_barcode": str,
-    "country": "category",
-    "province_state": "category",
-    "coord-lat": float,
-    "coord-lon": float,
-    "image_measurement_value": float,
-    "area_fraction": float,
-    "scale_factor": float,
-    "inferred_ranks": "uint8",
-    "split": str,
-    "index_bioscan_1M_insect": "Int64",
-    "chunk": str,
-}
+from bioscan_dna import (
+    PackedBarcodes,
+    encode_barcodes,
+    load_barcode_tokens,
+    load_packed_barcodes,
+    load_unique_barcode_mask,
+)
+from bioscan_image_store import (
+    CachedImageStore,
+    FileImageStore,
+    HDF5ImageStore,
+    HTTPImageStore,
+    HTTPShardImageStore,
+    MemmapImageStore,
+    PrefetchingImageStore,
+    default_hdf5_path,
+    default_memmap_path,
+    default_shard_dir,
+    draft_image,
+    find_store_paths,
+    iter_shard,
+    load_shard_manifest,
+)
+from bioscan_http import HTTPClient
+from bioscan_schema import CONSUMERS, get_dtypes
+from bioscan_table import evaluate_filters, load_image_path_index, load_metadata_table
+
+df_dtypes = get_dtypes(CONSUMERS["dataloader"])
+
+label_cols = [
+    "phylum",
+    "class",
+    "order",
+    "family",
+    "subfamily",
+    "genus",
+    "species",
+    "dna_bin",
+]
 
 df_usecols = [
     "processid",
@@ -97,12 +118,27 @@ class BIOSCAN5M(VisionDataset):
         Which data modalities to use. One of, or a list of:
         ``"image"``, ``"dna"``.
 
+    filters : dict, optional
+        Predicates on the metadata columns which samples must satisfy, in
+        addition to being in the ``split``. A mapping from column name to
+        a value or list of values to keep, a ``(low, high)`` tuple of
+        inclusive bounds (either of which may be ``None``), or a callable
+        which maps an array of the column's values to a boolean mask.
+        For example, ``{"order": "Diptera", "area_fraction": (0.1, None)}``.
+        See also :meth:`subset`.
+
     image_package : str, default="cropped_256"
         The package to load images from. One of:
         ``"original_full"``, ``"cropped"``, ``"original_256"``, ``"cropped_256"``.
 
     reduce_repeated_barcodes : str or bool, default=False
         Whether to reduce the dataset to only one sample per barcodes.
+        One of: ``False``, ``"base"`` (samples with identical barcodes are
+        repeats), or ``"rstrip_Ns"`` (barcodes are also compared ignoring
+        trailing Ns). Barcodes are compared after truncating them to
+        ``max_nucleotides``. The sample kept for each barcode is chosen by a
+        seeded hash, so is the same every time, and the selection is cached
+        with the metadata.
 
     max_nucleotides : int, default=None
         Maximum number of nucleotides to keep in the DNA barcode.
@@ -120,6 +156,98 @@ class BIOSCAN5M(VisionDataset):
 
     target_transform : Callable, default=None
         Label transformation pipeline.
+
+    dna_tokenizer : str, optional
+        If set, the DNA modality is served as a tensor of token ids instead
+        of a string. One of: ``"char"``, ``"kmer"`` (overlapping k-mers),
+        ``"kmer_nonoverlap"`` (non-overlapping k-mers). All the barcodes are
+        tokenized at once, and cached alongside the metadata cache.
+        See :func:`bioscan_dna.barcode_vocabulary` for the token ids.
+
+    dna_kmer_size : int, default=6
+        The k-mer size for the ``"kmer"`` and ``"kmer_nonoverlap"`` tokenizers.
+
+    metadata_cache : bool or str, default=True
+        Whether to cache the parsed metadata on disk as memory-mappable
+        columns, so subsequent constructions can skip parsing the CSV.
+        If ``True``, the cache is stored in ``<root>/metadata/cache``.
+        If a string, it is the directory to store the cache in.
+
+    table : bioscan_table.MetadataTable, optional
+        An already loaded metadata table to select the samples from, shared
+        with other datasets. See :class:`BIOSCAN5MSplits`. By default, the
+        table is loaded from the metadata file.
+
+    image_storage : str, default="files"
+        How the images of the ``image_package`` are stored. One of:
+        ``"files"`` (the individual JPEG files, as distributed), or
+        ``"hdf5"`` (one HDF5 file per split, written with
+        :func:`bioscan_image_store.write_hdf5`), or
+        ``"memmap"`` (pre-decoded fixed-size images, written with
+        :func:`bioscan_image_store.write_memmap`), or
+        ``"http"`` (the individual JPEG files, read from ``image_url``), or
+        ``"http_shards"`` (tar shards written with
+        :func:`bioscan_image_store.write_shards`, read from ``image_url``
+        with ranged requests).
+
+    image_url : str, optional
+        Base URL of a web server or S3-compatible object store holding a copy
+        of the ``<root>/images`` directory, for the ``"http"`` and
+        ``"http_shards"`` storage. The images are read from
+        ``<image_url>/<image_package>/`` or the shards from
+        ``<image_url>/shards/<image_package>/<split>/``, respectively.
+
+    image_http_options : dict, optional
+        Keyword arguments for the :class:`bioscan_http.HTTPClient` used to read
+        from ``image_url``, such as ``max_connections``, ``timeout`` and
+        ``headers``.
+
+    image_read_threads : int, default=0
+        Number of threads each process uses to read image files concurrently,
+        which hides the latency of network filesystems. The images of each
+        batch are read at once, and images passed to :meth:`prefetch` are read
+        ahead in the background. Set to ``0`` to read images one at a time.
+        See :class:`bioscan_image_store.PrefetchingImageStore`. To read the
+        images of the next batches ahead with a DataLoader, give it a
+        :class:`bioscan_sampler.LookaheadBatchSampler`.
+
+    image_prefetch_depth : int, optional
+        Maximum number of images which can be prefetched at once, per
+        process. Default is ``4 * image_read_threads``.
+
+    image_cache_size : int, default=0
+        Size in bytes of an in-memory cache of images, which speeds up
+        repeated passes over small splits. Set to ``0`` to disable caching.
+
+    image_cache_type : str, default="bytes"
+        What to cache. One of: ``"bytes"`` (the encoded image files), or
+        ``"decoded"`` (the decoded pixels).
+
+    image_cache_shared : bool, default=False
+        Whether to hold the image cache in shared memory, so all DataLoader
+        workers forked from this process share one copy of it.
+
+    decode_size : int or tuple[int, int], optional
+        Minimum size to decode JPEG images at, as the length of the shorter
+        side or as ``(height, width)``. Images are decoded at the smallest
+        power-of-two reduction of their full resolution (using libjpeg DCT
+        scaling) which is at least this size. This greatly reduces the cost
+        of decoding the ``"original_full"`` and ``"cropped"`` packages when
+        the transform downsamples the images. By default, images are decoded
+        at full resolution.
+
+    Notes
+    -----
+    Samples are served from :attr:`table`, whose columns are NumPy arrays
+    (memory-mapped from the metadata cache when it is enabled), indexed by
+    the array of selected row positions. DataLoader workers therefore all read
+    the same pages, without the copy-on-write growth caused by touching Python
+    objects. The pandas :attr:`metadata` DataFrame is only built when it is
+    first accessed.
+
+    If ``modality`` does not include ``"image"``, only the metadata columns
+    needed for the DNA barcodes and targets are loaded, and no image paths
+    are built or checked. :attr:`metadata` then only has those columns.
     """
 
     def __init__(
@@ -127,6 +255,7 @@ class BIOSCAN5M(VisionDataset):
         root,
         split="train",
         modality=("image", "dna"),
+        filters=None,
         image_package="cropped_256",
         reduce_repeated_barcodes=False,
         max_nucleotides=None,
@@ -134,20 +263,49 @@ class BIOSCAN5M(VisionDataset):
         transform=None,
         dna_transform=None,
         target_transform=None,
+        dna_tokenizer=None,
+        dna_kmer_size=6,
+        metadata_cache=True,
+        table=None,
+        image_storage="files",
+        image_url=None,
+        image_http_options=None,
+        image_read_threads=0,
+        image_prefetch_depth=None,
+        image_cache_size=0,
+        image_cache_type="bytes",
+        image_cache_shared=False,
+        decode_size=None,
     ) -> None:
         root = os.path.expanduser(root)
         super().__init__(root, transform=transform, target_transform=target_transform)
 
-        self.metadata = None
+        self._metadata = None
         self.root = root
         self.image_package = image_package
         self.image_dir = os.path.join(self.root, "images", self.image_package)
         self.metadata_path = os.path.join(self.root, "metadata", "csv", "BIOSCAN_5M_Insect_Dataset_metadata.csv")
+        if metadata_cache is True:
+            metadata_cache = os.path.join(self.root, "metadata", "cache")
+        self.metadata_cache = os.path.expanduser(metadata_cache) if metadata_cache else None
+
+        self.image_storage = image_storage
+        self.image_url = image_url
+        self.image_http_options = dict(image_http_options) if image_http_options else {}
+        self.image_read_threads = image_read_threads
+        self.image_prefetch_depth = image_prefetch_depth
+        self.image_cache_size = image_cache_size
+        self.image_cache_type = image_cache_type
+        self.image_cache_shared = image_cache_shared
+        self.decode_size = decode_size
 
         self.split = split
+        self.filters = dict(filters) if filters else {}
         self.reduce_repeated_barcodes = reduce_repeated_barcodes
         self.max_nucleotides = max_nucleotides
         self.dna_transform = dna_transform
+        self.dna_tokenizer = dna_tokenizer
+        self.dna_kmer_size = dna_kmer_size
 
         if isinstance(modality, str):
             self.modality = [modality]
@@ -165,41 +323,181 @@ class BIOSCAN5M(VisionDataset):
         if not self._check_exists():
             raise EnvironmentError(f"{type(self).__name__} dataset not found in {self.image_dir}.")
 
-        self.metadata = self._load_metadata()
+        self.table = self._load_table() if table is None else self._check_table(table)
+        self.rows = self._select_rows()
+        self.image_paths = None
+        self.image_store = None
+        if "image" in self.modality:
+            self.image_paths = load_image_path_index(self.table, self.image_package, cache_dir=self.table.cache_dir)
+            self.image_store = self._get_image_store()
+        self.dna_tokens = None
+        if self.dna_tokenizer is not None and set(self.modality) & {"dna_barcode", "dna", "barcode"}:
+            self.dna_tokens = self._load_dna_tokens()
+
+    @property
+    def metadata(self) -> pd.DataFrame:
+        """The metadata of the samples in the dataset, as a pandas DataFrame."""
+        if self._metadata is None:
+            self._metadata = self._load_metadata()
+        return self._metadata
 
     def __len__(self):
-        return len(self.metadata)
+        return len(self.rows)
 
     def __getitem__(self, index: int):
-        sample = self.metadata.iloc[index]
-        img_path = os.path.join(self.image_dir, sample["image_path"])
-        values = []
+        return self.__getitems__([index])[0]
+
+    def __getitems__(self, indices):
+        """Fetch a batch of samples.
+
+        The metadata for the whole batch is gathered with one vectorized
+        lookup per column. This is used automatically by
+        :class:`torch.utils.data.DataLoader` when batching. The samples are
+        still returned one by one, with their target as an int or a tuple of
+        ints as :meth:`__getitem__` returns it, so the DataLoader's
+        ``collate_fn`` stacks them as it does without this method.
+
+        Parameters
+        ----------
+        indices : Sequence[int]
+            Indices of the samples to fetch. If ``indices`` has an
+            ``upcoming`` attribute, as a :class:`bioscan_sampler.LookaheadBatch`
+            does, the images of those samples are prefetched once the images
+            of this batch have been read.
+
+        Returns
+        -------
+        list[tuple]
+            One tuple per sample, in the same format as :meth:`__getitem__`.
+        """
+        upcoming = getattr(indices, "upcoming", None)
+        indices = np.asarray(indices, dtype=np.int64)
+        rows = self.rows[indices]
+        columns = []
         for modality in self.modality:
             if modality == "image":
-                X = PIL.Image.open(img_path)
-                if self.transform is not None:
-                    X = self.transform(X)
+                columns.append(self.image_store.open_images(rows))
+                if upcoming:
+                    self.prefetch(upcoming)
+            elif modality in ["dna_barcode", "dna", "barcode"] and self.dna_tokens is not None:
+                # Cached tokens cover every row in the table, otherwise only the rows in the dataset
+                tokens = self.dna_tokens[rows if self.table.cache_dir is not None else indices]
+                columns.append(list(torch.from_numpy(tokens.astype(np.int64))))
             elif modality in ["dna_barcode", "dna", "barcode"]:
-                X = sample["dna_barcode"]
-                if self.dna_transform is not None:
-                    X = self.dna_transform(X)
+                barcodes = self.table["dna_barcode"].to_numpy(rows)
+                if self.max_nucleotides is not None:
+                    barcodes = [X[: self.max_nucleotides] if isinstance(X, str) else X for X in barcodes]
+                columns.append(barcodes)
             else:
                 raise ValueError(f"Unfamiliar modality: {modality}")
-            values.append(X)
 
-        target = []
-        for t in self.target_type:
-            target.append(sample[f"{t}_index"])
-
-        if target:
-            target = tuple(target) if len(target) > 1 else target[0]
-            if self.target_transform is not None:
-                target = self.target_transform(target)
+        if self.target_type:
+            # Look up the targets of the whole batch at once, then split them into one list of ints per sample
+            targets = np.stack([self.table[t].codes[rows] for t in self.target_type], axis=-1)
+            targets = targets.astype(np.int64).tolist()
         else:
-            target = None
+            targets = [None] * len(rows)
+
+        samples = []
+        for i, target in enumerate(targets):
+            values = []
+            for modality, column in zip(self.modality, columns):
+                X = column[i]
+                if modality == "image":
+                    if self.transform is not None:
+                        X = self.transform(X)
+                elif self.dna_transform is not None:
+                    X = self.dna_transform(X)
+                values.append(X)
 
-        values.append(target)
-        return tuple(values)
+            if target is not None:
+                target = tuple(target) if len(target) > 1 else target[0]
+                if self.target_transform is not None:
+                    target = self.target_transform(target)
+
+            values.append(target)
+            samples.append(tuple(values))
+        return samples
+
+    def prefetch(self, indices):
+        """
+        Start reading the images of samples which will be needed soon.
+
+        This has no effect unless ``image_read_threads`` is set. Prefetching is
+        per process, so with a DataLoader it should be called from the worker
+        which will fetch the samples. A :class:`bioscan_sampler.LookaheadBatchSampler`
+        does this for each batch.
+
+        Parameters
+        ----------
+        indices : Iterable[int]
+            The indices of the samples, in the order they will be needed.
+        """
+        store = self.image_store
+        while isinstance(store, CachedImageStore):
+            store = store.store
+        if isinstance(store, PrefetchingImageStore):
+            store.prefetch(self.rows[np.asarray(list(indices), dtype=np.int64)])
+
+    def get_labels(self, level="species") -> np.ndarray:
+        """
+        Get the label index of each sample, at a taxonomic level.
+
+        Parameters
+        ----------
+        level : str, default="species"
+            The taxonomic level, or ``"dna_bin"``. Other metadata columns,
+            such as ``"chunk"``, can be given too.
+
+        Returns
+        -------
+        numpy.ndarray
+            The label index of each sample, as in ``metadata[level + "_index"]``,
+            with ``-1`` for samples which are not labelled at this level.
+            Columns which are not stored as categories are numbered in order
+            of first appearance in the dataset instead.
+        """
+        self._load_columns([level])
+        column = self.table[level]
+        if not hasattr(column, "codes"):
+            return pd.factorize(column.to_numpy(self.rows))[0].astype(np.int64)
+        return np.asarray(column.codes)[self.rows].astype(np.int64)
+
+    def subset(self, **filters) -> "BIOSCAN5M":
+        """
+        Select a subset of the samples, by predicates on the metadata columns.
+
+        The predicates are evaluated on the column arrays of :attr:`table`,
+        which is shared with the returned dataset, so no metadata is copied
+        or reloaded. Columns which are not loaded yet are added to the table.
+
+        Parameters
+        ----------
+        **filters
+            Predicates on the metadata columns, as for the ``filters``
+            argument. Names which are not valid identifiers, such as
+            ``"coord-lat"``, can be given by unpacking a dict.
+
+        Returns
+        -------
+        BIOSCAN5M
+            A dataset of the samples in this dataset which satisfy all the
+            predicates, in the same order.
+
+        Examples
+        --------
+        >>> diptera = dataset.subset(order="Diptera")
+        >>> large = dataset.subset(image_measurement_value=(1000, None))
+        """
+        self._load_columns(filters)
+        positions = np.flatnonzero(evaluate_filters(self.table, filters, self.rows))
+        view = copy.copy(self)
+        view.rows = self.rows[positions]
+        view._metadata = None
+        if self.dna_tokens is not None and self.table.cache_dir is None:
+            # Tokens which are not cached are only held for the rows in the dataset
+            view.dna_tokens = self.dna_tokens[positions]
+        return view
 
     def _check_exists(self) -> bool:
         """Check if the dataset is already downloaded and extracted.
@@ -210,52 +508,452 @@ class BIOSCAN5M(VisionDataset):
             True if the dataset is already downloaded and extracted, False otherwise.
         """
         check = os.path.isfile(self.metadata_path)
-        if "images" in self.modality:
+        if "image" in self.modality and self.image_storage == "files":
             check &= os.path.isdir(self.image_dir)
         return check
 
-    def _load_metadata(self) -> pd.DataFrame:
+    def _get_image_store(self):
         """
-        Load metadata from CSV file and prepare it for training.
+        Get the storage backend to read images from.
 
         Returns
         -------
-        pandas.DataFrame
-            The metadata DataFrame.
+        bioscan_image_store.ImageStore
+            The image store, addressed by row position in :attr:`table`.
         """
-        df = pd.read_csv(self.metadata_path, dtype=df_dtypes, usecols=df_usecols)
-        if self.max_nucleotides is not None:
-            df["dna_barcode"] = df["dna_barcode"].str[: self.max_nucleotides]
-        if self.reduce_repeated_barcodes:
-            # Shuffle the data order
-            df = df.sample(frac=1, random_state=0)
-            # Drop duplicated barcodes
-            if self.reduce_repeated_barcodes == "rstrip_Ns":
-                df["dna_barcode_strip"] = df["dna_barcode"].str.rstrip("N")
-                df = df.drop_duplicates(subset=["dna_barcode_strip"])
-                df.drop(columns=["dna_barcode_strip"], inplace=True)
-            elif self.reduce_repeated_barcodes == "base":
-                df = df.drop_duplicates(subset=["dna_barcode"])
+        if self.image_storage == "files":
+            store = FileImageStore(self.image_dir, self.image_paths)
+        elif self.image_storage == "hdf5":
+            path = default_hdf5_path(self.root, self.image_package, self.split)
+            store = HDF5ImageStore(find_store_paths(path, self.split))
+        elif self.image_storage == "memmap":
+            path = default_memmap_path(self.root, self.image_package, self.split)
+            store = MemmapImageStore(find_store_paths(path, self.split))
+        elif self.image_storage in ("http", "http_shards"):
+            if not self.image_url:
+                raise ValueError(f"image_url must be given to use image_storage={self.image_storage!r}")
+            client = HTTPClient(**self.image_http_options)
+            base_url = self.image_url.rstrip("/")
+            if self.image_storage == "http":
+                store = HTTPImageStore(f"{base_url}/{self.image_package}", self.image_paths, client=client)
             else:
+                url = f"{base_url}/shards/{self.image_package}/{self.split or 'all'}"
+                store = HTTPShardImageStore(url, client=client)
+        else:
+            raise ValueError(f"Unfamiliar image_storage value: {self.image_storage}")
+        store.decode_size = self.decode_size
+        if self.image_read_threads:
+            store = PrefetchingImageStore(store, self.image_read_threads, depth=self.image_prefetch_depth)
+        if self.image_cache_size:
+            store = CachedImageStore(
+                store,
+                self.image_cache_size,
+                cache_type=self.image_cache_type,
+                shared=self.image_cache_shared,
+                n_rows=len(self.table),
+            )
+        return store
+
+    def _load_dna_tokens(self):
+        """
+        Tokenize the DNA barcodes.
+
+        Returns
+        -------
+        numpy.ndarray
+            The token ids of the barcodes of every row in :attr:`table`,
+            memory-mapped from the cache, if the metadata cache is enabled.
+            Otherwise, the token ids of the barcodes of the samples in the
+            dataset only.
+        """
+        kwargs = {"tokenizer": self.dna_tokenizer, "k": self.dna_kmer_size, "max_nucleotides": self.max_nucleotides}
+        if self.table.cache_dir is None:
+            return encode_barcodes(self.table["dna_barcode"], rows=self.rows, **kwargs)
+        return load_barcode_tokens(self.table["dna_barcode"], cache_dir=self.table.cache_dir, **kwargs)
+
+    def _load_table(self):
+        """
+        Load the metadata table, using the metadata cache if it is enabled.
+
+        Returns
+        -------
+        bioscan_table.MetadataTable
+            The table of all the samples in the metadata file, with the DNA
+            barcodes packed at 2 bits per nucleotide.
+        """
+        usecols = self._get_usecols() + [c for c in self.filters if c not in df_usecols]
+        table = load_metadata_table(self.metadata_path, df_dtypes, usecols, cache_dir=self.metadata_cache)
+        if "dna_barcode" in table:
+            table.columns["dna_barcode"] = load_packed_barcodes(table["dna_barcode"], cache_dir=table.cache_dir)
+        return table
+
+    def _load_columns(self, columns):
+        """
+        Add metadata columns to :attr:`table`, if they are not already loaded.
+
+        Parameters
+        ----------
+        columns : Iterable[str]
+            The names of the columns.
+        """
+        missing = [c for c in columns if c not in self.table]
+        if not missing:
+            return
+        extra = load_metadata_table(self.metadata_path, df_dtypes, missing, cache_dir=self.metadata_cache)
+        self.table.columns.update(extra.columns)
+        unknown = [c for c in missing if c not in self.table]
+        if unknown:
+            raise ValueError(f"Columns not in the metadata file: {unknown}")
+
+    def _check_table(self, table):
+        """
+        Prepare a metadata table which was loaded elsewhere for use by this dataset.
+
+        Any columns this dataset needs which the table does not have, such as
+        a target overridden for one split, are loaded into the table.
+
+        Parameters
+        ----------
+        table : bioscan_table.MetadataTable
+            The metadata table.
+
+        Returns
+        -------
+        bioscan_table.MetadataTable
+            The same table, with the missing columns added and the DNA
+            barcodes packed if they were not already.
+        """
+        self.table = table
+        self._load_columns(self._get_usecols())
+        if "dna_barcode" in table and not isinstance(table["dna_barcode"], PackedBarcodes):
+            table.columns["dna_barcode"] = load_packed_barcodes(table["dna_barcode"], cache_dir=table.cache_dir)
+        return table
+
+    def _get_usecols(self):
+        """
+        Get the metadata columns needed for the modalities and targets.
+
+        Returns
+        -------
+        list[str]
+            The columns to load from the metadata file.
+        """
+        if "image" in self.modality:
+            return df_usecols
+        # Without images, the columns only needed to build image paths are skipped
+        needed = {"processid", "split", "dna_barcode"} | set(self.target_type)
+        return [c for c in df_usecols if c in needed]
+
+    def _select_rows(self) -> np.ndarray:
+        """
+        Select the rows of the metadata table which make up the dataset.
+
+        Returns
+        -------
+        numpy.ndarray
+            Sorted positions of the selected rows in :attr:`table`.
+        """
+        keep = np.ones(len(self.table), dtype=bool)
+        if self.reduce_repeated_barcodes:
+            if self.reduce_repeated_barcodes not in ("base", "rstrip_Ns"):
                 raise ValueError(f"Unfamiliar reduce_repeated_barcodes value: {self.reduce_repeated_barcodes}")
-            # Re-order the data (reverting the shuffle)
-            df = df.sort_index()
+            # Keep one sample per barcode, chosen by a seeded hash of its position
+            keep &= load_unique_barcode_mask(
+                self.table["dna_barcode"],
+                cache_dir=self.table.cache_dir,
+                max_length=self.max_nucleotides,
+                rstrip_n=self.reduce_repeated_barcodes == "rstrip_Ns",
+            )
         # Filter to just the split of interest
         if self.split is not None and self.split != "all":
-            df = df[df["split"] == self.split]
+            keep &= self.table["split"].isin([self.split])
+        rows = np.flatnonzero(keep)
+        if self.filters:
+            self._load_columns(self.filters)
+            rows = rows[evaluate_filters(self.table, self.filters, rows)]
+        return rows
+
+    def _load_metadata(self) -> pd.DataFrame:
+        """
+        Build the metadata DataFrame for the samples in the dataset.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The metadata DataFrame, indexed by position in the metadata file.
+        """
+        df = self.table.to_dataframe(self.rows)
+        if self.max_nucleotides is not None:
+            df["dna_barcode"] = df["dna_barcode"].str[: self.max_nucleotides]
         # Add index columns to use for targets
-        label_cols = [
-            "phylum",
-            "class",
-            "order",
-            "family",
-            "subfamily",
-            "genus",
-            "species",
-            "dna_bin",
-        ]
         for c in label_cols:
-            df[c + "_index"] = df[c].cat.codes
+            if c in df:
+                df[c + "_index"] = df[c].cat.codes
         # Add path to image file
-        df["image_path"] = df.apply(get_image_path, axis=1)
-        return df
\ No newline at end of file
+        if self.image_paths is not None:
+            df["image_path"] = self.image_paths.to_numpy(self.rows)
+        return df
+
+
+class BIOSCAN5MSplits:
+    """
+    Load the BIOSCAN-5M metadata once, and create datasets for several splits from it.
+
+    Each dataset made by :meth:`get` is a :class:`BIOSCAN5M` which shares the
+    metadata table of the others, and only holds the array of its own row
+    positions in the table. The ``*_index`` targets are the category codes of
+    the shared table, so are consistent across splits.
+
+    Parameters
+    ----------
+    root : str
+        The root directory of the dataset.
+
+    **kwargs
+        Arguments for :class:`BIOSCAN5M` which are shared by all the splits,
+        such as ``modality``, ``target_type`` and ``metadata_cache``.
+
+    Examples
+    --------
+    >>> splits = BIOSCAN5MSplits("~/Datasets/bioscan-5m", modality="dna", target_type="genus")
+    >>> train_dataset = splits.get("train", dna_transform=augment)
+    >>> val_dataset = splits.get("val")
+    """
+
+    def __init__(self, root, **kwargs):
+        if "split" in kwargs:
+            raise TypeError("The split is given to get(), not to the constructor")
+        self.root = root
+        self.kwargs = kwargs
+        self.table = None
+
+    def get(self, split, **kwargs) -> BIOSCAN5M:
+        """
+        Create the dataset for a split.
+
+        Parameters
+        ----------
+        split : str
+            The dataset partition. See :class:`BIOSCAN5M`.
+
+        **kwargs
+            Arguments for :class:`BIOSCAN5M` specific to this split, such as
+            ``transform``, which override those given to the constructor.
+
+        Returns
+        -------
+        BIOSCAN5M
+            The dataset, using the shared metadata table.
+        """
+        dataset = BIOSCAN5M(self.root, split=split, table=self.table, **{**self.kwargs, **kwargs})
+        self.table = dataset.table
+        return dataset
+
+    def __getitem__(self, split) -> BIOSCAN5M:
+        return self.get(split)
+
+
+def _shuffle_buffer(samples, buffer_size, rng):
+    """Approximately shuffle a stream of samples using a fixed-size buffer."""
+    buffer = []
+    for sample in samples:
+        if len(buffer) < buffer_size:
+            buffer.append(sample)
+            continue
+        i = rng.integers(buffer_size)
+        yield buffer[i]
+        buffer[i] = sample
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+class BIOSCAN5MShards(IterableDataset):
+    """
+    BIOSCAN-5M Dataset, streamed sequentially from sharded tar files.
+
+    The shards are created from a :class:`BIOSCAN5M` dataset with
+    :func:`bioscan_image_store.write_shards`. The shards are divided between
+    distributed ranks and DataLoader workers, and each worker reads its
+    shards sequentially, shuffling samples within a buffer.
+
+    Every rank yields the same number of samples in an epoch,
+    ``n_samples // world_size``, which is the length of the dataset, so
+    the ranks take the same number of steps. The samples past that count
+    are dropped. A worker which runs out of its own shards before it reaches
+    its share of the count, because there are fewer shards than workers or
+    the shards are of uneven sizes, carries on with the other shards in
+    turn, so some samples are repeated.
+
+    Parameters
+    ----------
+    root : str
+        The root directory, containing the image directory.
+
+    split : str, default="train"
+        The dataset partition, as used when the shards were written.
+
+    modality : str or Iterable[str], default=("image", "dna")
+        Which data modalities to use. One of, or a list of:
+        ``"image"``, ``"dna"``.
+
+    image_package : str, default="cropped_256"
+        The package the shards were made from.
+
+    max_nucleotides : int, default=None
+        Maximum number of nucleotides to keep in the DNA barcode.
+
+    target_type : str or Iterable[str], default="species"
+        Type of target to use. One of, or a list of:
+        ``"phylum"``, ``"class"``, ``"order"``, ``"family"``, ``"subfamily"``,
+        ``"genus"``, ``"species"``, ``"dna_bin"``.
+
+    transform : Callable, default=None
+        Image transformation pipeline.
+
+    dna_transform : Callable, default=None
+        Barcode DNA transformation pipeline.
+
+    target_transform : Callable, default=None
+        Label transformation pipeline.
+
+    shard_dir : str, optional
+        Directory containing the shards. Default is
+        ``<root>/images/shards/<image_package>/<split>``.
+
+    shuffle_buffer : int, default=1000
+        Number of samples to shuffle over. The order of the shards is also
+        shuffled every epoch. Set to ``0`` to read the samples in order.
+
+    seed : int, default=0
+        Random seed for the shuffling.
+
+    decode_size : int or tuple[int, int], optional
+        Minimum size to decode JPEG images at. See :class:`BIOSCAN5M`.
+    """
+
+    def __init__(
+        self,
+        root,
+        split="train",
+        modality=("image", "dna"),
+        image_package="cropped_256",
+        max_nucleotides=None,
+        target_type="species",
+        transform=None,
+        dna_transform=None,
+        target_transform=None,
+        shard_dir=None,
+        shuffle_buffer=1000,
+        seed=0,
+        decode_size=None,
+    ) -> None:
+        super().__init__()
+        self.root = os.path.expanduser(root)
+        self.split = split
+        self.image_package = image_package
+        self.max_nucleotides = max_nucleotides
+        self.transform = transform
+        self.dna_transform = dna_transform
+        self.target_transform = target_transform
+        self.shard_dir = shard_dir or default_shard_dir(self.root, image_package, split)
+        self.shuffle_buffer = shuffle_buffer
+        self.seed = seed
+        self.decode_size = decode_size
+        self.epoch = 0
+
+        if isinstance(modality, str):
+            self.modality = [modality]
+        else:
+            self.modality = list(modality)
+
+        if isinstance(target_type, str):
+            self.target_type = [target_type]
+        else:
+            self.target_type = list(target_type)
+
+        if not self.target_type and self.target_transform is not None:
+            raise RuntimeError("target_transform is specified but target_type is empty")
+
+        try:
+            self.manifest = load_shard_manifest(self.shard_dir)
+        except FileNotFoundError:
+            raise EnvironmentError(f"{type(self).__name__} shards not found in {self.shard_dir}.") from None
+        self.shards = [os.path.join(self.shard_dir, shard["name"]) for shard in self.manifest["shards"]]
+        self.num_samples = self.manifest["n_samples"]
+
+    def set_epoch(self, epoch):
+        """Set the epoch, which changes the shuffling of the shards and samples.
+
+        With ``persistent_workers=True``, the epoch must be set before the
+        DataLoader workers are started for it to take effect.
+        """
+        self.epoch = epoch
+
+    def _get_world(self):
+        """Get the number of distributed ranks, and the rank of this process."""
+        if torch.distributed.is_available() and torch.distributed.is_initialized():
+            return torch.distributed.get_world_size(), torch.distributed.get_rank()
+        return 1, 0
+
+    def __len__(self):
+        world_size, _ = self._get_world()
+        return self.num_samples // world_size
+
+    def __iter__(self):
+        world_size, rank = self._get_world()
+        worker_info = torch.utils.data.get_worker_info()
+        num_workers, worker_id = (1, 0) if worker_info is None else (worker_info.num_workers, worker_info.id)
+        n_consumers, consumer = world_size * num_workers, rank * num_workers + worker_id
+        # The samples of each rank are divided between its workers
+        n_rank = len(self)
+        n_samples = n_rank // num_workers + (worker_id < n_rank % num_workers)
+        if not n_samples:
+            return
+        shards = self.shards
+        if self.shuffle_buffer:
+            order = np.random.default_rng((self.seed, self.epoch)).permutation(len(shards))
+            shards = [shards[i] for i in order]
+        own = shards[consumer::n_consumers] or [shards[consumer % len(shards)]]
+        start = consumer % len(shards)
+        others = itertools.cycle(shards[start:] + shards[:start])
+        # The other shards are only read once the consumer's own shards are used up
+        streams = []
+        for i, group in enumerate([own, others]):
+            samples = (sample for shard in group for _, sample in iter_shard(shard))
+            if self.shuffle_buffer:
+                rng = np.random.default_rng((self.seed, self.epoch, consumer, i))
+                samples = _shuffle_buffer(samples, self.shuffle_buffer, rng)
+            streams.append(samples)
+        for sample in itertools.islice(itertools.chain(*streams), n_samples):
+            yield self._make_sample(sample)
+
+    def _make_sample(self, sample):
+        record = json.loads(sample["json"])
+        values = []
+        for modality in self.modality:
+            if modality == "image":
+                X = draft_image(PIL.Image.open(io.BytesIO(sample["jpg"])), self.decode_size)
+                if self.transform is not None:
+                    X = self.transform(X)
+            elif modality in ["dna_barcode", "dna", "barcode"]:
+                X = record["dna_barcode"]
+                if X is None:
+                    X = np.nan
+                elif self.max_nucleotides is not None:
+                    X = X[: self.max_nucleotides]
+                if self.dna_transform is not None:
+                    X = self.dna_transform(X)
+            else:
+                raise ValueError(f"Unfamiliar modality: {modality}")
+            values.append(X)
+
+        target = [record[f"{t}_index"] for t in self.target_type]
+        if target:
+            target = tuple(target) if len(target) > 1 else target[0]
+            if self.target_transform is not None:
+                target = self.target_transform(target)
+        else:
+            target = None
+
+        values.append(target)
+        return tuple(values)
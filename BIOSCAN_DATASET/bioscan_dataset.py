@@ -1,6 +1,7 @@
 from torch.utils.data import Dataset
 import os
-from collections import defaultdict
+import numpy as np
+import pandas as pd
 import dataset_helper
 
 
@@ -10,19 +11,23 @@ class BioScan(Dataset):
             This class handles getting, setting and showing data statistics ...
             """
 
-    def get_statistics(self, metadata, level_name=None):
+    def get_statistics(self, metadata, level_name=None, consumer=None, engine=None, index_cache=True):
         """
         This function sets data attributes read from metadata file of the dataset.
         This includes biological taxonomy information, DNA barcode indexes and RGB image names and chunk numbers.
         :param metadata: Path to the Metadata file (.csv)
         :param level_name: Taxonomic level and corresponding name to extract subset.
+        :param consumer: Name of the consumer, to read only its columns (see bioscan_schema.CONSUMERS). All columns if None.
+        :param engine: CSV parser engine: c, python, pyarrow or auto.
+        :param index_cache: If to save the taxonomy index next to the metadata file, otherwise only hold it in memory.
         :return:
         """
 
         self.metadata = metadata
-        df = self.read_metadata(metadata)
+        self.taxonomy_index = dataset_helper.TaxonomyIndex(metadata, cache_dir=None if index_cache else False)
+        df = self.read_metadata(metadata, consumer=consumer, engine=engine)
         self.df = self.get_df(df, level_name=level_name)
-        self.index = self.df.index.to_list()
+        self.index = self.df.index
         self.df_categories = self.df.keys().to_list()
         self.n_DatasetAttributes = len(self.df_categories)
 
@@ -31,84 +36,92 @@ class BioScan(Dataset):
                                '5': 'family', '6': 'subfamily', '7': 'tribe', '8': 'genus', '9': 'species',
                                '10': 'subspecies', '11': 'name', '12': 'taxon'}
 
-        self.taxonomy_groups_list_dict = {}
-        for taxa in self.taxa_gt_sorted.values():
-            if taxa in self.df_categories:
-                self.taxonomy_groups_list_dict[taxa] = self.df[taxa].to_list()
+        # Columns are only read from the DataFrame when they are used
+        taxonomy_cols = [taxa for taxa in self.taxa_gt_sorted.values() if taxa in self.df_categories]
+        self.taxonomy_groups_list_dict = dataset_helper.ColumnMapping(self.df, taxonomy_cols)
 
         # Barcode and data Indexing
-        self.barcode_list_dict = {'dna_barcode': [], 'dna_bin': [], 'processid': [], 'sampleid': []}
-        for bar in self.barcode_list_dict.keys():
-            if bar in self.df_categories:
-                self.barcode_list_dict[bar] = self.df[bar].to_list()
+        barcode_cols = ['dna_barcode', 'dna_bin', 'processid', 'sampleid']
+        self.barcode_list_dict = dataset_helper.ColumnMapping(self.df, barcode_cols)
 
         # Organisms' Size
-        self.size_list_dict = {'image_measurement_value': [], 'area_fraction': [], 'scale_factor':[]}
-        for size_cat in self.size_list_dict.keys():
-            if size_cat in self.df_categories:
-                self.size_list_dict[size_cat] = self.df[size_cat].to_list()
+        size_cols = ['image_measurement_value', 'area_fraction', 'scale_factor']
+        self.size_list_dict = dataset_helper.ColumnMapping(self.df, size_cols)
 
         # Geographical location associated to the cite of collection
-        self.geographic_list_dict = {'country': [], 'province_state': [], 'coord-lat': [], 'coord-lon': []}
-        for geo_cat in self.geographic_list_dict.keys():
-            if geo_cat in self.df_categories:
-                self.geographic_list_dict[geo_cat] = self.df[geo_cat].to_list()
-
-        lat_lon = [[lat, lon] if lat != 'no_data' and lon != 'no_data' else 'no_data'
-                   for lat, lon in zip(self.geographic_list_dict.get('coord-lat'),
-                                       self.geographic_list_dict.get('coord-lon'))]
-        self.geographic_list_dict.update({'lat-lon': lat_lon})
+        geographic_cols = ['country', 'province_state', 'coord-lat', 'coord-lon']
+        self.geographic_list_dict = dataset_helper.ColumnMapping(self.df, geographic_cols,
+                                                                 derived={'lat-lon': self.get_lat_lon})
 
         # Data Chunk
         if 'chunk' in self.df_categories:
-            self.chunk_index = self.df['chunk'].to_list()
+            self.chunk_index = self.df['chunk'].values
 
         if 'index_bioscan_1M_insect' in self.df_categories:
-            self.index_1M_insect = self.df['index_bioscan_1M_insect'].to_list()
+            self.index_1M_insect = self.df['index_bioscan_1M_insect'].values
 
         if 'inferred_ranks' in self.df_categories:
-            self.label_inferred = self.df['inferred_ranks'].to_list()
+            self.label_inferred = self.df['inferred_ranks'].values
+
+        self.data_list_mapping = dataset_helper.ColumnMapping(
+            self.df, taxonomy_cols + barcode_cols + geographic_cols + ['lat-lon'] + size_cols,
+            derived={'lat-lon': lambda df: self.geographic_list_dict['lat-lon']})
 
-        self.data_list_mapping = {
-            **self.taxonomy_groups_list_dict,
-            **self.barcode_list_dict,
-            **self.geographic_list_dict,
-            **self.size_list_dict,
-        }
+    def get_lat_lon(self, df):
+        """
+        This function pairs the latitude and longitude of each sample.
+        :param df: Metadata.
+        :return: List of [lat, lon] pairs, or 'no_data' where either is unknown.
+        """
+
+        if 'coord-lat' not in df or 'coord-lon' not in df:
+            return []
+        return [[lat, lon] if lat != 'no_data' and lon != 'no_data' else 'no_data'
+                for lat, lon in zip(df['coord-lat'].to_list(), df['coord-lon'].to_list())]
 
     def __len__(self):
         return len(self.index)
 
-    def read_metadata(self, metadata):
-        """ Read a .tsv type metadata file """
+    def read_metadata(self, metadata, consumer=None, engine=None):
+        """ Read a .csv type metadata file """
 
         if os.path.isfile(metadata) and os.path.splitext(metadata)[1] == '.csv':
-            df = dataset_helper.read_csv(metadata)
+            df = dataset_helper.read_csv(metadata, consumer=consumer, engine=engine)
             print(f"Number of Samples of {os.path.basename(metadata)}: {len(df)}\n")
             return df
         else:
             raise ValueError(f'ERROR: Metadata (.csv) does NOT exist in: \n{metadata}!')
 
-    def get_df(self, df, level_name=None):
+    def get_df(self, df, level_name=None, how='union'):
         """
         Get the subset of metadata.
         :param df: Parent metadata
-        :param level_name: 2D string object showing taxonomic group-level, and a name under the group-level.
+        :param level_name: 2D string object showing taxonomic group-level, and a name under the group-level,
+        or a list of such pairs.
+        :param how: For a list of pairs, union to keep samples matching any pair, or intersection to keep samples
+        matching all of them.
         """
 
         if level_name == ['phylum', 'Arthropods']:
             """ When reading all samples of BIOSCAN dataset (exe., to split or to show statistics) """
+            self.rows = None
             return df
 
         else:
             """ When reading a specific level and name (exe., level: class, and name: Insecta) """
-            level, name = level_name
-            if level not in df.keys():
-                raise ValueError(f'\t\t\tERROR: Taxonomic level {level} is NOT available.')
-            df = dataset_helper.keep_row_by_item(df, [name], level)
-            if len(df) == 0:
-                raise ValueError(f'\t\t\tERROR: There are NO {name} in {level}.')
-            print(f"Number of Samples of {level.capitalize()} {name.capitalize()}: {len(df)}\n")
+            level_names = level_name if isinstance(level_name[0], (list, tuple)) else [level_name]
+            for level, name in level_names:
+                if level not in df.keys():
+                    raise ValueError(f'\t\t\tERROR: Taxonomic level {level} is NOT available.')
+
+            # Row ids of the subset from the inverted index, so only the selected rows are copied
+            self.rows = self.taxonomy_index.select(level_names, how=how, df=df)
+            description = f' {how} '.join(f"{level.capitalize()} {name.capitalize()}" for level, name in level_names)
+            if len(self.rows) == 0:
+                raise ValueError(f'\t\t\tERROR: There are NO {description}.')
+            df = df.take(self.rows)
+            df.index = pd.RangeIndex(len(df))
+            print(f"Number of Samples of {description}: {len(df)}\n")
             return df
 
     def set_statistics(self, configs, split='all'):
@@ -120,7 +133,7 @@ class BioScan(Dataset):
         :return:
         """
 
-        self.get_statistics(configs['metadata'], configs['level_name'])
+        self.get_statistics(configs['metadata'], configs['level_name'], index_cache=configs.get('index_cache', True))
 
         # Get data list as one of the Biological Taxonomy
         if configs['group_level'] in self.df_categories:
@@ -130,17 +143,31 @@ class BioScan(Dataset):
         else:
             raise ValueError(f'ERROR: "group_level" is NOT in: \n{self.df_categories}')
 
+        # Group the samples by class
+        self.class_groups = self.get_class_groups(configs['group_level'])
+
         # Get the data dictionary
-        self.data_dict = self.make_data_dict(self.data_list)
+        self.data_dict = self.class_groups.to_dict()
 
         # Get numbered labels of the classes
-        self.data_idx_label = self.class_to_ids(self.data_dict)
+        self.data_idx_label = self.class_groups.class_to_ids()
 
         # Get number of samples per class
-        self.n_sample_per_class = self.get_n_sample_class(self.data_dict)
+        self.n_sample_per_class = self.class_groups.counts.tolist()
 
         # Get numbered data samples list
-        self.data_list_ids = self.class_list_idx(self.data_list, self.data_idx_label)
+        self.data_list_ids = self.class_groups.labels.tolist()
+
+    def get_class_groups(self, attr):
+        """
+        This function groups the samples by the classes of an attribute.
+        :param attr: Attribute name, exe., order, dna_bin or lat-lon.
+        :return: dataset_helper.ClassGroups, with classes sorted by number of samples.
+        """
+
+        if attr in self.data_list_mapping:
+            return dataset_helper.ClassGroups(self.data_list_mapping[attr])
+        return dataset_helper.ClassGroups(self.df[attr].values)
 
     def make_data_dict(self, data_list):
         """
@@ -148,20 +175,7 @@ class BioScan(Dataset):
         :return:
         """
 
-        data_dict = defaultdict(list)
-        if all(isinstance(item, list) or item == 'no_data' for item in data_list):
-            for ind, name in enumerate(data_list):
-                if name == 'no_data':
-                    data_dict[name].append(ind)
-                else:
-                    data_dict[tuple(name)].append(ind)
-        else:
-            for ind, name in enumerate(data_list):
-                data_dict[name].append(ind)
-
-        sorted_data_dict = dataset_helper.sort_dict_list(data_dict)
-
-        return sorted_data_dict
+        return dataset_helper.ClassGroups(data_list).to_dict()
 
     def class_to_ids(self, data_dict):
 
@@ -170,12 +184,8 @@ class BioScan(Dataset):
         :param data_dict: Data dictionary corresponding each class to its sample ids
         :return:
         """
-        data_idx_label = {}
-        data_names = list(data_dict.keys())
-        for name in data_names:
-            data_idx_label[name] = data_names.index(name)
 
-        return data_idx_label
+        return dict(zip(data_dict.keys(), range(len(data_dict))))
 
     def get_n_sample_class(self, data_dict):
         """
@@ -197,8 +207,7 @@ class BioScan(Dataset):
         :return:
         """
 
-        data_list_ids = []
-        for data in data_list:
-            data_list_ids.append(data_idx_label[data])
+        groups = dataset_helper.ClassGroups(data_list)
+        label_map = np.array([data_idx_label[name] for name in groups.classes], dtype=np.int64)
 
-        return data_list_ids
+        return label_map[groups.labels].tolist()
@@ -1,5 +1,7 @@
 import math
+import numpy as np
 from bioscan_dataset import BioScan
+import dataset_helper
 from tabulate import tabulate
 
 
@@ -21,7 +23,39 @@ class BioScanDists:
         ]
         print(tabulate(formatted_rows, headers=headings, tablefmt="grid"))
 
-    def get_dis_dict(self, dataset, attr_list, dict_type='Genetic Attributes'):
+    def get_attr_dist(self, dataset, attr):
+        """
+        This function calculates the class distribution of one attribute.
+        :param dataset: Class BioScan Dataset.
+        :param attr: Attribute name.
+        :return: Dictionary of the distribution, keyed by table column.
+        """
+
+        groups = dataset.get_class_groups(attr)
+        keep = [name != 'no_data' for name in groups.classes]
+        cats = [name for name, k in zip(groups.classes, keep) if k]
+        counts = groups.counts[np.array(keep, dtype=bool)]
+
+        len_cats = np.sort(counts)
+        mean = len_cats.mean()
+        n = len(len_cats)
+        median = (len_cats[n//2 - 1] + len_cats[n//2]) / 2 if n % 2 == 0 else int(len_cats[n//2])
+        std = len_cats.std()
+
+        return {'Categories': len(cats),
+                'Most Populated': cats[0], 'Most Populated Size': int(counts[0]),
+                'Least Populated': cats[-1], 'Least Populated Size': int(counts[-1]),
+                'Mean': mean, 'Median': median, 'STD': std}
+
+    def get_dis_dict(self, dataset, attr_list, dict_type='Genetic Attributes', cache=None):
+        """
+        This function calculates the class distribution table of a list of attributes.
+        :param dataset: Class BioScan Dataset.
+        :param attr_list: Attribute names.
+        :param dict_type: Heading of the attribute column.
+        :param cache: dataset_helper.ResultCache to reuse the distribution of each attribute from. Optional.
+        :return:
+        """
 
         g_dict = {dict_type: [], 'Categories': [],
                   'Most Populated': [], 'Most Populated Size': [],
@@ -30,59 +64,58 @@ class BioScanDists:
 
         for attr in attr_list:
 
-            lst = dataset.data_list_mapping.get(attr)
-            attr_dict = dataset.make_data_dict(lst)
-            cats = list(attr_dict.keys())
-
-            if 'no_data' in cats:
-                del attr_dict['no_data']
-                cats.remove('no_data')
-
-            len_cats = sorted([len(attr_dict[c]) for c in cats])
-            mean = sum(len_cats)/len(cats)
-            n = len(len_cats)
-            median = (len_cats[n//2 - 1] + len_cats[n//2]) / 2 if n % 2 == 0 else len_cats[n//2]
-
-            variance = sum((x - mean) ** 2 for x in len_cats) / len(len_cats)
-            std = variance ** 0.5
+            if cache is not None:
+                attr_dist = cache.get_or_compute(attr, lambda: self.get_attr_dist(dataset, attr))
+            else:
+                attr_dist = self.get_attr_dist(dataset, attr)
 
             g_dict[dict_type].append(attr)
-            g_dict['Categories'].append(len(cats))
-            g_dict['Most Populated'].append(cats[0])
-            g_dict['Most Populated Size'].append(len(attr_dict[cats[0]]))
-            g_dict['Least Populated'].append(cats[-1])
-            g_dict['Least Populated Size'].append(len(attr_dict[cats[-1]]))
-            g_dict['Mean'].append(mean)
-            g_dict['Median'].append(median)
-            g_dict['STD'].append(std)
+            for key, value in attr_dist.items():
+                g_dict[key].append(value)
 
         return g_dict
 
-    def get_dataset_distribution(self, configs, dataset):
-
-        if configs['attr_dist'] not in ['genetic', 'geographic', 'size']:
-            return
-
-        get_attr = configs['attr_dist']
+    def get_distribution_report(self, dataset, get_attr='genetic', cache=None):
+        """
+        This function calculates the class distribution table of a type of attributes.
+        :param dataset: Class BioScan Dataset.
+        :param get_attr: Type of attributes: genetic, geographic or size.
+        :param cache: dataset_helper.ResultCache to reuse the distribution of each attribute from. Optional.
+        :return: Dictionary of the number of samples and the distribution table.
+        """
 
         if get_attr == 'genetic':
-            list_attr = list({**dataset.taxonomy_groups_list_dict}.keys())
+            list_attr = list(dataset.taxonomy_groups_list_dict.keys())
             list_attr.append('dna_bin')
         elif get_attr == 'geographic':
-            list_attr = list({**dataset.geographic_list_dict}.keys())
+            list_attr = list(dataset.geographic_list_dict.keys())
         elif get_attr == 'size':
-            list_attr = list({**dataset.size_list_dict}.keys())
+            list_attr = list(dataset.size_list_dict.keys())
         else:
             raise ValueError('Statistic type is NOT available!')
 
-        g_dict = self.get_dis_dict(dataset, list_attr, dict_type=f'{get_attr.capitalize()} Class Distribution')
+        g_dict = self.get_dis_dict(dataset, list_attr, dict_type=f'{get_attr.capitalize()} Class Distribution',
+                                   cache=cache)
+        return {'n_samples': len(dataset.index), 'table': g_dict}
+
+    def print_report(self, report, get_attr='genetic'):
+
         # Print category distribution
-        scale = int(math.floor(math.log10(abs(len(dataset.index)))))
+        n_samples = report['n_samples']
+        scale = int(math.floor(math.log10(abs(n_samples))))
         s = 'k' if scale < 6 else 'M'
-        n = round(len(dataset.index) / 10 ** scale)
+        n = round(n_samples / 10 ** scale)
         title = f"{get_attr.capitalize()} Category Distribution of the BIOSCAN-{n}{s} Insect dataset "
-        title += f"having {len(dataset.index)} specimens"
-        self.print_table(g_dict, title, print_table=True)
+        title += f"having {n_samples} specimens"
+        self.print_table(report['table'], title, print_table=True)
+
+    def get_dataset_distribution(self, configs, dataset, cache=None):
+
+        if configs['attr_dist'] not in ['genetic', 'geographic', 'size']:
+            return
+
+        report = self.get_distribution_report(dataset, get_attr=configs['attr_dist'], cache=cache)
+        self.print_report(report, get_attr=configs['attr_dist'])
 
 
 def show_distributions(configs):
@@ -92,11 +125,21 @@ def show_distributions(configs):
     :return:
     """
 
-    if not configs['attr_dist']:
+    if not configs['attr_dist'] or configs['attr_dist'] not in ['genetic', 'geographic', 'size']:
         return
 
-    dataset = BioScan()
-    dataset.get_statistics(configs["metadata"], level_name=configs["level_name"])
-
+    cache = dataset_helper.ResultCache(configs['metadata'], 'distribution', configs['level_name'],
+                                       cache_dir=None if configs.get('stats_cache') else False,
+                                       engine=configs.get('csv_engine'))
     vis_dists = BioScanDists()
-    vis_dists.get_dataset_distribution(configs, dataset)
+
+    def compute_report():
+        dataset = BioScan()
+        dataset.get_statistics(configs["metadata"], level_name=configs["level_name"],
+                               consumer=f"distribution.{configs['attr_dist']}", engine=configs.get('csv_engine'),
+                               index_cache=configs.get('index_cache', True))
+        return vis_dists.get_distribution_report(dataset, get_attr=configs['attr_dist'], cache=cache)
+
+    report = cache.get_or_compute(f"report.{configs['attr_dist']}", compute_report)
+
+    vis_dists.print_report(report, get_attr=configs['attr_dist'])
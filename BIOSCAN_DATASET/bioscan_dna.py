@@ -0,0 +1,656 @@
+"""
+DNA barcode encoding for BIOSCAN-5M.
+
+Barcodes are tokenized for a whole column at once with NumPy, instead of one
+string at a time in Python. They can also be stored packed at 2 bits per
+nucleotide, see :class:`PackedBarcodes`.
+"""
+
+import itertools
+import json
+import os
+import warnings
+
+import numpy as np
+
+from bioscan_table import CategoricalColumn, StringColumn, load_array, mix64, ragged_arange, save_array
+
+NUCLEOTIDES = "ACGT"
+SPECIAL_TOKENS = ["[PAD]", "[UNK]"]
+PAD_TOKEN = 0
+UNK_TOKEN = 1
+
+TOKENIZERS = ("char", "kmer", "kmer_nonoverlap")
+
+# Map from ASCII code to nucleotide index, or -1 for anything other than A/C/G/T
+_NUCLEOTIDE_LUT = np.full(256, -1, dtype=np.int8)
+for _i, _c in enumerate(NUCLEOTIDES):
+    _NUCLEOTIDE_LUT[ord(_c)] = _i
+    _NUCLEOTIDE_LUT[ord(_c.lower())] = _i
+
+# Marks positions past the end of a barcode
+_PAD_CODE = -2
+
+# Map from ASCII code to 2-bit code for packing. Anything other than A/C/G/T
+# (including lowercase, N, and IUPAC ambiguity codes) is stored as an exception.
+_PACK_EXCEPTION = 255
+_PACK_LUT = np.full(256, _PACK_EXCEPTION, dtype=np.uint8)
+for _i, _c in enumerate(NUCLEOTIDES):
+    _PACK_LUT[ord(_c)] = _i
+_UNPACK_LUT = np.frombuffer(NUCLEOTIDES.encode("ascii"), dtype=np.uint8)
+
+PACKED_CACHE_VERSION = 1
+
+
+def _get_kmer_params(tokenizer, k):
+    """Get the k-mer size and stride of a tokenizer."""
+    if tokenizer == "char":
+        return 1, 1
+    if tokenizer == "kmer":
+        return k, 1
+    if tokenizer == "kmer_nonoverlap":
+        return k, k
+    raise ValueError(f"Unfamiliar tokenizer: {tokenizer}")
+
+
+def barcode_vocabulary(tokenizer="kmer", k=6):
+    """Get the vocabulary of a tokenizer.
+
+    Parameters
+    ----------
+    tokenizer : str, default="kmer"
+        The tokenization scheme. One of: ``"char"`` (one token per
+        nucleotide), ``"kmer"`` (overlapping k-mers, with stride 1), or
+        ``"kmer_nonoverlap"`` (non-overlapping k-mers, with stride ``k``).
+    k : int, default=6
+        The k-mer size. Ignored for ``tokenizer="char"``.
+
+    Returns
+    -------
+    list[str]
+        The token strings, in order of their token ids. Ids ``0`` and ``1``
+        are the padding and unknown tokens; k-mers containing anything other
+        than A, C, G or T are mapped to the unknown token.
+    """
+    k, _ = _get_kmer_params(tokenizer, k)
+    return SPECIAL_TOKENS + ["".join(kmer) for kmer in itertools.product(NUCLEOTIDES, repeat=k)]
+
+
+def token_dtype(tokenizer="kmer", k=6):
+    """Get the smallest integer dtype which can hold the token ids of a tokenizer."""
+    vocab_size = len(SPECIAL_TOKENS) + 4 ** _get_kmer_params(tokenizer, k)[0]
+    if vocab_size <= np.iinfo(np.uint8).max + 1:
+        return np.dtype(np.uint8)
+    if vocab_size <= np.iinfo(np.int16).max + 1:
+        return np.dtype(np.int16)
+    return np.dtype(np.int32)
+
+
+def n_tokens(n_nucleotides, tokenizer="kmer", k=6):
+    """Get the number of tokens a barcode of a given length is encoded as."""
+    k, stride = _get_kmer_params(tokenizer, k)
+    return np.maximum(0, (np.asarray(n_nucleotides) - k) // stride + 1)
+
+
+def _as_string_column(barcodes, rows=None):
+    """Get the barcodes as a :class:`StringColumn`, and the positions of ``rows`` in it."""
+    if rows is None:
+        rows = np.arange(len(barcodes))
+    rows = np.asarray(rows, dtype=np.int64)
+    if not isinstance(barcodes, CategoricalColumn):
+        return barcodes, rows
+    # Dictionary-encoded barcodes, with an extra entry for missing values
+    strings = StringColumn.from_strings(list(barcodes.categories) + [None])
+    codes = np.asarray(barcodes.codes)[rows].astype(np.int64)
+    codes[codes < 0] = len(barcodes.categories)
+    return strings, codes
+
+
+def _encode_chunk(data, offsets, lengths, width, k, stride, dtype):
+    """Tokenize a contiguous chunk of barcodes into a padded array."""
+    n = len(lengths)
+    codes = np.full((n, width), _PAD_CODE, dtype=np.int8)
+    row_idx = np.repeat(np.arange(n), lengths)
+    col_idx = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    codes[row_idx, col_idx] = _NUCLEOTIDE_LUT[data[np.repeat(offsets[:-1], lengths) + col_idx]]
+
+    starts = np.arange(0, width - k + 1, stride)
+    tokens = np.zeros((n, len(starts)), dtype=np.int64)
+    is_unknown = np.zeros((n, len(starts)), dtype=bool)
+    is_padding = np.zeros((n, len(starts)), dtype=bool)
+    for j in range(k):
+        window = codes[:, starts + j]
+        tokens = tokens * 4 + np.maximum(window, 0)
+        is_unknown |= window == -1
+        is_padding |= window == _PAD_CODE
+    tokens += len(SPECIAL_TOKENS)
+    tokens[is_unknown] = UNK_TOKEN
+    tokens[is_padding] = PAD_TOKEN
+    return tokens.astype(dtype)
+
+
+def encode_barcodes(
+    barcodes,
+    rows=None,
+    tokenizer="kmer",
+    k=6,
+    max_nucleotides=None,
+    out=None,
+    chunk_size=8192,
+):
+    """Tokenize a column of DNA barcodes into a padded array of token ids.
+
+    Parameters
+    ----------
+    barcodes : bioscan_table.StringColumn or bioscan_table.CategoricalColumn
+        The DNA barcodes.
+    rows : numpy.ndarray, optional
+        Positions of the barcodes to encode. By default, all barcodes are
+        encoded.
+    tokenizer : str, default="kmer"
+        The tokenization scheme. One of: ``"char"`` (one token per
+        nucleotide), ``"kmer"`` (overlapping k-mers, with stride 1), or
+        ``"kmer_nonoverlap"`` (non-overlapping k-mers, with stride ``k``).
+        See :func:`barcode_vocabulary` for the token ids.
+    k : int, default=6
+        The k-mer size. Ignored for ``tokenizer="char"``.
+    max_nucleotides : int, optional
+        Maximum number of nucleotides of each barcode to encode.
+    out : numpy.ndarray, optional
+        Array to write the output into, such as a memory-mapped file.
+    chunk_size : int, default=8192
+        Number of barcodes to encode at once, which bounds memory usage.
+
+    Returns
+    -------
+    numpy.ndarray
+        Array of shape ``(n_barcodes, max_tokens)``, padded with
+        :data:`PAD_TOKEN`. Missing barcodes are encoded as all padding.
+    """
+    k, stride = _get_kmer_params(tokenizer, k)
+    barcodes, rows = _as_string_column(barcodes, rows)
+    lengths = np.asarray(barcodes.offsets[rows + 1] - barcodes.offsets[rows])
+    lengths[np.asarray(barcodes.mask)[rows]] = 0
+    if max_nucleotides is not None:
+        lengths = np.minimum(lengths, max_nucleotides)
+    width = int(lengths.max()) if len(lengths) else 0
+    if max_nucleotides is not None:
+        width = max_nucleotides
+    dtype = token_dtype(tokenizer, k)
+    if out is None:
+        out = np.empty((len(rows), int(n_tokens(width, tokenizer, k))), dtype=dtype)
+    for start in range(0, len(rows), chunk_size):
+        chunk = barcodes.take(rows[start : start + chunk_size])
+        # Pass the original offsets, since lengths may have been truncated
+        out[start : start + len(chunk)] = _encode_chunk(
+            np.asarray(chunk.data),
+            np.asarray(chunk.offsets),
+            lengths[start : start + chunk_size],
+            width,
+            k,
+            stride,
+            dtype,
+        )
+    return out
+
+
+def load_barcode_tokens(barcodes, cache_dir=None, tokenizer="kmer", k=6, max_nucleotides=None):
+    """Tokenize all the barcodes in a column, caching the result on disk.
+
+    Parameters
+    ----------
+    barcodes : bioscan_table.StringColumn or bioscan_table.CategoricalColumn
+        The DNA barcodes.
+    cache_dir : str, optional
+        Directory to cache the tokens in, which should be specific to the
+        metadata file (such as ``MetadataTable.cache_dir``). If ``None``, the
+        tokens are computed in memory.
+    tokenizer : str, default="kmer"
+        The tokenization scheme. See :func:`encode_barcodes`.
+    k : int, default=6
+        The k-mer size. Ignored for ``tokenizer="char"``.
+    max_nucleotides : int, optional
+        Maximum number of nucleotides of each barcode to encode.
+
+    Returns
+    -------
+    numpy.ndarray
+        Token ids of every barcode in the column, of shape
+        ``(n_barcodes, max_tokens)``. Memory-mapped if ``cache_dir`` is set
+        and the cache could be written.
+    """
+    if cache_dir is None:
+        return encode_barcodes(barcodes, tokenizer=tokenizer, k=k, max_nucleotides=max_nucleotides)
+    k, _ = _get_kmer_params(tokenizer, k)
+    path = os.path.join(cache_dir, "dna_tokens", f"{tokenizer}_k{k}_max{max_nucleotides}.npy")
+    if not os.path.isfile(path):
+        strings, rows = _as_string_column(barcodes)
+        lengths = np.asarray(strings.lengths)[rows]
+        width = int(lengths.max()) if len(lengths) else 0
+        if max_nucleotides is not None:
+            width = max_nucleotides
+        shape = (len(barcodes), int(n_tokens(width, tokenizer, k)))
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=token_dtype(tokenizer, k), shape=shape)
+            encode_barcodes(barcodes, tokenizer=tokenizer, k=k, max_nucleotides=max_nucleotides, out=out)
+            out.flush()
+            del out
+            os.replace(tmp_path, path)
+        except OSError as err:
+            warnings.warn(f"Unable to write barcode tokens to {os.path.dirname(path)}: {err}", stacklevel=2)
+            if os.path.isfile(tmp_path):
+                os.remove(tmp_path)
+            return encode_barcodes(barcodes, tokenizer=tokenizer, k=k, max_nucleotides=max_nucleotides)
+    return np.load(path, mmap_mode="r")
+
+
+def _segment_sums(values, counts):
+    """Sum consecutive segments of uint64 values, wrapping on overflow."""
+    totals = np.zeros(len(values) + 1, dtype=np.uint64)
+    np.cumsum(values, out=totals[1:])
+    ends = np.cumsum(counts)
+    return totals[ends] - totals[ends - counts]
+
+
+class PackedBarcodes:
+    """
+    DNA barcodes packed at 2 bits per nucleotide.
+
+    A, C, G and T are packed four to a byte, and each barcode starts on a
+    byte boundary. Any other character (N, IUPAC ambiguity codes, lowercase,
+    gaps) is recorded in a sparse list of exceptions, with its position and
+    byte value, so the packing is lossless. Barcodes can be hashed and
+    compared without unpacking them.
+
+    The column has the same ``offsets`` and ``mask`` as the
+    :class:`bioscan_table.StringColumn` it was packed from, so can be used in
+    its place.
+
+    Parameters
+    ----------
+    packed : numpy.ndarray
+        The packed nucleotides, as uint8.
+    offsets : numpy.ndarray
+        Start of each barcode in the unpacked sequence of all barcodes, with
+        one extra entry for the total length.
+    byte_offsets : numpy.ndarray
+        Start of each barcode in ``packed``, with one extra entry for the
+        total size.
+    exception_positions : numpy.ndarray
+        Sorted positions of the exceptions in the unpacked sequence.
+    exception_values : numpy.ndarray
+        The byte value of each exception.
+    mask : numpy.ndarray
+        Boolean array, ``True`` where the barcode is missing.
+    """
+
+    kind = "packed_dna"
+    array_names = ("packed", "offsets", "byte_offsets", "exception_positions", "exception_values", "mask")
+
+    def __init__(self, packed, offsets, byte_offsets, exception_positions, exception_values, mask):
+        self.packed = packed
+        self.offsets = offsets
+        self.byte_offsets = byte_offsets
+        self.exception_positions = exception_positions
+        self.exception_values = exception_values
+        self.mask = mask
+
+    @classmethod
+    def from_column(cls, barcodes, chunk_size=65536):
+        """Pack a column of barcodes.
+
+        Parameters
+        ----------
+        barcodes : bioscan_table.StringColumn or bioscan_table.CategoricalColumn
+            The DNA barcodes.
+        chunk_size : int, default=65536
+            Number of barcodes to pack at once, which bounds memory usage.
+
+        Returns
+        -------
+        PackedBarcodes
+        """
+        strings, rows = _as_string_column(barcodes)
+        if not np.array_equal(rows, np.arange(len(strings))):
+            strings = strings.take(rows)
+        offsets = np.asarray(strings.offsets, dtype=np.int64)
+        lengths = np.diff(offsets)
+        n_bytes = (lengths + 3) // 4
+        byte_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(n_bytes, out=byte_offsets[1:])
+        packed = np.empty(byte_offsets[-1], dtype=np.uint8)
+        exception_positions = []
+        exception_values = []
+        for start in range(0, len(lengths), chunk_size):
+            stop = min(start + chunk_size, len(lengths))
+            data = np.asarray(strings.data[offsets[start] : offsets[stop]])
+            codes = _PACK_LUT[data]
+            is_exception = np.flatnonzero(codes == _PACK_EXCEPTION)
+            exception_positions.append(is_exception + offsets[start])
+            exception_values.append(data[is_exception])
+            codes[is_exception] = 0
+            # Lay the codes out with each barcode padded to a whole number of bytes
+            chunk_lengths = lengths[start:stop]
+            padded = np.zeros(4 * (byte_offsets[stop] - byte_offsets[start]), dtype=np.uint8)
+            chunk_byte_starts = byte_offsets[start:stop] - byte_offsets[start]
+            padded[np.repeat(4 * chunk_byte_starts, chunk_lengths) + ragged_arange(chunk_lengths)] = codes
+            quads = padded.reshape(-1, 4)
+            packed[byte_offsets[start] : byte_offsets[stop]] = (
+                (quads[:, 0] << 6) | (quads[:, 1] << 4) | (quads[:, 2] << 2) | quads[:, 3]
+            )
+        return cls(
+            packed,
+            offsets,
+            byte_offsets,
+            np.concatenate(exception_positions) if exception_positions else np.zeros(0, dtype=np.int64),
+            np.concatenate(exception_values) if exception_values else np.zeros(0, dtype=np.uint8),
+            np.asarray(strings.mask, dtype=bool),
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        """The number of nucleotides in each barcode."""
+        return np.diff(self.offsets)
+
+    @property
+    def nbytes(self):
+        """The total size of the arrays, in bytes."""
+        return sum(np.asarray(array).nbytes for array in self.arrays().values())
+
+    def _exception_range(self, starts, stops):
+        """Get the indices of the exceptions within ranges of the unpacked sequence."""
+        lo = np.searchsorted(self.exception_positions, starts)
+        counts = np.searchsorted(self.exception_positions, stops) - lo
+        return np.repeat(lo, counts) + ragged_arange(counts), counts
+
+    def unpack(self, indices=None):
+        """Unpack barcodes into a :class:`bioscan_table.StringColumn`.
+
+        Parameters
+        ----------
+        indices : numpy.ndarray, optional
+            Positions of the barcodes to unpack. By default, all barcodes are
+            unpacked.
+
+        Returns
+        -------
+        bioscan_table.StringColumn
+        """
+        if indices is None:
+            indices = np.arange(len(self))
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        starts = np.asarray(self.offsets[indices])
+        lengths = np.asarray(self.offsets[indices + 1]) - starts
+        byte_starts = np.asarray(self.byte_offsets[indices])
+        n_bytes = np.asarray(self.byte_offsets[indices + 1]) - byte_starts
+        packed = np.asarray(self.packed[np.repeat(byte_starts, n_bytes) + ragged_arange(n_bytes)])
+        codes = np.stack([packed >> 6, (packed >> 4) & 3, (packed >> 2) & 3, packed & 3], axis=-1).reshape(-1)
+        out_offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=out_offsets[1:])
+        padded_starts = 4 * (np.cumsum(n_bytes) - n_bytes)
+        data = _UNPACK_LUT[codes[np.repeat(padded_starts, lengths) + ragged_arange(lengths)]]
+        # Patch in the exceptions
+        exceptions, counts = self._exception_range(starts, starts + lengths)
+        if len(exceptions):
+            positions = np.asarray(self.exception_positions[exceptions]) + np.repeat(out_offsets[:-1] - starts, counts)
+            data[positions] = self.exception_values[exceptions]
+        return StringColumn(data, out_offsets, np.asarray(self.mask)[indices])
+
+    def take(self, indices):
+        """Unpack a subset of the barcodes into a new, contiguous :class:`bioscan_table.StringColumn`."""
+        return self.unpack(indices)
+
+    def __getitem__(self, index):
+        if self.mask[index]:
+            return np.nan
+        return self.unpack([index]).get_bytes(0).decode("utf-8")
+
+    def to_numpy(self, indices=None):
+        """Unpack the barcodes into an object array of strings, with NaN for missing values."""
+        return self.unpack(indices).to_numpy()
+
+    def to_pandas(self, indices=None):
+        return self.to_numpy(indices)
+
+    def _trailing_n_counts(self, indices, lengths):
+        """Count the Ns at the end of the first ``lengths`` nucleotides of each barcode."""
+        starts = np.asarray(self.offsets[indices])
+        exceptions, counts = self._exception_range(starts, starts + lengths)
+        if not len(exceptions):
+            return np.zeros(len(indices), dtype=np.int64)
+        group = np.repeat(np.arange(len(indices)), counts)
+        is_n = np.asarray(self.exception_values[exceptions]) == ord("N")
+        # Number of exceptions, and of non-N exceptions, after each one in the same barcode
+        n_after = np.repeat(np.cumsum(counts), counts) - 1 - np.arange(len(exceptions))
+        not_n = np.cumsum(~is_n)
+        not_n_after = not_n[np.repeat(np.cumsum(counts), counts) - 1] - not_n
+        positions = np.asarray(self.exception_positions[exceptions])
+        # An N is trailing if the exceptions after it are all Ns, filling the end of the barcode
+        ends = starts + lengths
+        trailing = is_n & (not_n_after == 0) & (positions == ends[group] - 1 - n_after)
+        return np.bincount(group[trailing], minlength=len(indices))
+
+    def hash64(self, indices=None, max_length=None, rstrip_n=False, chunk_size=65536):
+        """Hash barcodes to 64-bit integers, without unpacking them.
+
+        Equal barcodes always have equal hashes. Distinct barcodes collide
+        with probability of about ``2**-64`` per pair.
+
+        Parameters
+        ----------
+        indices : numpy.ndarray, optional
+            Positions of the barcodes to hash. By default, all barcodes are
+            hashed.
+        max_length : int, optional
+            Only hash the first ``max_length`` nucleotides of each barcode.
+        rstrip_n : bool, default=False
+            Whether to ignore Ns at the end of each barcode (after truncating
+            to ``max_length``).
+        chunk_size : int, default=65536
+            Number of barcodes to hash at once, which bounds memory usage.
+
+        Returns
+        -------
+        numpy.ndarray
+            The uint64 hash of each barcode. Missing barcodes all share the
+            same hash, which is distinct from that of the empty barcode.
+        """
+        if indices is None:
+            indices = np.arange(len(self))
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+        out = np.empty(len(indices), dtype=np.uint64)
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start : start + chunk_size]
+            lengths = np.asarray(self.offsets[chunk + 1]) - np.asarray(self.offsets[chunk])
+            if max_length is not None:
+                lengths = np.minimum(lengths, max_length)
+            if rstrip_n:
+                lengths = lengths - self._trailing_n_counts(chunk, lengths)
+            # Hash the whole bytes, with the unused bits of the last byte zeroed
+            n_bytes = (lengths + 3) // 4
+            byte_positions = ragged_arange(n_bytes)
+            values = np.asarray(self.packed[np.repeat(self.byte_offsets[chunk], n_bytes) + byte_positions])
+            is_last = byte_positions == np.repeat(n_bytes - 1, n_bytes)
+            n_spare = np.where(is_last, np.repeat(4 * n_bytes - lengths, n_bytes), 0)
+            values = values & (0xFF << (2 * n_spare)).astype(np.uint8)
+            keys = values.astype(np.uint64) | (byte_positions.astype(np.uint64) << np.uint64(8))
+            h = _segment_sums(mix64(keys), n_bytes)
+            # Add the exceptions, by their position relative to the start of the barcode
+            starts = np.asarray(self.offsets[chunk])
+            exceptions, counts = self._exception_range(starts, starts + lengths)
+            if len(exceptions):
+                positions = np.asarray(self.exception_positions[exceptions]) - np.repeat(starts, counts)
+                keys = positions.astype(np.uint64) << np.uint64(8)
+                keys |= np.asarray(self.exception_values[exceptions]).astype(np.uint64)
+                h += mix64(_segment_sums(mix64(keys ^ np.uint64(0x5851F42D4C957F2D)), counts))
+            h = mix64(h ^ mix64(lengths.astype(np.uint64)))
+            h[np.asarray(self.mask)[chunk]] = np.uint64(0x9E3779B97F4A7C15)
+            out[start : start + len(chunk)] = h
+        return out
+
+    def equals(self, i, j):
+        """Test whether two barcodes are equal, without unpacking them."""
+        if self.mask[i] or self.mask[j]:
+            return bool(self.mask[i] and self.mask[j])
+        if self.offsets[i + 1] - self.offsets[i] != self.offsets[j + 1] - self.offsets[j]:
+            return False
+        if not np.array_equal(
+            self.packed[self.byte_offsets[i] : self.byte_offsets[i + 1]],
+            self.packed[self.byte_offsets[j] : self.byte_offsets[j + 1]],
+        ):
+            return False
+        exceptions_i, _ = self._exception_range([self.offsets[i]], [self.offsets[i + 1]])
+        exceptions_j, _ = self._exception_range([self.offsets[j]], [self.offsets[j + 1]])
+        return np.array_equal(
+            self.exception_positions[exceptions_i] - self.offsets[i],
+            self.exception_positions[exceptions_j] - self.offsets[j],
+        ) and np.array_equal(self.exception_values[exceptions_i], self.exception_values[exceptions_j])
+
+    def isin(self, values):
+        """Test which barcodes are in a set of strings.
+
+        Parameters
+        ----------
+        values : Iterable[str]
+            The barcodes to match against.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask, ``True`` where the barcode is one of ``values``.
+        """
+        values = [v for v in values if isinstance(v, str)]
+        query = PackedBarcodes.from_column(StringColumn.from_strings(values))
+        out = np.isin(self.hash64(), query.hash64())
+        # Confirm the matches, in case of hash collisions
+        candidates = np.flatnonzero(out)
+        out[candidates] = np.isin(self.to_numpy(candidates), values)
+        return out
+
+    def arrays(self):
+        return {name: getattr(self, name) for name in self.array_names}
+
+
+def load_packed_barcodes(barcodes, cache_dir=None):
+    """Pack a column of barcodes, caching the result on disk.
+
+    Parameters
+    ----------
+    barcodes : bioscan_table.StringColumn or bioscan_table.CategoricalColumn
+        The DNA barcodes.
+    cache_dir : str, optional
+        Directory to cache the packed barcodes in, which should be specific
+        to the metadata file (such as ``MetadataTable.cache_dir``). If
+        ``None``, the barcodes are packed in memory.
+
+    Returns
+    -------
+    PackedBarcodes
+        The packed barcodes. Memory-mapped if ``cache_dir`` is set.
+    """
+    if cache_dir is None:
+        return PackedBarcodes.from_column(barcodes)
+    packed_dir = os.path.join(cache_dir, "dna_packed")
+    header_path = os.path.join(packed_dir, "header.json")
+    header = None
+    if os.path.isfile(header_path):
+        with open(header_path) as f:
+            header = json.load(f)
+    if header is None or header.get("version") != PACKED_CACHE_VERSION or header.get("n_rows") != len(barcodes):
+        packed = PackedBarcodes.from_column(barcodes)
+        try:
+            os.makedirs(packed_dir, exist_ok=True)
+            # Write the arrays first, and the header last
+            for key, array in packed.arrays().items():
+                save_array(os.path.join(packed_dir, f"{key}.npy"), array)
+            tmp_path = f"{header_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"version": PACKED_CACHE_VERSION, "n_rows": len(packed)}, f)
+            os.replace(tmp_path, header_path)
+        except OSError as err:
+            warnings.warn(f"Unable to write packed barcodes to {packed_dir}: {err}", stacklevel=2)
+            return packed
+    return PackedBarcodes(
+        **{name: load_array(os.path.join(packed_dir, f"{name}.npy")) for name in PackedBarcodes.array_names}
+    )
+
+
+def unique_barcode_mask(barcodes, max_length=None, rstrip_n=False, seed=0):
+    """Select one representative sample for each distinct barcode.
+
+    Barcodes are compared by their 64-bit hashes. Within each group of
+    samples with the same barcode, the sample kept is the one with the
+    smallest hash of its position, seeded by ``seed``. The choice is
+    therefore pseudo-random, but deterministic and independent of the other
+    groups, and needs no shuffle of the table.
+
+    Parameters
+    ----------
+    barcodes : PackedBarcodes
+        The DNA barcodes.
+    max_length : int, optional
+        Only compare the first ``max_length`` nucleotides of each barcode.
+    rstrip_n : bool, default=False
+        Whether to ignore Ns at the end of each barcode (after truncating to
+        ``max_length``).
+    seed : int, default=0
+        Seed for the choice of representative sample.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask, ``True`` for the sample kept for each barcode.
+    """
+    hashes = barcodes.hash64(max_length=max_length, rstrip_n=rstrip_n)
+    priority = mix64(np.arange(len(hashes), dtype=np.uint64) ^ mix64(np.uint64(seed)))
+    order = np.lexsort((priority, hashes))
+    sorted_hashes = hashes[order]
+    is_first = np.ones(len(order), dtype=bool)
+    is_first[1:] = sorted_hashes[1:] != sorted_hashes[:-1]
+    keep = np.zeros(len(order), dtype=bool)
+    keep[order[is_first]] = True
+    return keep
+
+
+def load_unique_barcode_mask(barcodes, cache_dir=None, max_length=None, rstrip_n=False, seed=0):
+    """Select one representative sample for each distinct barcode, caching the result on disk.
+
+    Parameters
+    ----------
+    barcodes : PackedBarcodes
+        The DNA barcodes.
+    cache_dir : str, optional
+        Directory to cache the mask in, which should be specific to the
+        metadata file (such as ``MetadataTable.cache_dir``). If ``None``, the
+        mask is computed in memory.
+    max_length : int, optional
+        Only compare the first ``max_length`` nucleotides of each barcode.
+    rstrip_n : bool, default=False
+        Whether to ignore Ns at the end of each barcode.
+    seed : int, default=0
+        Seed for the choice of representative sample.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask, ``True`` for the sample kept for each barcode.
+        See :func:`unique_barcode_mask`.
+    """
+    if cache_dir is None:
+        return unique_barcode_mask(barcodes, max_length=max_length, rstrip_n=rstrip_n, seed=seed)
+    mode = "rstrip_n" if rstrip_n else "base"
+    path = os.path.join(cache_dir, "dna_unique", f"{mode}_max{max_length}_seed{seed}.npy")
+    if not os.path.isfile(path):
+        keep = unique_barcode_mask(barcodes, max_length=max_length, rstrip_n=rstrip_n, seed=seed)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            save_array(path, keep)
+        except OSError as err:
+            warnings.warn(f"Unable to write unique barcode mask to {os.path.dirname(path)}: {err}", stacklevel=2)
+            return keep
+    return load_array(path)
@@ -0,0 +1,296 @@
+"""
+Minimal asyncio HTTP/1.1 client for reading images from a web server or object store.
+
+Only the standard library is used. Requests are made on a pool of persistent
+(keep-alive) connections, and many requests can be in flight at once on a
+single event loop, which runs in a background thread so the client can be
+called from synchronous code, such as a DataLoader worker.
+
+The client only issues ``GET`` requests, optionally for a byte range. Objects
+in an S3-compatible store must therefore be readable anonymously, or with
+fixed headers (e.g. a bearer token for a gateway); requests are not signed.
+"""
+
+import asyncio
+import os
+import ssl
+import threading
+from urllib.parse import urlsplit
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+class HTTPError(OSError):
+    """
+    A request was answered with an unsuccessful status code.
+
+    Parameters
+    ----------
+    url : str
+        The requested URL.
+    status : int
+        The HTTP status code of the response.
+    reason : str
+        The reason phrase of the response.
+    """
+
+    def __init__(self, url, status, reason=""):
+        super().__init__(f"HTTP {status} {reason} for {url}".replace("  ", " "))
+        self.url = url
+        self.status = status
+        self.reason = reason
+
+
+async def _read_response(reader):
+    """Read an HTTP/1.x response from a stream.
+
+    Returns
+    -------
+    status : int
+    reason : str
+    body : bytes
+    keep_alive : bool
+        Whether the connection can be reused for another request.
+    """
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError("Connection closed by the server")
+    version, status, *reason = line.decode("latin-1").rstrip("\r\n").split(" ", 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n"):
+            break
+        if not line:
+            raise ConnectionResetError("Connection closed while reading the headers")
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    connection = headers.get("connection", "").lower()
+    keep_alive = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";", 1)[0], 16)
+            if size == 0:
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        # Skip any trailers
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        keep_alive = False
+    return int(status), reason[0] if reason else "", body, keep_alive
+
+
+class ConnectionPool:
+    """
+    Pool of persistent HTTP connections, used from a single event loop.
+
+    Parameters
+    ----------
+    max_connections : int, default=16
+        Maximum number of connections open at once, over all hosts. Further
+        requests wait for a connection to be released.
+    timeout : float, default=30
+        Timeout for each request, in seconds.
+    headers : dict[str, str], optional
+        Extra headers to send with every request.
+    retries : int, default=2
+        Number of times a request is retried after a connection error or
+        timeout. Requests on a reused connection which the server has closed
+        in the meantime are retried in the same way.
+    """
+
+    def __init__(self, max_connections=16, timeout=30.0, headers=None, retries=2):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.retries = retries
+        self._idle = {}
+        self._semaphore = None
+        self._ssl_context = None
+
+    async def _connect(self, scheme, host, port):
+        ssl_context = None
+        if scheme == "https":
+            if self._ssl_context is None:
+                self._ssl_context = ssl.create_default_context()
+            ssl_context = self._ssl_context
+        return await asyncio.open_connection(host, port, ssl=ssl_context)
+
+    async def _exchange(self, key, request):
+        idle = self._idle.setdefault(key, [])
+        connection = idle.pop() if idle else await self._connect(*key)
+        reader, writer = connection
+        try:
+            writer.write(request)
+            await writer.drain()
+            status, reason, body, keep_alive = await _read_response(reader)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            idle.append(connection)
+        else:
+            writer.close()
+        return status, reason, body
+
+    async def get(self, url, byte_range=None):
+        """Get the contents of a URL.
+
+        Parameters
+        ----------
+        url : str
+            The ``http://`` or ``https://`` URL to read.
+        byte_range : tuple[int, int], optional
+            The ``(start, stop)`` positions of the bytes to read, with
+            ``stop`` exclusive. By default, the whole object is read.
+
+        Returns
+        -------
+        bytes
+        """
+        parts = urlsplit(url)
+        if parts.scheme not in DEFAULT_PORTS:
+            raise ValueError(f"Unsupported URL scheme: {url}")
+        key = (parts.scheme, parts.hostname, parts.port or DEFAULT_PORTS[parts.scheme])
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        headers = {"Host": parts.netloc, "Connection": "keep-alive", **self.headers}
+        if byte_range is not None:
+            headers["Range"] = f"bytes={byte_range[0]}-{byte_range[1] - 1}"
+        request = f"GET {target} HTTP/1.1\r\n" + "".join(f"{k}: {v}\r\n" for k, v in headers.items()) + "\r\n"
+        request = request.encode("latin-1")
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_connections)
+        async with self._semaphore:
+            for attempt in range(self.retries + 1):
+                try:
+                    status, reason, body = await asyncio.wait_for(self._exchange(key, request), self.timeout)
+                    break
+                except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                    if attempt == self.retries:
+                        raise
+        if status not in (200, 206):
+            raise HTTPError(url, status, reason)
+        if byte_range is not None and status == 200:
+            # The server ignored the range and sent the whole object
+            body = body[byte_range[0] : byte_range[1]]
+        return body
+
+    async def get_many(self, urls, byte_ranges=None):
+        """Get the contents of several URLs concurrently.
+
+        Parameters
+        ----------
+        urls : Iterable[str]
+            The URLs to read.
+        byte_ranges : Iterable[tuple[int, int] or None], optional
+            The byte range to read from each URL. See :meth:`get`.
+
+        Returns
+        -------
+        list[bytes]
+        """
+        urls = list(urls)
+        if byte_ranges is None:
+            byte_ranges = [None] * len(urls)
+        return list(await asyncio.gather(*(self.get(url, r) for url, r in zip(urls, byte_ranges))))
+
+    async def close(self):
+        """Close all idle connections."""
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, writer in connections:
+                writer.close()
+        for connections in idle.values():
+            for _, writer in connections:
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+
+
+class HTTPClient:
+    """
+    Synchronous, thread-safe interface to a :class:`ConnectionPool`.
+
+    The pool runs on an event loop in a daemon thread, which is started lazily
+    in each process, so the client can be made before DataLoader workers are
+    forked and can be pickled to spawned workers.
+
+    Parameters
+    ----------
+    max_connections : int, default=16
+        Maximum number of connections open at once, per process.
+    timeout : float, default=30
+        Timeout for each request, in seconds.
+    headers : dict[str, str], optional
+        Extra headers to send with every request.
+    retries : int, default=2
+        Number of times a request is retried after a connection error.
+    """
+
+    def __init__(self, max_connections=16, timeout=30.0, headers=None, retries=2):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.headers = dict(headers or {})
+        self.retries = retries
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._loop = None
+        self._thread = None
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("_pid", "_loop", "_thread", "_pool", "_lock"):
+            state[key] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    def _get_loop(self):
+        if self._pid != os.getpid():
+            # The event loop thread does not survive a fork, so each process starts its own
+            self._reset()
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, name="bioscan-http", daemon=True)
+                self._thread.start()
+                self._pool = ConnectionPool(self.max_connections, self.timeout, self.headers, self.retries)
+                self._loop = loop
+        return self._loop
+
+    def get(self, url, byte_range=None):
+        """Get the contents of a URL. See :meth:`ConnectionPool.get`."""
+        loop = self._get_loop()
+        return asyncio.run_coroutine_threadsafe(self._pool.get(url, byte_range), loop).result()
+
+    def get_many(self, urls, byte_ranges=None):
+        """Get the contents of several URLs concurrently. See :meth:`ConnectionPool.get_many`."""
+        loop = self._get_loop()
+        return asyncio.run_coroutine_threadsafe(self._pool.get_many(urls, byte_ranges), loop).result()
+
+    def close(self):
+        """Close the connections and stop the event loop of this process."""
+        if self._loop is None or self._pid != os.getpid():
+            return
+        loop, thread, pool = self._loop, self._thread, self._pool
+        self._reset()
+        asyncio.run_coroutine_threadsafe(pool.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
@@ -0,0 +1,1233 @@
+"""
+Alternative storage formats for the BIOSCAN-5M images.
+
+The images are distributed as millions of small JPEG files, which is slow to
+read from network filesystems and cold page caches. The writers here repackage
+the images of a :class:`~bioscan_dataloader.BIOSCAN5M` dataset into a few
+large files, and the readers serve them back, from local disk or over HTTP.
+"""
+
+import datetime
+import glob
+import io
+import json
+import mmap
+import multiprocessing
+import os
+import tarfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import PIL.Image
+from tqdm.auto import tqdm
+
+from bioscan_http import HTTPClient
+from bioscan_table import file_fingerprint
+
+SHARD_SIZE = 1_000_000_000
+SHARD_MANIFEST = "manifest.json"
+SHARD_INDEX = "index.npy"
+HDF5_GROUP = "images"
+
+
+def draft_image(image, decode_size=None):
+    """Configure a JPEG image to be decoded at a reduced resolution.
+
+    Uses the DCT scaling of libjpeg to decode the image at the smallest
+    power-of-two reduction (up to 1/8) which is no smaller than the requested
+    size. This must be called before the image data is loaded, and has no
+    effect on other image formats.
+
+    Parameters
+    ----------
+    image : PIL.Image.Image
+        The opened, but not yet loaded, image.
+    decode_size : int or tuple[int, int], optional
+        The minimum size of the decoded image. If an int, the minimum length
+        of the shorter side. If a tuple, the minimum ``(height, width)``.
+        If ``None``, the image is decoded at full resolution.
+
+    Returns
+    -------
+    PIL.Image.Image
+        The same image.
+    """
+    if decode_size is None or image.format != "JPEG":
+        return image
+    if isinstance(decode_size, int):
+        decode_size = (decode_size, decode_size)
+    height, width = decode_size
+    image.draft(image.mode, (width, height))
+    return image
+
+
+class ImageStore:
+    """
+    Base class for the image storage backends used by :class:`~bioscan_dataloader.BIOSCAN5M`.
+
+    Images are addressed by the position of their row in the metadata table.
+    Subclasses must implement :meth:`read_bytes`, or set ``encoded = False``
+    and override :meth:`open_image`.
+    """
+
+    #: Whether the store holds encoded image files, which can be read with :meth:`read_bytes`.
+    encoded = True
+    #: Minimum size to decode JPEG images at. See :func:`draft_image`.
+    decode_size = None
+
+    def read_bytes(self, row):
+        """Read the encoded image file for a row.
+
+        Parameters
+        ----------
+        row : int
+            The position of the row in the metadata table.
+
+        Returns
+        -------
+        bytes
+        """
+        raise NotImplementedError
+
+    def read_many(self, rows):
+        """Read the encoded image files for a batch of rows.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            The positions of the rows in the metadata table.
+
+        Returns
+        -------
+        list[bytes]
+        """
+        return [self.read_bytes(row) for row in rows]
+
+    def open_image(self, row):
+        """Open the image for a row.
+
+        Parameters
+        ----------
+        row : int
+            The position of the row in the metadata table.
+
+        Returns
+        -------
+        PIL.Image.Image
+        """
+        return draft_image(PIL.Image.open(io.BytesIO(self.read_bytes(row))), self.decode_size)
+
+    def open_images(self, rows):
+        """Open the images for a batch of rows.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            The positions of the rows in the metadata table.
+
+        Returns
+        -------
+        list[PIL.Image.Image]
+        """
+        return [self.open_image(row) for row in rows]
+
+
+class FileImageStore(ImageStore):
+    """
+    Images stored as individual JPEG files, as distributed.
+
+    Parameters
+    ----------
+    image_dir : str
+        The directory of the image package.
+    image_paths : bioscan_table.ImagePathIndex
+        The path to each image, relative to ``image_dir``.
+    """
+
+    def __init__(self, image_dir, image_paths):
+        self.image_dir = image_dir
+        self.image_paths = image_paths
+
+    def get_paths(self, rows):
+        return [os.path.join(self.image_dir, p) for p in self.image_paths.to_numpy(rows)]
+
+    def read_bytes(self, row):
+        with open(self.get_paths([row])[0], "rb") as f:
+            return f.read()
+
+    def open_image(self, row):
+        return draft_image(PIL.Image.open(self.get_paths([row])[0]), self.decode_size)
+
+    def open_images(self, rows):
+        return [draft_image(PIL.Image.open(path), self.decode_size) for path in self.get_paths(rows)]
+
+
+class _RowIndex:
+    """
+    Lookup from metadata row positions to the file and position holding them.
+
+    Parameters
+    ----------
+    rows : list[numpy.ndarray]
+        The metadata row positions held in each file.
+    """
+
+    def __init__(self, rows):
+        file_ids = [np.full(len(r), i, dtype=np.int16) for i, r in enumerate(rows)]
+        positions = [np.arange(len(r), dtype=np.int64) for r in rows]
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        order = np.argsort(rows, kind="stable")
+        self.rows = rows[order]
+        self.file_ids = np.concatenate(file_ids)[order] if len(rows) else np.zeros(0, dtype=np.int16)
+        self.positions = np.concatenate(positions)[order] if len(rows) else np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def lookup(self, row):
+        """Get the file index and the position within that file of a row."""
+        i = np.searchsorted(self.rows, row)
+        if i >= len(self.rows) or self.rows[i] != row:
+            raise KeyError(f"Row {row} is not in the image store")
+        return self.file_ids[i], self.positions[i]
+
+
+class HDF5ImageStore(ImageStore):
+    """
+    Images stored in HDF5 files as one concatenated blob of JPEG bytes.
+
+    The files are written by :func:`write_hdf5`. The small index arrays are
+    read when the store is created, but the files are only opened on first
+    read, separately in each process, so the store can be shared with forked
+    DataLoader workers.
+
+    Parameters
+    ----------
+    paths : str or Iterable[str]
+        The HDF5 file(s) to read from.
+    """
+
+    def __init__(self, paths):
+        import h5py
+
+        if isinstance(paths, str):
+            paths = [paths]
+        self.paths = list(paths)
+        rows, self.offsets, self.lengths = [], [], []
+        for path in self.paths:
+            with h5py.File(path, "r") as f:
+                group = f[HDF5_GROUP]
+                rows.append(group["rows"][:])
+                self.offsets.append(group["offsets"][:])
+                self.lengths.append(group["lengths"][:])
+        self.index = _RowIndex(rows)
+        self._blobs = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_blobs"] = None
+        state["_pid"] = None
+        return state
+
+    def _get_blob(self, file_id):
+        if self._pid != os.getpid():
+            # File handles must not be shared with forked processes
+            import h5py
+
+            self._blobs = [h5py.File(path, "r")[HDF5_GROUP]["jpeg"] for path in self.paths]
+            self._pid = os.getpid()
+        return self._blobs[file_id]
+
+    def read_bytes(self, row):
+        file_id, i = self.index.lookup(row)
+        offset = self.offsets[file_id][i]
+        return self._get_blob(file_id)[offset : offset + self.lengths[file_id][i]].tobytes()
+
+
+class MemmapImageStore(ImageStore):
+    """
+    Decoded images stored in a memory-mapped ``uint8`` array.
+
+    The arrays are written by :func:`write_memmap`, with shape
+    ``(n_images, height, width, 3)``, so images are served with no decoding.
+
+    Parameters
+    ----------
+    paths : str or Iterable[str]
+        The ``.npy`` file(s) to read from. Each must be accompanied by a
+        ``.rows.npy`` file holding the metadata row position of each image.
+    """
+
+    encoded = False
+
+    def __init__(self, paths):
+        if isinstance(paths, str):
+            paths = [paths]
+        self.paths = list(paths)
+        self.arrays = [np.load(path, mmap_mode="r") for path in self.paths]
+        self.index = _RowIndex([np.load(_memmap_rows_path(path)) for path in self.paths])
+
+    def read_bytes(self, row):
+        raise NotImplementedError(f"{type(self).__name__} holds decoded images, not encoded files")
+
+    def read_array(self, row):
+        """Read the decoded image for a row, as an ``(height, width, 3)`` array."""
+        file_id, i = self.index.lookup(row)
+        return np.array(self.arrays[file_id][i])
+
+    def open_image(self, row):
+        return PIL.Image.fromarray(self.read_array(row))
+
+
+class _LRUCache:
+    """In-process cache with least-recently-used eviction and a byte budget."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.entries = OrderedDict()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, row):
+        entry = self.entries.get(row)
+        if entry is None:
+            return None
+        self.entries.move_to_end(row)
+        return entry[0]
+
+    def put(self, row, value, n_bytes):
+        if n_bytes > self.max_bytes or row in self.entries:
+            return
+        self.entries[row] = (value, n_bytes)
+        self.n_bytes += n_bytes
+        while self.n_bytes > self.max_bytes:
+            _, (_, evicted_bytes) = self.entries.popitem(last=False)
+            self.n_bytes -= evicted_bytes
+
+
+class _SharedRingCache:
+    """
+    Cache held in a ring buffer of shared memory, with first-in-first-out eviction.
+
+    The buffer is an anonymous shared memory map, so it is shared with all
+    processes forked after it was created (such as DataLoader workers using
+    the default ``"fork"`` start method). Writes are serialized with a lock.
+    Reads take no lock: they are validated against the write position after
+    copying, since a reader can be overtaken by writers reusing the space.
+
+    Each entry holds a header of ``_HEADER`` int64 values (row, number of
+    bytes, and up to four further values of metadata), followed by the data.
+    """
+
+    _HEADER = 6
+
+    def __init__(self, max_bytes, n_rows):
+        self.capacity = int(max_bytes) // 8 * 8
+        self._arena = mmap.mmap(-1, max(self.capacity, 8))
+        self._meta = mmap.mmap(-1, 8 * (1 + n_rows))
+        self.arena = np.frombuffer(self._arena, dtype=np.uint8)
+        meta = np.frombuffer(self._meta, dtype=np.int64)
+        self.position = meta[:1]
+        # Position of the latest entry of each row in the stream, plus 1
+        self.slots = meta[1:]
+        self.lock = multiprocessing.Lock()
+
+    @property
+    def n_bytes(self):
+        return int(min(self.position[0], self.capacity))
+
+    def get(self, row):
+        position = self.slots[row] - 1
+        if position < 0:
+            return None
+        start = position % self.capacity
+        header = self.arena[start : start + 8 * self._HEADER].view(np.int64)
+        if header[0] != row:
+            return None
+        data_start = start + 8 * self._HEADER
+        data = self.arena[data_start : data_start + header[1]].tobytes()
+        meta = tuple(header[2:].tolist())
+        if self.position[0] > position + self.capacity:
+            # The entry was overwritten while it was being read
+            return None
+        return data, meta
+
+    def put(self, row, data, meta=()):
+        size = 8 * self._HEADER + len(data)
+        size = (size + 7) // 8 * 8
+        if size > self.capacity:
+            return
+        header = np.zeros(self._HEADER, dtype=np.int64)
+        header[0] = row
+        header[1] = len(data)
+        header[2 : 2 + len(meta)] = meta
+        with self.lock:
+            position = int(self.position[0])
+            if position % self.capacity + size > self.capacity:
+                # Not enough space before the end of the buffer, so wrap around
+                position += self.capacity - position % self.capacity
+            self.position[0] = position + size
+            start = position % self.capacity
+            self.arena[start : start + 8 * self._HEADER] = header.view(np.uint8)
+            self.arena[start + 8 * self._HEADER : start + 8 * self._HEADER + len(data)] = np.frombuffer(
+                data, dtype=np.uint8
+            )
+            self.slots[row] = position + 1
+
+
+def _n_pixels(image):
+    """Get the number of bytes of the decoded pixels of an image."""
+    return image.width * image.height * len(image.getbands())
+
+
+class CachedImageStore(ImageStore):
+    """
+    Image store wrapper which caches images in memory, up to a byte budget.
+
+    Parameters
+    ----------
+    store : ImageStore
+        The image store to cache.
+    max_bytes : int
+        The maximum total size of the cached images, in bytes.
+    cache_type : str, default="bytes"
+        What to cache. One of: ``"bytes"`` (the encoded image files, which
+        must be decoded on each access), or ``"decoded"`` (the decoded pixels).
+    shared : bool, default=False
+        Whether to hold the cache in shared memory, so all DataLoader workers
+        forked after the store is created share one copy of it. A shared cache
+        evicts the oldest entries first, instead of the least recently used.
+    n_rows : int, optional
+        The number of rows in the metadata table. Required if ``shared=True``.
+
+    Attributes
+    ----------
+    hits : int
+        Number of images served from the cache by this process.
+    misses : int
+        Number of images read from the underlying store by this process.
+    """
+
+    def __init__(self, store, max_bytes, cache_type="bytes", shared=False, n_rows=None):
+        if cache_type not in ("bytes", "decoded"):
+            raise ValueError(f"Unfamiliar cache_type value: {cache_type}")
+        if cache_type == "bytes" and not store.encoded:
+            raise ValueError(f"Can not cache encoded bytes of {type(store).__name__}")
+        self.store = store
+        self.encoded = store.encoded and cache_type == "bytes"
+        self.max_bytes = max_bytes
+        self.cache_type = cache_type
+        self.shared = shared
+        if shared:
+            if n_rows is None:
+                raise ValueError("n_rows must be given for a shared cache")
+            self.cache = _SharedRingCache(max_bytes, n_rows)
+        else:
+            self.cache = _LRUCache(max_bytes)
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def decode_size(self):
+        return self.store.decode_size
+
+    @decode_size.setter
+    def decode_size(self, decode_size):
+        self.store.decode_size = decode_size
+
+    def stats(self):
+        """Get the cache statistics.
+
+        Returns
+        -------
+        dict
+            The number of hits and misses in this process, and the number of
+            bytes held in the cache.
+        """
+        return {"hits": self.hits, "misses": self.misses, "n_bytes": self.cache.n_bytes, "max_bytes": self.max_bytes}
+
+    def _get(self, row):
+        value = self.cache.get(row)
+        if value is None or not self.shared:
+            return value
+        data, meta = value
+        if self.cache_type == "bytes":
+            return data
+        shape = meta[1 : 1 + meta[0]]
+        return PIL.Image.fromarray(np.frombuffer(data, dtype=np.uint8).reshape(shape))
+
+    def _put(self, row, value):
+        if self.cache_type == "bytes":
+            if self.shared:
+                self.cache.put(row, value)
+            else:
+                self.cache.put(row, value, len(value))
+        elif self.shared:
+            array = np.asarray(value)
+            self.cache.put(row, array.tobytes(), (array.ndim,) + array.shape)
+        else:
+            value.load()
+            self.cache.put(row, value, _n_pixels(value))
+
+    def read_bytes(self, row):
+        return self.read_many([row])[0]
+
+    def read_many(self, rows):
+        if self.cache_type != "bytes":
+            return self.store.read_many(rows)
+        out = [self._get(row) for row in rows]
+        missing = [i for i, value in enumerate(out) if value is None]
+        if missing:
+            for i, data in zip(missing, self.store.read_many([rows[i] for i in missing])):
+                self._put(rows[i], data)
+                out[i] = data
+        self.hits += len(rows) - len(missing)
+        self.misses += len(missing)
+        return out
+
+    def open_images(self, rows):
+        if self.cache_type == "bytes":
+            return [draft_image(PIL.Image.open(io.BytesIO(data)), self.decode_size) for data in self.read_many(rows)]
+        out = [self._get(row) for row in rows]
+        missing = [i for i, value in enumerate(out) if value is None]
+        if missing:
+            for i, image in zip(missing, self.store.open_images([rows[i] for i in missing])):
+                self._put(rows[i], image)
+                out[i] = image
+        self.hits += len(rows) - len(missing)
+        self.misses += len(missing)
+        # Copy the images, so transforms can not alter the cached version
+        return [image.copy() for image in out]
+
+    def open_image(self, row):
+        return self.open_images([row])[0]
+
+
+class PrefetchingImageStore(ImageStore):
+    """
+    Image store wrapper which reads image files concurrently with a pool of threads.
+
+    On storage with a high latency per file, such as a network filesystem,
+    reading the images of a batch one after another leaves the process mostly
+    waiting. This store reads all the images of a batch at once on a pool of
+    threads, and decodes them from memory once they have arrived. Images
+    which will be needed soon can also be requested ahead of time with
+    :meth:`prefetch`, so they are read in the background.
+
+    The thread pool is created lazily in each process, so the store can be
+    made before DataLoader workers are started.
+
+    Parameters
+    ----------
+    store : ImageStore
+        The image store to read from. Must hold encoded image files.
+    num_threads : int, default=8
+        Number of threads reading images in each process.
+    depth : int, optional
+        Maximum number of images requested by :meth:`prefetch` which can be
+        pending, read or being read, at once. Default is ``4 * num_threads``.
+        Images needed by a batch are always read, regardless of this limit.
+    """
+
+    def __init__(self, store, num_threads=8, depth=None):
+        if not store.encoded:
+            raise ValueError(f"The wrapped store must return encoded image bytes, but {type(store).__name__} does not")
+        self.store = store
+        self.num_threads = num_threads
+        self.depth = 4 * num_threads if depth is None else depth
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._pool = None
+        self._lock = threading.Lock()
+        self._pending = OrderedDict()
+        self.n_reads = 0
+        self.n_prefetch_hits = 0
+        self.bytes_read = 0
+        self.bytes_in_flight = 0
+        self.max_bytes_in_flight = 0
+        self.wait_time = 0.0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for key in ("_pool", "_lock", "_pending"):
+            state[key] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._reset()
+
+    @property
+    def decode_size(self):
+        return self.store.decode_size
+
+    @decode_size.setter
+    def decode_size(self, decode_size):
+        self.store.decode_size = decode_size
+
+    def _get_pool(self):
+        if self._pid != os.getpid():
+            # Threads do not survive a fork, so each process starts its own pool
+            self._reset()
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(self.num_threads, thread_name_prefix="bioscan-image")
+        return self._pool
+
+    def _read(self, row):
+        data = self.store.read_bytes(row)
+        with self._lock:
+            self.n_reads += 1
+            self.bytes_read += len(data)
+            self.bytes_in_flight += len(data)
+            self.max_bytes_in_flight = max(self.max_bytes_in_flight, self.bytes_in_flight)
+        return data
+
+    def stats(self):
+        """Get the reader statistics for this process.
+
+        Returns
+        -------
+        dict
+            The number of images and bytes read, the number of images served
+            from a prefetch, the number of images requested but not yet used
+            and the bytes of those which have been read (``"bytes_in_flight"``),
+            the peak of the latter, and the total time spent waiting for reads.
+        """
+        with self._lock:
+            return {
+                "n_reads": self.n_reads,
+                "bytes_read": self.bytes_read,
+                "n_prefetch_hits": self.n_prefetch_hits,
+                "n_pending": len(self._pending),
+                "bytes_in_flight": self.bytes_in_flight,
+                "max_bytes_in_flight": self.max_bytes_in_flight,
+                "wait_time": self.wait_time,
+            }
+
+    def prefetch(self, rows):
+        """Start reading images in the background, up to the prefetch depth.
+
+        When the prefetch depth is reached, the images requested longest ago
+        which have not been used are discarded, to make room for the first
+        ``depth`` of ``rows``.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            The positions of the rows in the metadata table, in the order they
+            will be needed.
+        """
+        pool = self._get_pool()
+        for row in rows[: self.depth]:
+            if row in self._pending:
+                self._pending.move_to_end(row)
+                continue
+            if len(self._pending) >= self.depth:
+                _, future = self._pending.popitem(last=False)
+                if not future.cancel():
+                    future.add_done_callback(self._discard)
+            self._pending[row] = pool.submit(self._read, row)
+
+    def _discard(self, future):
+        # Release the bytes of an image read ahead of time which will not be used
+        if future.exception() is None:
+            with self._lock:
+                self.bytes_in_flight -= len(future.result())
+
+    def read_many(self, rows):
+        pool = self._get_pool()
+        futures = []
+        for row in rows:
+            future = self._pending.pop(row, None)
+            if future is None:
+                future = pool.submit(self._read, row)
+            else:
+                self.n_prefetch_hits += 1
+            futures.append(future)
+        start = time.perf_counter()
+        out = [future.result() for future in futures]
+        with self._lock:
+            self.wait_time += time.perf_counter() - start
+            self.bytes_in_flight -= sum(len(data) for data in out)
+        return out
+
+    def read_bytes(self, row):
+        return self.read_many([row])[0]
+
+    def open_images(self, rows):
+        return [draft_image(PIL.Image.open(io.BytesIO(data)), self.decode_size) for data in self.read_many(rows)]
+
+
+class HTTPImageStore(ImageStore):
+    """
+    Images stored as individual files on a web server or S3-compatible object store.
+
+    The objects are laid out as the image package directory is on disk, so
+    the image at ``<image_dir>/<path>`` is read from ``<base_url>/<path>``.
+    The images of a batch are read concurrently with an asyncio client
+    holding a pool of persistent connections.
+
+    Parameters
+    ----------
+    base_url : str
+        The URL of the image package directory.
+    image_paths : bioscan_table.ImagePathIndex
+        The path to each image, relative to ``base_url``.
+    client : bioscan_http.HTTPClient, optional
+        The client to read with. By default, a client is made with the
+        default settings.
+    """
+
+    def __init__(self, base_url, image_paths, client=None):
+        self.base_url = base_url.rstrip("/")
+        self.image_paths = image_paths
+        self.client = HTTPClient() if client is None else client
+
+    def get_urls(self, rows):
+        return [f"{self.base_url}/{quote(p)}" for p in self.image_paths.to_numpy(rows)]
+
+    def read_many(self, rows):
+        return self.client.get_many(self.get_urls(rows))
+
+    def read_bytes(self, row):
+        return self.read_many([row])[0]
+
+    def open_images(self, rows):
+        return [draft_image(PIL.Image.open(io.BytesIO(data)), self.decode_size) for data in self.read_many(rows)]
+
+
+class HTTPShardImageStore(HTTPImageStore):
+    """
+    Images read with ranged requests from tar shards on a web server or object store.
+
+    The shards, manifest and index are those written by :func:`write_shards`,
+    uploaded as they are. The index locates the bytes of each image within
+    its shard, so images are read with HTTP ``Range`` requests. The images of
+    a batch which are close together in the same shard are read with a single
+    request.
+
+    Parameters
+    ----------
+    base_url : str
+        The URL of the shard directory.
+    client : bioscan_http.HTTPClient, optional
+        The client to read with. By default, a client is made with the
+        default settings.
+    max_gap : int, default=65536
+        Images of a batch in the same shard which are separated by at most
+        this many bytes are read with a single request.
+    """
+
+    def __init__(self, base_url, client=None, max_gap=65536):
+        self.base_url = base_url.rstrip("/")
+        self.client = HTTPClient() if client is None else client
+        self.max_gap = max_gap
+        manifest, index = self.client.get_many([f"{self.base_url}/{SHARD_MANIFEST}", f"{self.base_url}/{SHARD_INDEX}"])
+        manifest = json.loads(manifest)
+        self.shard_urls = [f"{self.base_url}/{quote(shard['name'])}" for shard in manifest["shards"]]
+        index = np.load(io.BytesIO(index))
+        self.index = _RowIndex([index[:, 0]])
+        self.shard_ids, self.offsets, self.lengths = index[:, 1], index[:, 2], index[:, 3]
+
+    def _locate(self, rows):
+        return np.array([self.index.lookup(row)[1] for row in rows], dtype=np.int64)
+
+    def get_urls(self, rows):
+        return [self.shard_urls[i] for i in self.shard_ids[self._locate(rows)]]
+
+    def read_many(self, rows):
+        positions = self._locate(rows)
+        shard_ids, starts = self.shard_ids[positions], self.offsets[positions]
+        stops = starts + self.lengths[positions]
+        # Merge the byte ranges of nearby images in the same shard into one request
+        runs, run_ids = [], []
+        for i in np.lexsort((starts, shard_ids)):
+            if runs and runs[-1][0] == shard_ids[i] and starts[i] - runs[-1][2] <= self.max_gap:
+                runs[-1][2] = max(runs[-1][2], stops[i])
+            else:
+                runs.append([shard_ids[i], starts[i], stops[i]])
+            run_ids.append((i, len(runs) - 1))
+        blobs = self.client.get_many(
+            [self.shard_urls[shard_id] for shard_id, _, _ in runs],
+            [(int(start), int(stop)) for _, start, stop in runs],
+        )
+        out = [None] * len(positions)
+        for i, run in run_ids:
+            start = starts[i] - runs[run][1]
+            out[i] = blobs[run][start : start + self.lengths[positions[i]]]
+        return out
+
+
+def _jsonable(value):
+    """Convert a table value into a JSON serializable value."""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if value is pd.NA or (isinstance(value, float) and np.isnan(value)):
+        return None
+    return value
+
+
+def sample_record(table, row):
+    """Get all the metadata for one row of the table as a dictionary.
+
+    Labels stored as categoricals are included both by name and by their
+    ``*_index`` code, as used for targets by :class:`~bioscan_dataloader.BIOSCAN5M`.
+
+    Parameters
+    ----------
+    table : bioscan_table.MetadataTable
+        The metadata table.
+    row : int
+        The position of the row in the table.
+
+    Returns
+    -------
+    dict
+    """
+    record = {"row": int(row)}
+    for name, column in table.columns.items():
+        record[name] = _jsonable(column[row])
+        if column.kind == "categorical" and not column.as_str:
+            record[name + "_index"] = int(column.codes[row])
+    return record
+
+
+def default_shard_dir(root, image_package, split):
+    """Get the default directory for the shards of a split.
+
+    Parameters
+    ----------
+    root : str
+        The dataset root directory.
+    image_package : str
+        The image package the shards were made from.
+    split : str
+        The dataset partition.
+
+    Returns
+    -------
+    str
+    """
+    return os.path.join(root, "images", "shards", image_package, split or "all")
+
+
+def _add_tar_member(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    tar.addfile(info, io.BytesIO(data))
+
+
+def write_shards(dataset, output_dir=None, shard_size=SHARD_SIZE, shuffle=True, seed=0, verbose=1):
+    """Pack the images and metadata of a dataset into sequential tar shards.
+
+    The shards follow the WebDataset convention: each sample is stored as a
+    pair of consecutive members, ``<processid>.jpg`` holding the original
+    JPEG bytes and ``<processid>.json`` holding the metadata of the sample.
+    A ``manifest.json`` file lists the shards and their number of samples,
+    and an ``index.npy`` file holds the metadata row position, shard number,
+    byte offset and length of each image, so the shards can be read with
+    ranged requests by :class:`HTTPShardImageStore`.
+
+    Parameters
+    ----------
+    dataset : bioscan_dataloader.BIOSCAN5M
+        The dataset to pack. Its split, image package and barcode reduction
+        determine which samples are written.
+    output_dir : str, optional
+        Directory to write the shards to. Default is
+        ``<root>/images/shards/<image_package>/<split>``.
+    shard_size : int, default=1_000_000_000
+        Approximate size of each shard, in bytes.
+    shuffle : bool, default=True
+        Whether to shuffle the order of the samples before packing them.
+    seed : int, default=0
+        Random seed for the shuffle.
+    verbose : int, default=1
+        Verbosity level.
+
+    Returns
+    -------
+    dict
+        The manifest of the written shards.
+    """
+    if output_dir is None:
+        output_dir = default_shard_dir(dataset.root, dataset.image_package, dataset.split)
+    os.makedirs(output_dir, exist_ok=True)
+    rows = np.asarray(dataset.rows)
+    if shuffle:
+        rows = rows[np.random.default_rng(seed).permutation(len(rows))]
+    paths = dataset.image_paths.to_numpy(rows)
+
+    shards = []
+    index = []
+    tar = None
+    for row, path in tqdm(zip(rows, paths), total=len(rows), disable=verbose < 1):
+        if tar is None or tar.offset >= shard_size:
+            if tar is not None:
+                tar.close()
+            shards.append({"name": f"shard-{len(shards):06d}.tar", "n_samples": 0})
+            tar = tarfile.open(os.path.join(output_dir, shards[-1]["name"]), mode="w")
+        record = sample_record(dataset.table, row)
+        with open(os.path.join(dataset.image_dir, path), "rb") as f:
+            data = f.read()
+        _add_tar_member(tar, record["processid"] + ".json", json.dumps(record).encode("utf-8"))
+        _add_tar_member(tar, record["processid"] + ".jpg", data)
+        # The data of a member is padded to a whole number of blocks
+        offset = tar.offset - -(-len(data) // tarfile.BLOCKSIZE) * tarfile.BLOCKSIZE
+        index.append((row, len(shards) - 1, offset, len(data)))
+        shards[-1]["n_samples"] += 1
+    if tar is not None:
+        tar.close()
+    np.save(os.path.join(output_dir, SHARD_INDEX), np.array(index, dtype=np.int64).reshape(-1, 4))
+
+    manifest = {
+        "image_package": dataset.image_package,
+        "split": dataset.split,
+        "metadata": file_fingerprint(dataset.metadata_path),
+        "n_samples": len(rows),
+        "shards": shards,
+        "index": SHARD_INDEX,
+    }
+    with open(os.path.join(output_dir, SHARD_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+    if verbose >= 1:
+        print(f"Wrote {len(rows)} samples to {len(shards)} shards in {output_dir}")
+    return manifest
+
+
+def default_hdf5_path(root, image_package, split):
+    """Get the default path of the HDF5 file for a split.
+
+    Parameters
+    ----------
+    root : str
+        The dataset root directory.
+    image_package : str
+        The image package the file was made from.
+    split : str
+        The dataset partition.
+
+    Returns
+    -------
+    str
+    """
+    return os.path.join(root, "images", "hdf5", image_package, f"{split or 'all'}.h5")
+
+
+def default_memmap_path(root, image_package, split):
+    """Get the default path of the decoded image array for a split.
+
+    Parameters
+    ----------
+    root : str
+        The dataset root directory.
+    image_package : str
+        The image package the array was made from.
+    split : str
+        The dataset partition.
+
+    Returns
+    -------
+    str
+    """
+    return os.path.join(root, "images", "memmap", image_package, f"{split or 'all'}.npy")
+
+
+def _memmap_rows_path(path):
+    return os.path.splitext(path)[0] + ".rows.npy"
+
+
+def find_store_paths(path, split):
+    """Find the files holding the images of a split.
+
+    If there is no file for the split itself and the split is ``"all"``,
+    the files of all the individual splits are used.
+
+    Parameters
+    ----------
+    path : str
+        The default path of the file for the split.
+    split : str
+        The dataset partition.
+
+    Returns
+    -------
+    list[str]
+    """
+    if os.path.isfile(path) or (split and split != "all"):
+        return [path]
+    ext = os.path.splitext(path)[1]
+    paths = glob.glob(os.path.join(os.path.dirname(path), "*" + ext))
+    return sorted(p for p in paths if not p.endswith(".rows.npy"))
+
+
+def write_hdf5(dataset, output_path=None, verbose=1):
+    """Pack the images of a dataset into a single HDF5 file.
+
+    The JPEG files are concatenated, unchanged, into one ``uint8`` dataset,
+    indexed by the offset and length of each image and the position of its
+    row in the metadata table. The file is read by :class:`HDF5ImageStore`.
+
+    Parameters
+    ----------
+    dataset : bioscan_dataloader.BIOSCAN5M
+        The dataset to pack. Its split, image package and barcode reduction
+        determine which images are written.
+    output_path : str, optional
+        Path of the HDF5 file to write. Default is
+        ``<root>/images/hdf5/<image_package>/<split>.h5``.
+    verbose : int, default=1
+        Verbosity level.
+
+    Returns
+    -------
+    str
+        The path of the written file.
+    """
+    import h5py
+
+    import dataset_helper
+
+    if output_path is None:
+        output_path = default_hdf5_path(dataset.root, dataset.image_package, dataset.split)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    date_time = datetime.datetime.now().astimezone().strftime("%Y%m%d_%H%M%S")
+    dataset_helper.create_hdf5(
+        date_time,
+        dataset_name=HDF5_GROUP,
+        path=output_path,
+        data_typ=dataset.image_package,
+        author="BIOSCAN-5M",
+        dataset_title="BIOSCAN-5M Insect Dataset",
+    )
+    rows = np.asarray(dataset.rows)
+    image_files = [os.path.join(dataset.image_dir, p) for p in dataset.image_paths.to_numpy(rows)]
+    with h5py.File(output_path, "a") as f:
+        group = f[HDF5_GROUP]
+        group.attrs["Split"] = str(dataset.split)
+        group.attrs["Metadata"] = file_fingerprint(dataset.metadata_path)
+        dataset_helper.write_blob_in_hdf5(group, image_files, rows)
+    if verbose >= 1:
+        print(f"Wrote {len(rows)} images to {output_path}")
+    return output_path
+
+
+def _fit_width(image, height, width):
+    """Resize an image to the given height, then center crop or pad it to the given width."""
+    if image.height != height:
+        image = image.resize((max(1, round(image.width * height / image.height)), height), PIL.Image.BILINEAR)
+    array = np.asarray(image.convert("RGB"))
+    out = np.zeros((height, width, 3), dtype=np.uint8)
+    if array.shape[1] >= width:
+        start = (array.shape[1] - width) // 2
+        out[:] = array[:, start : start + width]
+    else:
+        start = (width - array.shape[1]) // 2
+        out[:, start : start + array.shape[1]] = array
+    return out
+
+
+def write_memmap(dataset, output_path=None, height=256, width=256, verbose=1):
+    """Decode the images of a dataset into a memory-mappable ``uint8`` array.
+
+    Each image is resized to the given height (a no-op for the ``*_256``
+    packages), then center cropped or zero padded to the given width. The
+    array is saved with shape ``(n_images, height, width, 3)`` in the order of
+    ``dataset.rows``, and the row positions are saved alongside it. The array
+    is read by :class:`MemmapImageStore`.
+
+    Parameters
+    ----------
+    dataset : bioscan_dataloader.BIOSCAN5M
+        The dataset to decode. Its split, image package and barcode reduction
+        determine which images are written.
+    output_path : str, optional
+        Path of the ``.npy`` file to write. Default is
+        ``<root>/images/memmap/<image_package>/<split>.npy``.
+    height : int, default=256
+        Height of the stored images.
+    width : int, default=256
+        Width of the stored images.
+    verbose : int, default=1
+        Verbosity level.
+
+    Returns
+    -------
+    str
+        The path of the written file.
+    """
+    if output_path is None:
+        output_path = default_memmap_path(dataset.root, dataset.image_package, dataset.split)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    rows = np.asarray(dataset.rows)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.uint8, shape=(len(rows), height, width, 3))
+    for i, path in enumerate(tqdm(dataset.image_paths.to_numpy(rows), disable=verbose < 1)):
+        with PIL.Image.open(os.path.join(dataset.image_dir, path)) as image:
+            out[i] = _fit_width(image, height, width)
+    out.flush()
+    del out
+    np.save(_memmap_rows_path(output_path), rows)
+    os.replace(tmp_path, output_path)
+    if verbose >= 1:
+        print(f"Wrote {len(rows)} images to {output_path}")
+    return output_path
+
+
+def load_shard_manifest(shard_dir):
+    """Load the manifest written by :func:`write_shards`.
+
+    Parameters
+    ----------
+    shard_dir : str
+        The directory containing the shards.
+
+    Returns
+    -------
+    dict
+    """
+    with open(os.path.join(shard_dir, SHARD_MANIFEST)) as f:
+        return json.load(f)
+
+
+def iter_shard(path):
+    """Iterate over the samples in a tar shard, reading it sequentially.
+
+    Parameters
+    ----------
+    path : str
+        Path to the tar shard.
+
+    Yields
+    ------
+    key : str
+        The key of the sample (its ``processid``).
+    sample : dict[str, bytes]
+        The contents of each member of the sample, keyed by file extension.
+    """
+    key, sample = None, {}
+    with tarfile.open(path, mode="r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            member_key, ext = os.path.basename(member.name).split(".", 1)
+            if member_key != key and sample:
+                yield key, sample
+                sample = {}
+            key = member_key
+            sample[ext] = tar.extractfile(member).read()
+    if sample:
+        yield key, sample
+
+
+def get_parser():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Repackage the BIOSCAN-5M images into an alternative storage format.")
+    parser.add_argument(
+        "root",
+        type=str,
+        help="The dataset root directory, containing the metadata and images directories.",
+    )
+    parser.add_argument(
+        "--format",
+        type=str,
+        default="shards",
+        choices=["shards", "hdf5", "memmap"],
+        help="The storage format to write. Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--split",
+        type=str,
+        default="train",
+        help="The dataset partition to write. Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--image-package",
+        type=str,
+        default="cropped_256",
+        help="The image package to read the images from. Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default=None,
+        help="Output directory (shards) or file (hdf5, memmap). Default is inside the images directory.",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=SHARD_SIZE,
+        help="Approximate size of each shard in bytes. Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--width",
+        type=int,
+        default=256,
+        help="Width to crop or pad the images to, for the memmap format. Default is %(default)s.",
+    )
+    parser.add_argument(
+        "--no-shuffle",
+        dest="shuffle",
+        action="store_false",
+        help="Write the shards in metadata order instead of shuffling the samples.",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Random seed for shuffling the samples. Default is %(default)s.",
+    )
+    # Verbosity args ----------------------------------------------------------
+    group = parser.add_argument_group("Verbosity")
+    group.add_argument(
+        "--verbose",
+        "-v",
+        action="count",
+        default=1,
+        help="Increase the level of verbosity. The default verbosity level is %(default)s.",
+    )
+    group.add_argument(
+        "--quiet",
+        "-q",
+        action="count",
+        default=0,
+        help="Decrease the level of verbosity.",
+    )
+    return parser
+
+
+def cli():
+    from bioscan_dataloader import BIOSCAN5M
+
+    parser = get_parser()
+    args = parser.parse_args()
+    args.verbose -= args.quiet
+    dataset = BIOSCAN5M(args.root, split=args.split, modality="image", image_package=args.image_package, target_type=[])
+    if args.format == "shards":
+        write_shards(
+            dataset,
+            output_dir=args.output_dir,
+            shard_size=args.shard_size,
+            shuffle=args.shuffle,
+            seed=args.seed,
+            verbose=args.verbose,
+        )
+    elif args.format == "hdf5":
+        write_hdf5(dataset, output_path=args.output_dir, verbose=args.verbose)
+    elif args.format == "memmap":
+        write_memmap(dataset, output_path=args.output_dir, width=args.width, verbose=args.verbose)
+
+
+if __name__ == "__main__":
+    cli()
@@ -0,0 +1,664 @@
+"""
+Samplers for the BIOSCAN-5M datasets.
+
+The samplers work on arrays of label indices (the ``*_index`` columns of
+:attr:`~bioscan_dataloader.BIOSCAN5M.metadata`), which are grouped by class
+once. Each epoch is then drawn with vectorized NumPy operations, instead of
+building it from the metadata in Python.
+
+:class:`RandomSampler`, :class:`ClassBalancedSampler`,
+:class:`PerClassBatchSampler` and :class:`ChunkLocalitySampler` can be
+checkpointed with ``state_dict()`` and resumed mid-epoch with
+``load_state_dict()``.
+
+:class:`LookaheadBatchSampler` wraps a batch sampler, to tell each
+DataLoader worker which samples it will fetch next, so their images can be
+read ahead.
+"""
+
+import itertools
+from collections import deque
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+from bioscan_table import mix64
+
+
+def get_replicas(num_replicas=None, rank=None):
+    """Get the number of distributed replicas and the rank of this one.
+
+    Parameters
+    ----------
+    num_replicas : int, optional
+        Number of processes taking part in distributed training. By default,
+        the world size of the default process group, if it is initialized.
+    rank : int, optional
+        Rank of the current process. By default, the rank in the default
+        process group, if it is initialized.
+
+    Returns
+    -------
+    tuple[int, int]
+        The number of replicas, and the rank of this one.
+    """
+    distributed = torch.distributed.is_available() and torch.distributed.is_initialized()
+    if num_replicas is None:
+        num_replicas = torch.distributed.get_world_size() if distributed else 1
+    if rank is None:
+        rank = torch.distributed.get_rank() if distributed else 0
+    if not 0 <= rank < num_replicas:
+        raise ValueError(f"Invalid rank {rank}, rank should be in the interval [0, {num_replicas - 1}]")
+    return num_replicas, rank
+
+
+class ClassIndex:
+    """
+    Table of the samples in each class, in compressed sparse row layout.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        The label index of each sample. Samples with a negative label are
+        unlabelled, and are not included in any class.
+
+    Attributes
+    ----------
+    classes : numpy.ndarray
+        The label indices which have at least one sample, in ascending order.
+    counts : numpy.ndarray
+        The number of samples in each class.
+    offsets : numpy.ndarray
+        The start of each class in :attr:`indices`, with one extra entry for
+        the total number of labelled samples.
+    indices : numpy.ndarray
+        The positions of the labelled samples, grouped by class.
+    """
+
+    def __init__(self, labels):
+        labels = np.asarray(labels, dtype=np.int64)
+        labelled = np.flatnonzero(labels >= 0)
+        self.indices = labelled[np.argsort(labels[labelled], kind="stable")]
+        counts = np.bincount(labels[labelled]) if len(labelled) else np.zeros(0, dtype=np.int64)
+        self.classes = np.flatnonzero(counts)
+        self.counts = counts[self.classes]
+        self.offsets = np.zeros(len(self.classes) + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=self.offsets[1:])
+
+    @property
+    def n_classes(self):
+        return len(self.classes)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def members(self, i):
+        """Get the positions of the samples in the ``i``-th class."""
+        return self.indices[self.offsets[i] : self.offsets[i + 1]]
+
+    def shuffled(self, rng):
+        """Get :attr:`indices` with the samples of each class in a random order.
+
+        Parameters
+        ----------
+        rng : numpy.random.Generator
+            The random number generator.
+
+        Returns
+        -------
+        numpy.ndarray
+            The positions of the labelled samples, grouped by class as in
+            :attr:`indices`, and shuffled within each class.
+        """
+        class_of = np.repeat(np.arange(self.n_classes), self.counts)
+        return self.indices[np.lexsort((rng.random(len(self.indices)), class_of))]
+
+    def class_weights(self, power=1.0):
+        """Get the probability of drawing each class, proportional to its size raised to ``power``."""
+        weights = self.counts.astype(float) ** power
+        return weights / weights.sum()
+
+
+class ResumableSampler(Sampler):
+    """
+    Base class for samplers which can be resumed from any point in an epoch.
+
+    Each epoch is a sequence of ``n`` dataset indices, which is generated
+    lazily in blocks of :attr:`block_size` from the seed, the epoch number and
+    the block number. The sequence does not depend on the number of
+    replicas: replica ``rank`` takes every ``num_replicas``-th position,
+    starting from its rank. The end of the sequence wraps around to its start,
+    so every replica gets the same number of samples.
+
+    The state is the position in the sequence which all the replicas have
+    reached together, so training can resume from it with a different number
+    of replicas or DataLoader workers. Resuming only needs the blocks from
+    that position on, so takes constant time.
+
+    Parameters
+    ----------
+    n : int
+        The length of the sequence of each epoch.
+    seed : int, default=0
+        Random seed.
+    num_replicas : int, optional
+        Number of processes taking part in distributed training. By default,
+        the world size of the default process group.
+    rank : int, optional
+        Rank of the current process. By default, the rank in the default
+        process group.
+    """
+
+    block_size = 65536
+
+    def __init__(self, n, seed=0, num_replicas=None, rank=None):
+        self.n = n
+        self.seed = seed
+        self.epoch = 0
+        self.num_replicas, self.rank = get_replicas(num_replicas, rank)
+        self.offset = 0
+        self._start = 0
+        self._n_yielded = 0
+
+    def _get_block(self, block):
+        """Generate the sequence at positions ``block * block_size`` up to ``(block + 1) * block_size``."""
+        raise NotImplementedError
+
+    def set_epoch(self, epoch):
+        """Set the epoch, which changes the sequence. Starts the epoch from the beginning, unless resuming it."""
+        if epoch != self.epoch:
+            self.offset = 0
+        self.epoch = epoch
+
+    def _get_start(self):
+        """Get the position in the sequence to start iterating from."""
+        return self.offset if self.offset < self.n else 0
+
+    def __len__(self):
+        return -(-(self.n - self._get_start()) // self.num_replicas)
+
+    def __iter__(self):
+        self._start = self._get_start()
+        self._n_yielded = 0
+        positions = self._start + self.rank + self.num_replicas * np.arange(len(self))
+        positions %= self.n
+        blocks = positions // self.block_size
+        # Positions are increasing, apart from one wrap around to the start
+        boundaries = np.flatnonzero(np.diff(blocks)) + 1
+        for chunk in np.split(positions, boundaries):
+            if not len(chunk):
+                continue
+            block = chunk[0] // self.block_size
+            sequence = self._get_block(block)
+            for index in sequence[chunk - block * self.block_size].tolist():
+                self._n_yielded += 1
+                yield index
+        # The epoch is complete, so iterating again starts it from the beginning
+        self.offset = 0
+
+    def state_dict(self, n_consumed=None):
+        """
+        Get the state of the sampler, to resume it from.
+
+        Parameters
+        ----------
+        n_consumed : int, optional
+            Number of samples of the current epoch which this replica has
+            used, since the sampler was (re)started. By default, the number
+            which the sampler has yielded. With a DataLoader, this is more
+            than have been used, since the DataLoader fetches ahead, so the
+            number of samples actually used (e.g. batches times batch size)
+            should be given.
+
+        Returns
+        -------
+        dict
+            The seed, epoch, and position reached in the epoch's sequence.
+        """
+        if n_consumed is None:
+            n_consumed = self._n_yielded
+        offset = min(self.n, self._start + n_consumed * self.num_replicas)
+        return {"seed": self.seed, "epoch": self.epoch, "offset": offset}
+
+    def load_state_dict(self, state_dict):
+        """
+        Resume from a state returned by :meth:`state_dict`.
+
+        The next iteration over the sampler continues the epoch from where
+        the state was saved.
+
+        Parameters
+        ----------
+        state_dict : dict
+            The state of the sampler.
+        """
+        self.seed = state_dict["seed"]
+        self.epoch = state_dict["epoch"]
+        self.offset = state_dict["offset"]
+
+
+def _feistel_permute(x, n_bits, keys):
+    """Apply a bijection on ``n_bits``-bit integers, built as a Feistel network."""
+    half = np.uint64(n_bits // 2)
+    mask = np.uint64((1 << (n_bits // 2)) - 1)
+    left, right = x >> half, x & mask
+    for key in keys:
+        left, right = right, left ^ (mix64(right ^ key) & mask)
+    return (left << half) | right
+
+
+def _epoch_key(seed, epoch):
+    """Get the key of an epoch, from which its random draws are derived."""
+    return mix64(mix64(np.uint64(seed)) ^ np.uint64(epoch))
+
+
+def _round_keys(key, n_rounds=4):
+    """Derive the round keys of a Feistel network from a key, or from each of an array of keys."""
+    keys = mix64(np.asarray(key, dtype=np.uint64)[..., None] + np.arange(n_rounds, dtype=np.uint64))
+    return np.moveaxis(keys, -1, 0)
+
+
+def _permute_below(x, n, keys):
+    """Apply a keyed bijection of the integers in ``[0, n)`` to ``x``.
+
+    ``n`` and the round keys can be scalars, or arrays the shape of ``x`` to
+    apply a separate bijection to each value.
+    """
+    x = np.asarray(x, dtype=np.uint64)
+    # Permute the smallest even number of bits which covers n, and walk any
+    # values outside [0, n) through the permutation again until they are inside
+    if np.ndim(n) == 0:
+        n_bits = max(2, int(n - 1).bit_length())
+    else:
+        n = np.asarray(n, dtype=np.uint64)
+        n_bits = np.maximum(2, np.frexp(n.astype(float) - 1)[1]).astype(np.int64)
+    n_bits += n_bits % 2
+    out = _feistel_permute(x, n_bits, keys)
+    outside = np.flatnonzero(out >= n)
+    while len(outside):
+        sub_bits = n_bits if np.ndim(n_bits) == 0 else n_bits[outside]
+        sub_keys = [key if np.ndim(key) == 0 else key[outside] for key in keys]
+        out[outside] = _feistel_permute(out[outside], sub_bits, sub_keys)
+        outside = outside[out[outside] >= (n if np.ndim(n) == 0 else n[outside])]
+    return out
+
+
+class RandomSampler(ResumableSampler):
+    """
+    Sample the dataset in a random order, without replacement.
+
+    The random permutation is computed a block at a time, with a keyed
+    bijection of the sample positions (a Feistel network), instead of being
+    drawn and held in memory. It can therefore be resumed from any point in
+    the epoch in constant time.
+
+    Parameters
+    ----------
+    n : int
+        The number of samples in the dataset.
+    seed : int, default=0
+        Random seed. Each epoch is drawn from the seed and the epoch number,
+        so is the same on every replica.
+    num_replicas : int, optional
+        Number of processes taking part in distributed training. By default,
+        the world size of the default process group.
+    rank : int, optional
+        Rank of the current process. By default, the rank in the default
+        process group.
+
+    Examples
+    --------
+    >>> sampler = RandomSampler(len(dataset), seed=0)
+    >>> loader = DataLoader(dataset, batch_size=256, sampler=sampler)
+    >>> checkpoint["sampler"] = sampler.state_dict(n_consumed=n_batches * 256)
+    >>> ...
+    >>> sampler.load_state_dict(checkpoint["sampler"])
+    """
+
+    n_rounds = 4
+
+    def _get_block(self, block):
+        positions = np.arange(block * self.block_size, min((block + 1) * self.block_size, self.n), dtype=np.uint64)
+        keys = _round_keys(_epoch_key(self.seed, self.epoch), self.n_rounds)
+        return _permute_below(positions, self.n, keys).astype(np.int64)
+
+
+class ClassBalancedSampler(ResumableSampler):
+    """
+    Sample with replacement, with class probabilities depending on class size.
+
+    Each sample is drawn by first drawing a class, with probability
+    proportional to ``n_c ** power`` where ``n_c`` is the number of samples in
+    the class, and then drawing a sample uniformly from the class.
+    With ``power=0``, every class is equally likely (class-balanced); with
+    ``power=0.5``, classes are drawn with square-root frequency; and with
+    ``power=1``, every sample is equally likely. Unlabelled samples are never
+    drawn.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        The label index of each sample in the dataset, such as from
+        :meth:`bioscan_dataloader.BIOSCAN5M.get_labels`.
+    power : float, default=0.0
+        The exponent applied to the class sizes.
+    num_samples : int, optional
+        Number of samples to draw per epoch, over all replicas. By default,
+        the number of labelled samples.
+    seed : int, default=0
+        Random seed. Each epoch is drawn from the seed and the epoch number,
+        so is the same on every replica.
+    num_replicas : int, optional
+        Number of processes taking part in distributed training. By default,
+        the world size of the default process group.
+    rank : int, optional
+        Rank of the current process. By default, the rank in the default
+        process group.
+
+    Notes
+    -----
+    The draws are made in blocks, each from its own seed, so the sampler can
+    be resumed mid-epoch. See :class:`ResumableSampler`.
+    """
+
+    def __init__(self, labels, power=0.0, num_samples=None, seed=0, num_replicas=None, rank=None):
+        self.class_index = ClassIndex(labels)
+        if num_samples is None:
+            num_samples = len(self.class_index)
+        super().__init__(num_samples, seed=seed, num_replicas=num_replicas, rank=rank)
+        self.power = power
+        self.class_probs = self.class_index.class_weights(power)
+
+    @classmethod
+    def from_dataset(cls, dataset, level="species", **kwargs):
+        """Make a sampler for the labels of a dataset at a taxonomic level.
+
+        Parameters
+        ----------
+        dataset : bioscan_dataloader.BIOSCAN5M
+            The dataset.
+        level : str, default="species"
+            The taxonomic level, or ``"dna_bin"``.
+        **kwargs
+            Other arguments for the sampler.
+        """
+        return cls(dataset.get_labels(level), **kwargs)
+
+    def _get_block(self, block):
+        rng = np.random.default_rng((self.seed, self.epoch, block))
+        n = min(self.block_size, self.n - block * self.block_size)
+        index = self.class_index
+        classes = rng.choice(index.n_classes, size=n, p=self.class_probs)
+        within = (rng.random(n) * index.counts[classes]).astype(np.int64)
+        return index.indices[index.offsets[classes] + within]
+
+
+class PerClassBatchSampler(ResumableSampler):
+    """
+    Batches of a fixed number of samples from each of a fixed number of classes.
+
+    This is the "P x K" sampling used for metric learning, where each batch
+    has ``classes_per_batch`` classes, and ``samples_per_class`` samples from
+    each of them. Classes are visited by cycling through random permutations
+    of the classes, so all classes are used equally often. The samples of
+    each class are cycled through in a random order: on the ``j``-th
+    permutation of the classes, a class takes the next ``samples_per_class``
+    samples from position ``j * samples_per_class``, so samples are only
+    repeated once their class is exhausted. Classes with fewer than
+    ``samples_per_class`` samples contribute repeated samples. When the
+    number of classes is not a multiple of ``classes_per_batch``, the classes
+    left out of a permutation skip their turn.
+
+    The sequence of :class:`ResumableSampler` is the sequence of batches of
+    the epoch, so the sampler can be resumed from any batch, and the
+    ``n_consumed`` argument of :meth:`state_dict` is a number of batches.
+    The order of the samples of each class is a keyed bijection of their
+    positions, as in :class:`RandomSampler`, so each block of batches is
+    drawn on its own.
+
+    Parameters
+    ----------
+    labels : numpy.ndarray
+        The label index of each sample in the dataset, such as from
+        :meth:`bioscan_dataloader.BIOSCAN5M.get_labels`.
+    classes_per_batch : int
+        Number of classes in each batch.
+    samples_per_class : int
+        Number of samples of each class in each batch.
+    num_batches : int, optional
+        Number of batches per epoch for each replica. By default, the number
+        of labelled samples divided by the global batch size.
+    seed : int, default=0
+        Random seed. Each epoch is drawn from the seed and the epoch number,
+        so is the same on every replica.
+    num_replicas : int, optional
+        Number of processes taking part in distributed training. By default,
+        the world size of the default process group.
+    rank : int, optional
+        Rank of the current process. By default, the rank in the default
+        process group.
+    """
+
+    def __init__(
+        self,
+        labels,
+        classes_per_batch,
+        samples_per_class,
+        num_batches=None,
+        seed=0,
+        num_replicas=None,
+        rank=None,
+    ):
+        self.class_index = ClassIndex(labels)
+        if classes_per_batch > self.class_index.n_classes:
+            raise ValueError(
+                f"classes_per_batch={classes_per_batch} is more than the number of classes"
+                f" ({self.class_index.n_classes})"
+            )
+        self.classes_per_batch = classes_per_batch
+        self.samples_per_class = samples_per_class
+        num_replicas, rank = get_replicas(num_replicas, rank)
+        if num_batches is None:
+            num_batches = len(self.class_index) // (classes_per_batch * samples_per_class * num_replicas)
+        self.num_batches = max(1, num_batches)
+        super().__init__(self.num_batches * num_replicas, seed=seed, num_replicas=num_replicas, rank=rank)
+        # Only whole batches are taken from each permutation of the classes, so
+        # no batch spans two, and each block holds whole permutations
+        self.batches_per_permutation = self.class_index.n_classes // classes_per_batch
+        self.block_size = self.batches_per_permutation * max(1, 1024 // self.batches_per_permutation)
+
+    @classmethod
+    def from_dataset(cls, dataset, level="species", **kwargs):
+        """Make a sampler for the labels of a dataset at a taxonomic level.
+
+        Parameters
+        ----------
+        dataset : bioscan_dataloader.BIOSCAN5M
+            The dataset.
+        level : str, default="species"
+            The taxonomic level, or ``"dna_bin"``.
+        **kwargs
+            Other arguments for the sampler.
+        """
+        return cls(dataset.get_labels(level), **kwargs)
+
+    def _get_block(self, block):
+        index = self.class_index
+        P, K = self.classes_per_batch, self.samples_per_class
+        start = block * self.block_size
+        n_batches = min(self.block_size, self.n - start)
+        rng = np.random.default_rng((self.seed, self.epoch, block))
+        keys = rng.random((-(-n_batches // self.batches_per_permutation), index.n_classes))
+        classes = np.argsort(keys, axis=1)[:, : self.batches_per_permutation * P].reshape(-1, P)[:n_batches]
+        # On the j-th permutation, a class takes its samples j*K to (j+1)*K, wrapping around
+        permutation = (start + np.arange(n_batches)) // self.batches_per_permutation
+        counts = np.broadcast_to(index.counts[classes][:, :, None], (n_batches, P, K))
+        within = (permutation[:, None, None] * K + np.arange(K)) % counts
+        # Each class has its own order of its samples in the epoch
+        class_keys = mix64(_epoch_key(self.seed, self.epoch) ^ classes.astype(np.uint64))
+        class_keys = np.broadcast_to(class_keys[:, :, None], counts.shape).ravel()
+        within = _permute_below(within.ravel(), counts.ravel(), _round_keys(class_keys)).astype(np.int64)
+        rows = index.indices[np.repeat(index.offsets[classes].ravel(), K) + within]
+        return rows.reshape(n_batches, P * K)
+
+
+class ChunkLocalitySampler(ResumableSampler):
+    """
+    Shuffle samples while keeping reads local to a few image directories at a time.
+
+    The images are stored in ``chunk`` subdirectories, and a random
+    permutation of the whole dataset spreads every batch across all of them.
+    This sampler instead visits the directories in a random order, and the
+    samples in each directory in a random order, and then shuffles samples
+    within windows of ``window_size`` consecutive samples, which mixes
+    neighbouring directories. A larger window gives more random batches, at
+    the cost of reading from more directories at once.
+
+    The order of the epoch does not depend on the number of replicas: as for
+    any :class:`ResumableSampler`, replica ``rank`` takes every
+    ``num_replicas``-th sample, so the replicas read from the same few
+    directories at once, and the sampler can be resumed with a different
+    number of replicas. The samples of each directory are ordered by a keyed
+    bijection of their positions, as in :class:`RandomSampler`, so each
+    block of the epoch is drawn on its own.
+
+    Parameters
+    ----------
+    groups : numpy.ndarray
+        The directory (or any other grouping) of each sample in the dataset,
+        as integer codes.
+    window_size : int, default=8192
+        Number of consecutive samples to shuffle together.
+    seed : int, default=0
+        Random seed. Each epoch is drawn from the seed and the epoch number,
+        so is the same on every replica.
+    num_replicas : int, optional
+        Number of processes taking part in distributed training. By default,
+        the world size of the default process group.
+    rank : int, optional
+        Rank of the current process. By default, the rank in the default
+        process group.
+    drop_last : bool, default=False
+        Whether to drop the end of the epoch so it divides evenly between the
+        replicas. Otherwise, samples from the start of the epoch are repeated.
+    """
+
+    def __init__(self, groups, window_size=8192, seed=0, num_replicas=None, rank=None, drop_last=False):
+        _, self.groups = np.unique(np.asarray(groups), return_inverse=True)
+        self.n_groups = int(self.groups.max()) + 1 if len(self.groups) else 0
+        self.class_index = ClassIndex(self.groups)
+        self.window_size = window_size
+        self.drop_last = drop_last
+        super().__init__(len(self.groups), seed=seed, num_replicas=num_replicas, rank=rank)
+        # Windows never span two blocks
+        self.block_size = window_size * max(1, ResumableSampler.block_size // window_size)
+
+    @classmethod
+    def from_dataset(cls, dataset, **kwargs):
+        """Make a sampler which groups the samples of a dataset by image directory.
+
+        Parameters
+        ----------
+        dataset : bioscan_dataloader.BIOSCAN5M
+            The dataset.
+        **kwargs
+            Other arguments for the sampler.
+        """
+        if dataset.image_paths is not None:
+            groups = np.asarray(dataset.image_paths.prefix_codes)[dataset.rows]
+        else:
+            groups = dataset.get_labels("chunk")
+        return cls(groups, **kwargs)
+
+    def __len__(self):
+        if self.drop_last:
+            return (self.n - self._get_start()) // self.num_replicas
+        return super().__len__()
+
+    def _get_block(self, block):
+        index = self.class_index
+        positions = np.arange(block * self.block_size, min((block + 1) * self.block_size, self.n))
+        # The groups are visited in a random order, which only takes time in the number of groups
+        group_order = np.random.default_rng((self.seed, self.epoch)).permutation(index.n_classes)
+        ends = np.cumsum(index.counts[group_order])
+        turn = np.searchsorted(ends, positions, side="right")
+        groups = group_order[turn]
+        within = positions - (ends[turn] - index.counts[groups])
+        group_keys = mix64(_epoch_key(self.seed, self.epoch) ^ groups.astype(np.uint64))
+        within = _permute_below(within, index.counts[groups], _round_keys(group_keys)).astype(np.int64)
+        samples = index.indices[index.offsets[groups] + within]
+        windows = positions // self.window_size
+        rng = np.random.default_rng((self.seed, self.epoch, block))
+        return samples[np.lexsort((rng.random(len(samples)), windows))]
+
+
+class LookaheadBatch(list):
+    """
+    A batch of dataset indices, with the indices of the next batches fetched by the same DataLoader worker.
+
+    Parameters
+    ----------
+    indices : Iterable[int]
+        The indices of the samples in the batch.
+    upcoming : Iterable[int], optional
+        The indices of the samples which will be fetched next, in order.
+    """
+
+    def __init__(self, indices, upcoming=()):
+        super().__init__(indices)
+        self.upcoming = list(upcoming)
+
+
+class LookaheadBatchSampler(Sampler):
+    """
+    Wrap a batch sampler so each batch carries the indices of the batches which follow it in the same worker.
+
+    A DataLoader hands batches to its workers in turn, so each worker only
+    sees the batches it fetches. This sampler yields each batch as a
+    :class:`LookaheadBatch`, whose ``upcoming`` attribute lists the samples
+    of the next ``lookahead`` batches of the same worker.
+    :meth:`bioscan_dataloader.BIOSCAN5M.__getitems__` passes them to
+    :meth:`~bioscan_dataloader.BIOSCAN5M.prefetch`, so their images are read
+    in the background while the current batch is transformed.
+
+    Parameters
+    ----------
+    batch_sampler : Iterable[list[int]]
+        The batch sampler to wrap, such as a
+        :class:`torch.utils.data.BatchSampler` or a
+        :class:`PerClassBatchSampler`. To change the epoch or resume, call
+        its methods (or those of the sampler it wraps) directly.
+    num_workers : int, default=0
+        The ``num_workers`` of the DataLoader.
+    lookahead : int, default=1
+        Number of batches of the same worker to read ahead.
+
+    Examples
+    --------
+    >>> batch_sampler = LookaheadBatchSampler(BatchSampler(sampler, 256, drop_last=True), num_workers=8)
+    >>> loader = DataLoader(dataset, batch_sampler=batch_sampler, num_workers=8)
+    """
+
+    def __init__(self, batch_sampler, num_workers=0, lookahead=1):
+        self.batch_sampler = batch_sampler
+        self.num_workers = num_workers
+        self.lookahead = lookahead
+
+    def __iter__(self):
+        # The batches a worker fetches are num_workers apart, or consecutive in the main process
+        stride = max(1, self.num_workers)
+        batches = iter(self.batch_sampler)
+        buffer = deque(itertools.islice(batches, stride * self.lookahead))
+        for batch in batches:
+            buffer.append(batch)
+            yield self._make_batch(buffer.popleft(), buffer, stride)
+        while buffer:
+            yield self._make_batch(buffer.popleft(), buffer, stride)
+
+    def _make_batch(self, batch, buffer, stride):
+        upcoming = [i for k in range(stride - 1, len(buffer), stride) for i in buffer[k]]
+        return LookaheadBatch(batch, upcoming)
+
+    def __len__(self):
+        return len(self.batch_sampler)
@@ -0,0 +1,269 @@
+"""
+Schema registry for the BIOSCAN-5M metadata.
+
+Declares the dtype of every column of the metadata CSV files, and the columns
+needed by each consumer, so all the tools parse the metadata the same way:
+labels as categoricals and numbers in the smallest lossless dtype, reading
+only the columns they use.
+"""
+
+import importlib.util
+
+import numpy as np
+import pandas as pd
+
+# Bump whenever a change to the schema or the downcast changes the parsed values
+SCHEMA_VERSION = 1
+
+SCHEMA = {
+    "processid": str,
+    "sampleid": str,
+    "uri_preconflictres": "category",
+    "taxon_preconflictres": "category",
+    "phylum_preconflictres": "category",
+    "class_preconflictres": "category",
+    "order_preconflictres": "category",
+    "family_preconflictres": "category",
+    "subfamily_preconflictres": "category",
+    "genus_preconflictres": "category",
+    "species_preconflictres": "category",
+    "nucraw": str,
+    "dna_barcode": str,
+    "dna_bin": "category",
+    "country": "category",
+    "province/state": "category",
+    "province_state": "category",
+    "coord-lat": float,
+    "coord-lon": float,
+    "image_measurement_value": float,
+    "image_measurement_context": "category",
+    "area_fraction": float,
+    "scale_factor": float,
+    "image_file": str,
+    "chunk_number": "uint8",
+    "chunk": str,
+    "index_bioscan_1M_insect": "Int64",
+    "_phylum_original": "category",
+    "_class_original": "category",
+    "_order_original": "category",
+    "_family_original": "category",
+    "_subfamily_original": "category",
+    "_genus_original": "category",
+    "_species_original": "category",
+    "_taxon_original": "category",
+    "_uri_original": "category",
+    "_nucraw_original": "category",
+    "_phylum_fixtypos": "category",
+    "_class_fixtypos": "category",
+    "_order_fixtypos": "category",
+    "_family_fixtypos": "category",
+    "_subfamily_fixtypos": "category",
+    "_genus_fixtypos": "category",
+    "_species_fixtypos": "category",
+    "_taxon_fixtypos": "category",
+    "_rank": "Int64",
+    "phylum_conflictres": "category",
+    "class_conflictres": "category",
+    "order_conflictres": "category",
+    "family_conflictres": "category",
+    "subfamily_conflictres": "category",
+    "genus_conflictres": "category",
+    "species_conflictres": "category",
+    "taxon_conflictres": "category",
+    "uri_conflictres": "category",
+    "ratio": float,
+    "conflicted": bool,
+    "conflicted_uri": bool,
+    "is_novel_species": "boolean",
+    "inferred_ranks": "uint8",
+    "label_was_reworded": "uint8",
+    "label_was_manualeditted": "uint8",
+    "label_was_inferred": "uint8",
+    "label_was_dropped": "uint8",
+    "split": str,
+    "taxon": "category",
+    "phylum": "category",
+    "class": "category",
+    "order": "category",
+    "family": "category",
+    "subfamily": "category",
+    "genus": "category",
+    "species": "category",
+}
+
+taxonomy_cols = [
+    "domain",
+    "kingdom",
+    "phylum",
+    "class",
+    "order",
+    "family",
+    "subfamily",
+    "tribe",
+    "genus",
+    "species",
+    "subspecies",
+    "name",
+    "taxon",
+]
+geographic_cols = ["country", "province_state", "coord-lat", "coord-lon"]
+size_cols = ["image_measurement_value", "area_fraction", "scale_factor"]
+
+#: The columns read by each consumer of the metadata. ``None`` means all the columns.
+CONSUMERS = {
+    "dataloader": [
+        "processid",
+        "sampleid",
+        *taxonomy_cols,
+        "dna_bin",
+        "dna_barcode",
+        *geographic_cols,
+        *size_cols,
+        "inferred_ranks",
+        "split",
+        "index_bioscan_1M_insect",
+        "chunk",
+    ],
+    "split": None,
+    "statistics.genetic": [*taxonomy_cols, "dna_bin", "dna_barcode"],
+    "statistics.geographic": [*taxonomy_cols, *geographic_cols],
+    "statistics.size": [*taxonomy_cols, *size_cols],
+    "distribution.genetic": [*taxonomy_cols, "dna_bin"],
+    "distribution.geographic": [*taxonomy_cols, *geographic_cols],
+    "distribution.size": [*taxonomy_cols, *size_cols],
+}
+
+
+def get_columns(consumer=None):
+    """Get the metadata columns read by a consumer.
+
+    Parameters
+    ----------
+    consumer : str, optional
+        The name of the consumer, a key of :data:`CONSUMERS`. If omitted,
+        all the columns are read.
+
+    Returns
+    -------
+    list[str] or None
+        The column names, or ``None`` for all the columns.
+    """
+    if consumer is None:
+        return None
+    if consumer not in CONSUMERS:
+        raise ValueError(f"Unfamiliar metadata consumer: {consumer}. Expected one of {list(CONSUMERS)}")
+    columns = CONSUMERS[consumer]
+    return None if columns is None else list(columns)
+
+
+def get_dtypes(columns=None):
+    """Get the dtypes to parse metadata columns as.
+
+    Parameters
+    ----------
+    columns : Iterable[str], optional
+        The columns to get the dtypes of. Columns which are not in
+        :data:`SCHEMA` are omitted, and left for pandas to infer. By default,
+        the dtypes of all the columns in the schema are returned.
+
+    Returns
+    -------
+    dict
+        Mapping from column name to dtype.
+    """
+    if columns is None:
+        return dict(SCHEMA)
+    return {c: SCHEMA[c] for c in columns if c in SCHEMA}
+
+
+def resolve_engine(engine=None):
+    """Get the parser engine :func:`read_metadata` reads with.
+
+    Parameters
+    ----------
+    engine : str, optional
+        The ``engine`` argument of :func:`read_metadata`.
+
+    Returns
+    -------
+    str
+        ``"c"``, ``"python"`` or ``"pyarrow"``.
+    """
+    if engine == "auto":
+        return "pyarrow" if importlib.util.find_spec("pyarrow") is not None else "c"
+    return engine or "c"
+
+
+def downcast_numeric(df):
+    """Convert the numeric columns of a DataFrame to their smallest lossless dtype, in place.
+
+    Integer columns (including nullable ones) are downcast to the smallest
+    integer dtype which holds their range. Float columns are only converted
+    to ``float32`` if every value survives the round trip exactly, so the
+    values reported by the statistics are unchanged.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The metadata.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The same DataFrame.
+    """
+    for name in df.columns:
+        column = df[name]
+        if pd.api.types.is_bool_dtype(column.dtype) or not pd.api.types.is_numeric_dtype(column.dtype):
+            continue
+        if pd.api.types.is_integer_dtype(column.dtype):
+            low = column.min()
+            if pd.isna(low):
+                continue
+            df[name] = pd.to_numeric(column, downcast="unsigned" if low >= 0 else "integer")
+        elif column.dtype == np.float64:
+            values = column.to_numpy()
+            downcast = values.astype(np.float32)
+            if np.array_equal(downcast.astype(np.float64), values, equal_nan=True):
+                df[name] = downcast
+    return df
+
+
+def read_metadata(path, consumer=None, usecols=None, downcast=True, engine=None, **kwargs):
+    """Read a metadata CSV file with the dtypes of the schema.
+
+    Parameters
+    ----------
+    path : str
+        Path to the metadata CSV file.
+    consumer : str, optional
+        The consumer to read the columns of. See :data:`CONSUMERS`.
+    usecols : Iterable[str], optional
+        The columns to read, instead of those of the ``consumer``. Columns
+        which are not in the file are skipped. By default, all the columns
+        are read.
+    downcast : bool, default=True
+        Whether to downcast numeric columns. See :func:`downcast_numeric`.
+    engine : str, optional
+        The parser engine for :func:`pandas.read_csv`: ``"c"``,
+        ``"python"`` or ``"pyarrow"``, which parses with multiple threads.
+        Use ``"auto"`` for ``"pyarrow"`` when it is installed, and ``"c"``
+        otherwise. Default is ``"c"``.
+    **kwargs
+        Further arguments for :func:`pandas.read_csv`.
+
+    Returns
+    -------
+    pandas.DataFrame
+    """
+    if usecols is None:
+        usecols = get_columns(consumer)
+    header = pd.read_csv(path, nrows=0, **kwargs).columns
+    if usecols is not None:
+        # Order the columns as in the file, as pandas.read_csv does
+        usecols = [c for c in header if c in set(usecols)]
+    dtype = get_dtypes(header if usecols is None else usecols)
+    df = pd.read_csv(path, dtype=dtype, usecols=usecols, engine=resolve_engine(engine), **kwargs)
+    if downcast:
+        downcast_numeric(df)
+    return df
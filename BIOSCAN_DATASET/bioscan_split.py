@@ -18,87 +18,15 @@ from tqdm.auto import tqdm
 import matplotlib.pyplot as plt
 from IPython.display import display
 
+from bioscan_schema import get_dtypes, read_metadata
+
 tqdm.pandas()
 
 taxon_cols = ["phylum", "class", "order", "family", "subfamily", "genus", "species"]
 seen_partitions = ["seen", "train", "val", "test"]
 unseen_partitions = ["unseen", "key_unseen", "val_unseen", "test_unseen"]
 
-df_dtypes = {
-    "processid": "str",
-    "sampleid": "str",
-    "uri_preconflictres": "category",
-    "taxon_preconflictres": "category",
-    "phylum_preconflictres": "category",
-    "class_preconflictres": "category",
-    "order_preconflictres": "category",
-    "family_preconflictres": "category",
-    "subfamily_preconflictres": "category",
-    "genus_preconflictres": "category",
-    "species_preconflictres": "category",
-    "nucraw": str,
-    "dna_barcode": str,
-    "dna_bin": "category",
-    "country": "category",
-    "province/state": "category",
-    "province_state": "category",
-    "coord-lat": float,
-    "coord-lon": float,
-    "image_measurement_value": float,
-    "image_measurement_context": "category",
-    "area_fraction": float,
-    "scale_factor": float,
-    "image_file": str,
-    "chunk_number": "uint8",
-    "chunk": str,
-    "index_bioscan_1M_insect": "Int64",
-    "_phylum_original": "category",
-    "_class_original": "category",
-    "_order_original": "category",
-    "_family_original": "category",
-    "_subfamily_original": "category",
-    "_genus_original": "category",
-    "_species_original": "category",
-    "_taxon_original": "category",
-    "_uri_original": "category",
-    "_nucraw_original": "category",
-    "_phylum_fixtypos": "category",
-    "_class_fixtypos": "category",
-    "_order_fixtypos": "category",
-    "_family_fixtypos": "category",
-    "_subfamily_fixtypos": "category",
-    "_genus_fixtypos": "category",
-    "_species_fixtypos": "category",
-    "_taxon_fixtypos": "category",
-    "_rank": "Int64",
-    "phylum_conflictres": "category",
-    "class_conflictres": "category",
-    "order_conflictres": "category",
-    "family_conflictres": "category",
-    "subfamily_conflictres": "category",
-    "genus_conflictres": "category",
-    "species_conflictres": "category",
-    "taxon_conflictres": "category",
-    "uri_conflictres": "category",
-    "ratio": float,
-    "conflicted": bool,
-    "conflicted_uri": bool,
-    "is_novel_species": "boolean",
-    "inferred_ranks": "uint8",
-    "label_was_reworded": "uint8",
-    "label_was_manualeditted": "uint8",
-    "label_was_inferred": "uint8",
-    "label_was_dropped": "uint8",
-    "split": "str",
-    "taxon": "category",
-    "phylum": "category",
-    "class": "category",
-    "order": "category",
-    "family": "category",
-    "subfamily": "category",
-    "genus": "category",
-    "species": "category",
-}
+df_dtypes = get_dtypes()
 
 
 def find_novel_species(df, verbose=0):
@@ -472,7 +400,7 @@ def show_partition_stats(df, show_empty=False):
     print("\n" + out)
 
 
-def main(input_csv, output_csv, verbose=1):
+def main(input_csv, output_csv, engine=None, verbose=1):
     """
     Partition data into splits.
 
@@ -493,13 +421,16 @@ def main(input_csv, output_csv, verbose=1):
         Input CSV file name.
     output_csv : str
         Output CSV file name.
+    engine : str, optional
+        Parser engine for reading the input CSV file.
+        See :func:`bioscan_schema.read_metadata`.
     verbose : int, default=1
         Verbosity level.
     """
     # Load metadata
     if verbose >= 0:
         print(f"Loading {input_csv}")
-    df = pd.read_csv(input_csv, dtype=df_dtypes)
+    df = read_metadata(input_csv, consumer="split", engine=engine, downcast=False)
     if verbose >= 0:
         print("Finished loading metadata.")
     if verbose >= 1:
@@ -1219,6 +1150,13 @@ def get_parser():
         default="BIOSCAN-5M_Dataset_partitioned.csv",
         help="Path to save the partitioned dataset.",
     )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default=None,
+        choices=["c", "python", "pyarrow", "auto"],
+        help="Parser engine for reading the CSV file. Default is c.",
+    )
     # Verbosity args ----------------------------------------------------------
     group = parser.add_argument_group("Verbosity")
     group.add_argument(
@@ -1243,7 +1181,7 @@ def cli():
     args = parser.parse_args()
     args.verbose -= args.quiet
     del args.quiet
-    main(args.input_csv, args.output_csv, verbose=args.verbose)
+    main(args.input_csv, args.output_csv, engine=args.engine, verbose=args.verbose)
 
 
 if __name__ == "__main__":
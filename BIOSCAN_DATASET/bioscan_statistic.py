@@ -4,6 +4,7 @@ from pyspark.sql.functions import monotonically_increasing_id, size, col, collec
 import math
 from tabulate import tabulate
 from bioscan_dataset import BioScan
+import dataset_helper
 import pandas as pd
 import os
 import numpy as np
@@ -103,10 +104,9 @@ class BioScanStats:
         ]
         print(tabulate(formatted_rows, headers=headings, tablefmt="grid"))
 
-    def get_imbalance_ratio(self, data_dict):
+    def get_imbalance_ratio(self, class_counts):
 
-        data_dict_length = {key: len(value)
-                            for key, value in data_dict.items() if key != 'no_data'}
+        data_dict_length = {key: count for key, count in class_counts.items() if key != 'no_data'}
 
         # If using sorted class
         # clas = list(data_dict_length.keys())
@@ -118,58 +118,98 @@ class BioScanStats:
 
         return imbalance_ratio
 
-    def get_stat_dict(self, dataset, attr_list, dict_type='Genetic Attributes'):
+    def get_attr_stat(self, dataset, attr):
+        """
+        This function calculates the statistics of one attribute.
+        :param dataset: Class BioScan Dataset.
+        :param attr: Attribute name.
+        :return: Dictionary of the statistics, keyed by table column.
+        """
+
+        groups = dataset.get_class_groups(attr)
+        class_counts = dict(zip(groups.classes, groups.counts.tolist()))
+
+        n_no_data, n_cat = 0, len(class_counts)
+        if np.nan in class_counts:
+            n_no_data, n_cat = class_counts[np.nan], len(class_counts) - 1
+
+        return {'Categories': n_cat,
+                'Labelled Samples': len(dataset.index) - n_no_data,
+                'Labelled (%)': 100 * (len(dataset.index) - n_no_data) / len(dataset.index),
+                'Unlabelled Samples': n_no_data,
+                'Unlabelled (%)': 100 * n_no_data / len(dataset.index),
+                'Imbalance Ratio (IR)': self.get_imbalance_ratio(class_counts)}
+
+    def get_stat_dict(self, dataset, attr_list, dict_type='Genetic Attributes', cache=None):
+        """
+        This function calculates the statistics table of a list of attributes.
+        :param dataset: Class BioScan Dataset.
+        :param attr_list: Attribute names.
+        :param dict_type: Heading of the attribute column.
+        :param cache: dataset_helper.ResultCache to reuse the statistics of each attribute from. Optional.
+        :return:
+        """
 
         g_dict = {dict_type: [], 'Categories': [], 'Labelled Samples': [], 'Labelled (%)': [],
                   'Unlabelled Samples': [], 'Unlabelled (%)': [], 'Imbalance Ratio (IR)': []}
 
         for attr in attr_list:
 
-            lst = dataset.data_list_mapping.get(attr)
-            attr_dict = dataset.make_data_dict(lst)
-
-            n_no_data, n_cat = 0, len(attr_dict.keys())
-            if np.nan in attr_dict.keys():
-                n_no_data, n_cat = len(attr_dict[np.nan]), len(attr_dict.keys()) - 1
+            if cache is not None:
+                attr_stat = cache.get_or_compute(attr, lambda: self.get_attr_stat(dataset, attr))
+            else:
+                attr_stat = self.get_attr_stat(dataset, attr)
 
             g_dict[dict_type].append(attr)
-            g_dict['Categories'].append(n_cat)
-            g_dict['Labelled Samples'].append(len(dataset.index) - n_no_data)
-            g_dict['Labelled (%)'].append(100 * (len(dataset.index) - n_no_data) / len(dataset.index))
-            g_dict['Unlabelled Samples'].append(n_no_data)
-            g_dict['Unlabelled (%)'].append(100 * n_no_data / len(dataset.index))
-            g_dict['Imbalance Ratio (IR)'].append(self.get_imbalance_ratio(attr_dict))
+            for key, value in attr_stat.items():
+                g_dict[key].append(value)
 
         return g_dict
 
-    def get_attribute_statistics(self, dataset, level_name, get_attr='genetic'):
+    def get_attribute_report(self, dataset, get_attr='genetic', cache=None):
         """
-        This function shows data statistics from metadata file of the dataset.
+        This function calculates the statistics table of a type of attributes.
         :param dataset: Class BioScan Dataset.
-        :param get_attr:
-        :return:
+        :param get_attr: Type of attributes: genetic, geographic or size.
+        :param cache: dataset_helper.ResultCache to reuse the statistics of each attribute from. Optional.
+        :return: Dictionary of the number of samples and the statistics table.
         """
 
         if get_attr == 'genetic':
-            list_attr = list({**dataset.taxonomy_groups_list_dict}.keys())
+            list_attr = list(dataset.taxonomy_groups_list_dict.keys())
             list_attr.append('dna_bin')
             list_attr.append('dna_barcode')
         elif get_attr == 'geographic':
-            list_attr = list({**dataset.geographic_list_dict}.keys())
+            list_attr = list(dataset.geographic_list_dict.keys())
         elif get_attr == 'size':
-            list_attr = list({**dataset.size_list_dict}.keys())
+            list_attr = list(dataset.size_list_dict.keys())
         else:
             raise ValueError('Attribute type is NOT available!')
 
-        g_dict = self.get_stat_dict(dataset, list_attr, dict_type=f'{get_attr.capitalize()} Attributes')
+        g_dict = self.get_stat_dict(dataset, list_attr, dict_type=f'{get_attr.capitalize()} Attributes', cache=cache)
+        return {'n_samples': len(dataset.index), 'table': g_dict}
+
+    def print_report(self, report, get_attr='genetic'):
 
         # Print statistics
-        scale = int(math.floor(math.log10(abs(len(dataset.index)))))
+        n_samples = report['n_samples']
+        scale = int(math.floor(math.log10(abs(n_samples))))
         s = 'k' if scale < 6 else 'M'
-        n = round(len(dataset.index) / 10 ** scale)
+        n = round(n_samples / 10 ** scale)
         title = f"{get_attr.capitalize()} Statistics of the BIOSCAN-{n}{s} Insect dataset "
-        title += f"having {len(dataset.index)} specimens"
-        self.print_table(g_dict, title, print_table=True)
+        title += f"having {n_samples} specimens"
+        self.print_table(report['table'], title, print_table=True)
+
+    def get_attribute_statistics(self, dataset, level_name, get_attr='genetic', cache=None):
+        """
+        This function shows data statistics from metadata file of the dataset.
+        :param dataset: Class BioScan Dataset.
+        :param get_attr:
+        :param cache: dataset_helper.ResultCache to reuse the statistics of each attribute from. Optional.
+        :return:
+        """
+
+        self.print_report(self.get_attribute_report(dataset, get_attr=get_attr, cache=cache), get_attr=get_attr)
 
     def get_dataset_statistics(self, configs, dataset):
         """
@@ -185,7 +225,17 @@ class BioScanStats:
         print(f"\n\nGenerating {configs['attr_stat'].capitalize()}"
               f" statistics of {configs['level_name'][0].capitalize()} {configs['level_name'][1].capitalize()} ...")
 
-        dataset.get_statistics(configs["metadata"], level_name=configs["level_name"])
+        cache = dataset_helper.ResultCache(configs['metadata'], 'statistics', configs['level_name'],
+                                           cache_dir=None if configs.get('stats_cache') else False,
+                                           engine=configs.get('csv_engine'))
+
+        def compute_report():
+            dataset.get_statistics(configs["metadata"], level_name=configs["level_name"],
+                                   consumer=f"statistics.{configs['attr_stat']}", engine=configs.get('csv_engine'),
+                                   index_cache=configs.get('index_cache', True))
+            return self.get_attribute_report(dataset, get_attr=configs['attr_stat'], cache=cache)
+
+        report = cache.get_or_compute(f"report.{configs['attr_stat']}", compute_report)
 
         print("\n\n"+"-" * 90)
         print(f"\t\t\t\t\t\t\t\tCopyright")
@@ -198,7 +248,7 @@ class BioScanStats:
         print("Copyright Year: 2021")
         print("-"*90 + "\n")
 
-        self.get_attribute_statistics(dataset, configs["level_name"], get_attr=configs['attr_stat'])
+        self.print_report(report, get_attr=configs['attr_stat'])
 
 
 def show_statistics(configs):
@@ -0,0 +1,809 @@
+"""
+Columnar storage for the BIOSCAN-5M metadata table.
+
+The metadata CSV is parsed once and each column is written to disk as a small
+set of ``.npy`` files. Subsequent loads memory-map those files instead of
+parsing the CSV again.
+"""
+
+import hashlib
+import json
+import os
+import warnings
+
+import numpy as np
+import pandas as pd
+
+CACHE_VERSION = 1
+
+# String columns with at most this many distinct values are dictionary-encoded
+MAX_DICTIONARY_SIZE = 2**16
+
+
+def file_fingerprint(path):
+    """Fingerprint a file by its absolute path, size and modification time.
+
+    Parameters
+    ----------
+    path : str
+        Path to the file.
+
+    Returns
+    -------
+    str
+        A short hexadecimal digest which changes whenever the file is replaced
+        or modified.
+    """
+    stat = os.stat(path)
+    h = hashlib.sha1()
+    h.update(os.path.abspath(path).encode("utf-8"))
+    h.update(str(stat.st_size).encode("utf-8"))
+    h.update(str(stat.st_mtime_ns).encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def _dtype_token(dtype):
+    """Get a stable string representation of a dtype specifier."""
+    if dtype is None:
+        return "infer"
+    if isinstance(dtype, type):
+        return dtype.__name__
+    return str(dtype)
+
+
+def load_array(path, mmap_mode="r"):
+    """Load a ``.npy`` file, memory-mapping it when possible."""
+    try:
+        return np.load(path, mmap_mode=mmap_mode)
+    except ValueError:
+        # Empty arrays can not be memory-mapped
+        return np.load(path)
+
+
+def ragged_arange(counts):
+    """Concatenate ``arange(count)`` for each count, without a Python loop."""
+    counts = np.asarray(counts, dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    return np.arange(counts.sum()) - np.repeat(starts, counts)
+
+
+def mix64(x):
+    """Mix 64-bit integers with the splitmix64 finalizer, as a fast hash."""
+    x = np.array(x, dtype=np.uint64)
+    x ^= x >> np.uint64(30)
+    x *= np.uint64(0xBF58476D1CE4E5B9)
+    x ^= x >> np.uint64(27)
+    x *= np.uint64(0x94D049BB133111EB)
+    x ^= x >> np.uint64(31)
+    return x
+
+
+def save_array(path, array):
+    """Save an array to a ``.npy`` file atomically."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_path, path)
+
+
+class StringColumn:
+    """
+    Variable-length strings packed into a single byte buffer.
+
+    String ``i`` is stored as ``data[offsets[i]:offsets[i + 1]]``, encoded as
+    UTF-8. Missing values are flagged in ``mask``.
+
+    Parameters
+    ----------
+    data : numpy.ndarray
+        The concatenated UTF-8 encoded strings, as ``uint8``.
+    offsets : numpy.ndarray
+        The ``int64`` start offset of each string, plus the end offset of the
+        last string.
+    mask : numpy.ndarray, optional
+        Boolean array which is ``True`` where the value is missing.
+    """
+
+    kind = "string"
+
+    def __init__(self, data, offsets, mask=None):
+        self.data = data
+        self.offsets = offsets
+        if mask is None:
+            mask = np.zeros(len(offsets) - 1, dtype=bool)
+        self.mask = mask
+
+    @classmethod
+    def from_strings(cls, values):
+        """Pack a sequence of strings, which may contain missing values.
+
+        Parameters
+        ----------
+        values : Iterable[str]
+            The strings to pack. Missing values (``None`` or NaN) are recorded
+            in the mask.
+
+        Returns
+        -------
+        StringColumn
+        """
+        values = pd.Series(values, dtype=object)
+        mask = values.isna().to_numpy()
+        encoded = values.where(~mask, "").str.encode("utf-8")
+        lengths = encoded.str.len().to_numpy(dtype=np.int64)
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(data, offsets, mask)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self):
+        """The length in bytes of each string."""
+        return np.diff(self.offsets)
+
+    def get_bytes(self, index):
+        """Get the raw bytes of a single string."""
+        return self.data[self.offsets[index] : self.offsets[index + 1]].tobytes()
+
+    def __getitem__(self, index):
+        if self.mask[index]:
+            return np.nan
+        return self.get_bytes(index).decode("utf-8")
+
+    def take(self, indices):
+        """Gather a subset of the strings into a new, contiguous column.
+
+        Parameters
+        ----------
+        indices : numpy.ndarray
+            Integer positions of the strings to take.
+
+        Returns
+        -------
+        StringColumn
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        starts = self.offsets[indices]
+        lengths = self.offsets[indices + 1] - starts
+        offsets = np.zeros(len(indices) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        positions = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+        return type(self)(np.asarray(self.data)[positions], offsets, np.asarray(self.mask)[indices])
+
+    def to_numpy(self, indices=None):
+        """Decode the strings into an object array.
+
+        Parameters
+        ----------
+        indices : numpy.ndarray, optional
+            Integer positions of the strings to decode. By default, all
+            strings are decoded.
+
+        Returns
+        -------
+        numpy.ndarray
+            Object array of ``str``, with NaN for missing values.
+        """
+        column = self if indices is None else self.take(indices)
+        buffer = np.asarray(column.data).tobytes()
+        offsets = np.asarray(column.offsets).tolist()
+        if not buffer.isascii():
+            out = [buffer[a:b].decode("utf-8") for a, b in zip(offsets[:-1], offsets[1:])]
+        else:
+            # Slicing a str is much faster than decoding each substring
+            text = buffer.decode("ascii")
+            out = [text[a:b] for a, b in zip(offsets[:-1], offsets[1:])]
+        out = np.array(out, dtype=object)
+        out[np.asarray(column.mask)] = np.nan
+        return out
+
+    def to_pandas(self, indices=None):
+        return self.to_numpy(indices)
+
+    def isin(self, values):
+        """Test which strings are equal to any of the given values.
+
+        Parameters
+        ----------
+        values : Iterable[str]
+            The values to match against.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask, ``True`` where the string is one of ``values``.
+        """
+        data = np.asarray(self.data)
+        starts = np.asarray(self.offsets[:-1])
+        lengths = self.lengths
+        out = np.zeros(len(self), dtype=bool)
+        for value in values:
+            if not isinstance(value, str):
+                continue
+            target = np.frombuffer(value.encode("utf-8"), dtype=np.uint8)
+            candidates = np.flatnonzero(lengths == len(target))
+            if len(target):
+                chars = data[starts[candidates, None] + np.arange(len(target))]
+                candidates = candidates[(chars == target).all(axis=1)]
+            out[candidates] = True
+        out &= ~np.asarray(self.mask)
+        return out
+
+    def arrays(self):
+        return {"data": self.data, "offsets": self.offsets, "mask": self.mask}
+
+
+class CategoricalColumn:
+    """
+    Dictionary-encoded column.
+
+    Parameters
+    ----------
+    codes : numpy.ndarray
+        Integer code of each value, with ``-1`` for missing values.
+    categories : numpy.ndarray
+        Object array of the category names.
+    as_str : bool, default=False
+        Whether the column should be presented to pandas as plain strings,
+        instead of as a categorical.
+    """
+
+    kind = "categorical"
+
+    def __init__(self, codes, categories, as_str=False):
+        self.codes = codes
+        self.categories = np.asarray(categories, dtype=object)
+        self.as_str = as_str
+
+    @classmethod
+    def from_series(cls, series, as_str=False):
+        """Build a column from a pandas Series.
+
+        Parameters
+        ----------
+        series : pandas.Series
+            The values to encode. If the series is not already categorical,
+            it is converted.
+        as_str : bool, default=False
+            Whether the column should be presented to pandas as plain strings.
+
+        Returns
+        -------
+        CategoricalColumn
+        """
+        if not isinstance(series.dtype, pd.CategoricalDtype):
+            series = series.astype("category")
+        return cls(series.cat.codes.to_numpy(), series.cat.categories.to_numpy(dtype=object), as_str=as_str)
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        code = self.codes[index]
+        if code < 0:
+            return np.nan
+        return self.categories[code]
+
+    def to_numpy(self, indices=None):
+        """Decode the values into an object array, with NaN for missing values."""
+        codes = np.asarray(self.codes) if indices is None else np.asarray(self.codes)[indices]
+        if not len(self.categories):
+            return np.full(len(codes), np.nan, dtype=object)
+        out = self.categories[np.maximum(codes, 0)]
+        out[codes < 0] = np.nan
+        return out
+
+    def to_pandas(self, indices=None):
+        if self.as_str:
+            return self.to_numpy(indices)
+        codes = np.asarray(self.codes) if indices is None else np.asarray(self.codes)[indices]
+        return pd.Categorical.from_codes(codes, categories=self.categories)
+
+    def isin(self, values):
+        """Test which values are in a set of category names.
+
+        Parameters
+        ----------
+        values : Iterable[str]
+            The category names to match against.
+
+        Returns
+        -------
+        numpy.ndarray
+            Boolean mask, ``True`` where the value is one of ``values``.
+        """
+        matches = np.flatnonzero(pd.Index(self.categories).isin(list(values)))
+        return np.isin(self.codes, matches)
+
+    def arrays(self):
+        categories = StringColumn.from_strings(self.categories)
+        return {"codes": self.codes, "categories.data": categories.data, "categories.offsets": categories.offsets}
+
+
+class NumericColumn:
+    """
+    Numeric column, optionally with a mask of missing values.
+
+    Parameters
+    ----------
+    values : numpy.ndarray
+        The values.
+    mask : numpy.ndarray, optional
+        Boolean array which is ``True`` where the value is missing. Only used
+        for pandas nullable dtypes, such as ``"Int64"``.
+    dtype : str, optional
+        The pandas nullable dtype to restore, if any.
+    """
+
+    kind = "numeric"
+
+    def __init__(self, values, mask=None, dtype=None):
+        self.values = values
+        self.mask = mask
+        self.dtype = dtype
+
+    @classmethod
+    def from_series(cls, series):
+        if isinstance(series.dtype, pd.api.extensions.ExtensionDtype):
+            mask = series.isna().to_numpy()
+            numpy_dtype = series.dtype.numpy_dtype
+            values = series.to_numpy(dtype=numpy_dtype, na_value=numpy_dtype.type(0))
+            return cls(values, mask, dtype=str(series.dtype))
+        return cls(series.to_numpy())
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if self.mask is not None and self.mask[index]:
+            return pd.NA
+        return self.values[index]
+
+    def to_numpy(self, indices=None):
+        """Get the values as an array, with NaN for missing values."""
+        values = np.asarray(self.values) if indices is None else np.asarray(self.values)[indices]
+        if self.mask is None:
+            return values
+        mask = np.asarray(self.mask) if indices is None else np.asarray(self.mask)[indices]
+        values = values.astype(float)
+        values[mask] = np.nan
+        return values
+
+    def to_pandas(self, indices=None):
+        values = np.asarray(self.values)
+        mask = None if self.mask is None else np.asarray(self.mask)
+        if indices is not None:
+            values = values[indices]
+            mask = None if mask is None else mask[indices]
+        if mask is None:
+            return values
+        out = pd.array(values, dtype=self.dtype)
+        out[mask] = pd.NA
+        return out
+
+    def isin(self, values):
+        """Test which values are in a set of numbers."""
+        out = np.isin(self.values, list(values))
+        if self.mask is not None:
+            out &= ~np.asarray(self.mask)
+        return out
+
+    def arrays(self):
+        out = {"values": self.values}
+        if self.mask is not None:
+            out["mask"] = self.mask
+        return out
+
+
+def column_from_series(series, dtype=None):
+    """Convert a pandas Series into the matching column type.
+
+    Parameters
+    ----------
+    series : pandas.Series
+        The parsed column.
+    dtype : str or type, optional
+        The dtype the column was requested to be parsed as.
+
+    Returns
+    -------
+    StringColumn or CategoricalColumn or NumericColumn
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return CategoricalColumn.from_series(series)
+    if series.dtype == object:
+        n_unique = series.nunique(dropna=True)
+        if n_unique <= MAX_DICTIONARY_SIZE and n_unique <= len(series) // 2:
+            return CategoricalColumn.from_series(series, as_str=True)
+        return StringColumn.from_strings(series)
+    return NumericColumn.from_series(series)
+
+
+class MetadataTable:
+    """
+    A table of columns, each backed by NumPy arrays.
+
+    Parameters
+    ----------
+    columns : dict
+        Mapping from column name to column object.
+    cache_dir : str, optional
+        The cache directory the columns were loaded from, which is specific
+        to the metadata file. Other data derived from the table can be cached
+        alongside the columns there. ``None`` if the table is not cached on
+        disk.
+    """
+
+    def __init__(self, columns, cache_dir=None):
+        self.columns = dict(columns)
+        self.cache_dir = cache_dir
+        lengths = {len(col) for col in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have mismatched lengths: {sorted(lengths)}")
+        self.n_rows = lengths.pop() if lengths else 0
+
+    def __len__(self):
+        return self.n_rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name in self.columns
+
+    def keys(self):
+        return self.columns.keys()
+
+    def to_dataframe(self, rows=None, columns=None):
+        """Materialize the table, or a subset of it, as a pandas DataFrame.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray, optional
+            Integer positions of the rows to include. These are also used as
+            the index of the output. By default, all rows are included.
+        columns : Iterable[str], optional
+            The columns to include. By default, all columns are included.
+
+        Returns
+        -------
+        pandas.DataFrame
+        """
+        if columns is None:
+            columns = self.columns.keys()
+        index = pd.RangeIndex(self.n_rows) if rows is None else pd.Index(rows)
+        data = {c: self.columns[c].to_pandas(rows) for c in columns}
+        return pd.DataFrame(data, index=index)
+
+
+def _predicate_mask(column, predicate, rows=None):
+    """Evaluate a predicate on a column, for the given rows."""
+    if callable(predicate):
+        return np.asarray(predicate(column.to_numpy(rows)), dtype=bool)
+    if isinstance(predicate, tuple):
+        low, high = predicate
+        values = column.to_numpy(rows)
+        mask = np.ones(len(values), dtype=bool)
+        # Comparisons with missing values (NaN) are False, so they are excluded
+        with np.errstate(invalid="ignore"):
+            if low is not None:
+                mask &= values >= low
+            if high is not None:
+                mask &= values <= high
+        return mask
+    if isinstance(predicate, str) or np.isscalar(predicate):
+        predicate = [predicate]
+    mask = column.isin(predicate)
+    return mask if rows is None else mask[rows]
+
+
+def evaluate_filters(table, filters, rows=None):
+    """Evaluate predicates on the columns of a table.
+
+    Each predicate is evaluated on the column arrays (category codes for
+    categorical columns), without building a DataFrame.
+
+    Parameters
+    ----------
+    table : MetadataTable
+        The metadata table.
+    filters : dict
+        Mapping from column name to a predicate on the column, which is one of:
+
+        - a value, or list of values, to keep;
+        - a tuple ``(low, high)`` of inclusive bounds on the values to keep,
+          where either bound can be ``None`` to leave it open;
+        - a callable, which is given the values of the column as an array
+          and returns a boolean mask of those to keep.
+
+        Missing values never match a value or range.
+    rows : numpy.ndarray, optional
+        Positions of the rows to evaluate the predicates on. By default, all
+        rows are used.
+
+    Returns
+    -------
+    numpy.ndarray
+        Boolean mask over ``rows``, ``True`` where every predicate holds.
+    """
+    mask = np.ones(len(table) if rows is None else len(rows), dtype=bool)
+    for name, predicate in filters.items():
+        mask &= _predicate_mask(table[name], predicate, rows)
+    return mask
+
+
+def _column_codes(column):
+    """Get the dictionary codes and categories of a column of strings."""
+    if isinstance(column, CategoricalColumn):
+        return np.asarray(column.codes), list(column.categories)
+    codes, categories = pd.factorize(column.to_numpy())
+    return codes, list(categories)
+
+
+class ImagePathIndex:
+    """
+    The relative path to the image of each row in the metadata table.
+
+    Paths are stored as the directory of the image (``split/chunk/``), which
+    is shared by many rows and so stored once, and the file name, which is
+    the processid of the row and is not copied.
+
+    Parameters
+    ----------
+    prefixes : list[str]
+        The distinct directories, each ending with a separator.
+    prefix_codes : numpy.ndarray
+        The position in ``prefixes`` of the directory of each row.
+    names : StringColumn or CategoricalColumn
+        The file name of each row, without the suffix.
+    suffix : str, default=".jpg"
+        The file name extension.
+    """
+
+    def __init__(self, prefixes, prefix_codes, names, suffix=".jpg"):
+        self.prefixes = list(prefixes)
+        self.prefix_codes = prefix_codes
+        self.names = names
+        self.suffix = suffix
+
+    @classmethod
+    def from_table(cls, table, suffix=".jpg"):
+        """Build the index from the ``split``, ``chunk`` and ``processid`` columns.
+
+        Parameters
+        ----------
+        table : MetadataTable
+            The metadata table.
+        suffix : str, default=".jpg"
+            The file name extension.
+
+        Returns
+        -------
+        ImagePathIndex
+        """
+        split_codes, splits = _column_codes(table["split"])
+        chunk_codes, chunks = _column_codes(table["chunk"])
+        # Rows with an empty chunk are stored directly in the split directory
+        chunk_codes = np.where(chunk_codes >= 0, chunk_codes, len(chunks))
+        chunks = [c if isinstance(c, str) else "" for c in chunks] + [""]
+        keys = split_codes.astype(np.int64) * len(chunks) + chunk_codes
+        keys, prefix_codes = np.unique(keys, return_inverse=True)
+        prefixes = []
+        for key in keys.tolist():
+            split, chunk = divmod(key, len(chunks))
+            parts = [splits[split] if split >= 0 else "", chunks[chunk]]
+            prefixes.append("".join(part + os.path.sep for part in parts if part))
+        return cls(prefixes, prefix_codes.astype(np.int32), table["processid"], suffix=suffix)
+
+    def __len__(self):
+        return len(self.prefix_codes)
+
+    def __getitem__(self, row):
+        return self.prefixes[self.prefix_codes[row]] + self.names[row] + self.suffix
+
+    def to_strings(self, rows=None):
+        """Build the paths as a :class:`StringColumn`.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray, optional
+            Positions of the rows in the table. By default, the paths of all
+            rows are built.
+
+        Returns
+        -------
+        StringColumn
+        """
+        if rows is None:
+            rows = np.arange(len(self))
+        rows = np.asarray(rows, dtype=np.int64).reshape(-1)
+        if isinstance(self.names, StringColumn):
+            names = self.names.take(rows)
+        else:
+            names = StringColumn.from_strings(self.names.to_numpy(rows))
+        prefixes = StringColumn.from_strings(self.prefixes)
+        suffix = np.frombuffer(self.suffix.encode("utf-8"), dtype=np.uint8)
+        codes = np.asarray(self.prefix_codes)[rows]
+        prefix_lengths = prefixes.lengths[codes]
+        name_lengths = names.lengths
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(prefix_lengths + name_lengths + len(suffix), out=offsets[1:])
+        data = np.empty(offsets[-1], dtype=np.uint8)
+        starts = offsets[:-1]
+        data[np.repeat(starts, prefix_lengths) + ragged_arange(prefix_lengths)] = prefixes.data[
+            np.repeat(prefixes.offsets[codes], prefix_lengths) + ragged_arange(prefix_lengths)
+        ]
+        starts = starts + prefix_lengths
+        data[np.repeat(starts, name_lengths) + ragged_arange(name_lengths)] = names.data
+        starts = starts + name_lengths
+        data[(starts[:, None] + np.arange(len(suffix))).reshape(-1)] = np.tile(suffix, len(rows))
+        return StringColumn(data, offsets, np.asarray(names.mask))
+
+    def to_numpy(self, rows=None):
+        """Build the paths as an object array of ``str``, with NaN where the processid is missing."""
+        return self.to_strings(rows).to_numpy()
+
+
+def load_image_path_index(table, image_package, cache_dir=None):
+    """Load the image paths of a metadata table, using the on-disk cache.
+
+    Parameters
+    ----------
+    table : MetadataTable
+        The metadata table.
+    image_package : str
+        The image package the paths are for. Each package has its own index.
+    cache_dir : str, optional
+        Directory to cache the index in, which should be specific to the
+        metadata file (such as :attr:`MetadataTable.cache_dir`). If ``None``,
+        the index is built in memory.
+
+    Returns
+    -------
+    ImagePathIndex
+    """
+    if cache_dir is None:
+        return ImagePathIndex.from_table(table)
+    index_dir = os.path.join(cache_dir, "image_paths", image_package)
+    header_path = os.path.join(index_dir, "header.json")
+    codes_path = os.path.join(index_dir, "prefix_codes.npy")
+    header = None
+    if os.path.isfile(header_path):
+        with open(header_path) as f:
+            header = json.load(f)
+    if header is None or header.get("version") != CACHE_VERSION or header.get("n_rows") != len(table):
+        index = ImagePathIndex.from_table(table)
+        try:
+            os.makedirs(index_dir, exist_ok=True)
+            save_array(codes_path, index.prefix_codes)
+            header = {
+                "version": CACHE_VERSION,
+                "n_rows": len(index),
+                "prefixes": index.prefixes,
+                "suffix": index.suffix,
+            }
+            tmp_path = f"{header_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(header, f)
+            os.replace(tmp_path, header_path)
+        except OSError as err:
+            warnings.warn(f"Unable to write image path index to {index_dir}: {err}", stacklevel=2)
+            return index
+    return ImagePathIndex(header["prefixes"], load_array(codes_path), table["processid"], suffix=header["suffix"])
+
+
+def _column_path(cache_dir, name, suffix):
+    return os.path.join(cache_dir, f"{name}.{suffix}")
+
+
+def _save_column(cache_dir, name, column, dtype):
+    """Write a column to the cache directory.
+
+    The arrays are written first, and the JSON header last, so a column is
+    only ever seen by readers once it is complete.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    arrays = column.arrays()
+    for key, array in arrays.items():
+        save_array(_column_path(cache_dir, name, f"{key}.npy"), array)
+    header = {
+        "version": CACHE_VERSION,
+        "dtype": _dtype_token(dtype),
+        "kind": column.kind,
+        "n_rows": len(column),
+        "arrays": sorted(arrays.keys()),
+    }
+    if column.kind == "categorical":
+        header["as_str"] = column.as_str
+    if column.kind == "numeric":
+        header["nullable_dtype"] = column.dtype
+    path = _column_path(cache_dir, name, "json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(header, f)
+    os.replace(tmp_path, path)
+
+
+def _load_column(cache_dir, name, dtype):
+    """Memory-map a column from the cache directory.
+
+    Returns ``None`` if the column is not cached, or was cached with a
+    different dtype.
+    """
+    path = _column_path(cache_dir, name, "json")
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        header = json.load(f)
+    if header.get("version") != CACHE_VERSION or header.get("dtype") != _dtype_token(dtype):
+        return None
+    arrays = {key: load_array(_column_path(cache_dir, name, f"{key}.npy")) for key in header["arrays"]}
+    if header["kind"] == "string":
+        return StringColumn(arrays["data"], arrays["offsets"], arrays["mask"])
+    if header["kind"] == "categorical":
+        categories = StringColumn(arrays["categories.data"], arrays["categories.offsets"]).to_numpy()
+        return CategoricalColumn(arrays["codes"], categories, as_str=header["as_str"])
+    return NumericColumn(arrays["values"], arrays.get("mask"), dtype=header["nullable_dtype"])
+
+
+def load_metadata_table(path, dtype=None, usecols=None, cache_dir=None):
+    """Load the metadata CSV as a :class:`MetadataTable`, using an on-disk cache.
+
+    Each column is cached separately in a subdirectory of ``cache_dir`` named
+    after the fingerprint of the CSV file (its path, size and modification
+    time). A cached column is only reused if it was parsed with the same
+    dtype as is requested now. Columns which are missing from the cache are
+    parsed from the CSV and added to it.
+
+    Parameters
+    ----------
+    path : str
+        Path to the metadata CSV file.
+    dtype : dict, optional
+        Mapping from column name to the dtype to parse it as.
+    usecols : list[str], optional
+        The columns to load. If omitted, all the columns in ``dtype`` are
+        loaded.
+    cache_dir : str, optional
+        Root directory for the cache. If ``None``, the CSV is parsed and no
+        cache is used.
+
+    Returns
+    -------
+    MetadataTable
+    """
+    if dtype is None:
+        dtype = {}
+    if usecols is None:
+        usecols = list(dtype.keys())
+    # Order the columns as in the file, as pandas.read_csv does
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in header if c in set(usecols)]
+    columns = {}
+    missing = list(usecols)
+    if cache_dir is not None:
+        cache_dir = os.path.join(cache_dir, file_fingerprint(path))
+        missing = []
+        for name in usecols:
+            column = _load_column(cache_dir, name, dtype.get(name))
+            if column is None:
+                missing.append(name)
+            else:
+                columns[name] = column
+    if missing:
+        df = pd.read_csv(path, dtype={c: dtype[c] for c in missing if c in dtype}, usecols=missing)
+        for name in missing:
+            columns[name] = column_from_series(df[name], dtype.get(name))
+        del df
+        if cache_dir is not None:
+            try:
+                for name in missing:
+                    _save_column(cache_dir, name, columns[name], dtype.get(name))
+                    columns[name] = _load_column(cache_dir, name, dtype.get(name))
+            except OSError as err:
+                warnings.warn(f"Unable to write metadata cache to {cache_dir}: {err}", stacklevel=2)
+                cache_dir = None
+    return MetadataTable({name: columns[name] for name in usecols}, cache_dir=cache_dir)
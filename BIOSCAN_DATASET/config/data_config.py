@@ -38,6 +38,12 @@ def config_base(parser):
                         default='BIOSCAN_metadata/BIOSCAN_5M_Insect_Dataset_metadata.csv',
                         help='Path to the metadata file of the dataset.')
 
+    parser.add_argument('--csv_engine',
+                        type=str,
+                        default=None,
+                        choices=['c', 'python', 'pyarrow', 'auto'],
+                        help='Parser engine for reading the metadata file; auto uses pyarrow if it is installed.')
+
     parser.add_argument('--bbox',
                         type=str,
                         default='/BIOSCAN_5M_Insect_bbox.tsv',
@@ -65,6 +71,18 @@ def config_run_module(parser):
                         choices=['genetic', 'geographic', 'size'],
                         help='Attribute to get distribution, if None skip distribution module.')
 
+    parser.add_argument('--stats_cache',
+                        default=False,
+                        action='store_true',
+                        help='Save statistics and distributions in a cache directory next to the metadata file, '
+                             'and reuse them while the file is unchanged.')
+
+    parser.add_argument('--no_index_cache',
+                        dest='index_cache',
+                        default=True,
+                        action='store_false',
+                        help='Keep the taxonomy index of subsets in memory instead of saving it next to the metadata.')
+
     parser.add_argument('--plot_type',
                         type=str,
                         default='heatmap',
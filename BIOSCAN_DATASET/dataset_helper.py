@@ -8,7 +8,12 @@ import pandas as pd
 import io
 from PIL import Image
 import csv
+import json
+from collections.abc import Mapping
 from pathlib import Path
+from urllib.parse import quote
+import bioscan_schema
+from bioscan_table import file_fingerprint, load_array, save_array
 
 
 class CustomArg:
@@ -57,11 +62,12 @@ def extract_zip(zip_file=None, path=None):
     with zipfile.ZipFile(zip_file, 'r') as zip_ref:
         zip_ref.extractall(path)
 
-def create_hdf5(date_time, dataset_name='', path='', data_typ='Original Full Size', author='Zahra Gharaee'):
+def create_hdf5(date_time, dataset_name='', path='', data_typ='Original Full Size', author='Zahra Gharaee',
+                dataset_title='BIOSCAN_1M Insect Dataset'):
 
     with h5py.File(path, 'w') as hdf5:
         dataset = hdf5.create_group(dataset_name)
-        dataset.attrs['Description'] = f'BIOSCAN_1M Insect Dataset: {data_typ} Images'
+        dataset.attrs['Description'] = f'{dataset_title}: {data_typ} Images'
         dataset.attrs['Copyright Holder'] = 'CBG Photography Group'
         dataset.attrs['Copyright Institution'] = 'Centre for Biodiversity Genomics (email:CBGImaging@gmail.com)'
         dataset.attrs['Photographer'] = 'CBG Robotic Imager'
@@ -120,6 +126,55 @@ def read_from_hdf5(hdf5, image_name, saved_as_binary=False):
     return image
 
 
+def write_blob_in_hdf5(hdf5, image_files, rows, buffer_size=2 ** 26):
+    """
+    This function writes images in a HDF5 file as one concatenated blob of JPEG bytes.
+    The blob is indexed by the offset and length of each image, and the row position of each image
+    in the metadata file. The images are sorted by row position.
+    :param hdf5: HDF5 file (or group) to write images in.
+    :param image_files: Paths to the image files.
+    :param rows: Row position of each image in the metadata file.
+    :param buffer_size: Number of bytes to buffer in memory between writes to the blob.
+    :return:
+    """
+
+    rows = np.asarray(rows, dtype=np.int64)
+    order = np.argsort(rows, kind='stable')
+    image_files = [image_files[i] for i in order]
+    lengths = np.array([os.path.getsize(image_file) for image_file in image_files], dtype=np.int64)
+    offsets = np.cumsum(lengths) - lengths
+
+    blob = hdf5.create_dataset('jpeg', shape=(int(lengths.sum()),), dtype=np.uint8)
+    buffer, start = [], 0
+    for ind, image_file in enumerate(image_files):
+        with open(image_file, 'rb') as img_f:
+            buffer.append(img_f.read())
+        end = offsets[ind] + lengths[ind]
+        if end - start >= buffer_size or ind == len(image_files) - 1:
+            blob[start:end] = np.frombuffer(b''.join(buffer), dtype=np.uint8)
+            buffer, start = [], end
+
+    hdf5.create_dataset('rows', data=rows[order])
+    hdf5.create_dataset('offsets', data=offsets)
+    hdf5.create_dataset('lengths', data=lengths)
+
+
+def read_blob_from_hdf5(hdf5, index):
+    """
+    This function reads an image from a HDF5 file written with write_blob_in_hdf5.
+    :param hdf5: The Hdf5 file (or group) to read from.
+    :param index: Position of the image in the blob index (not the row in the metadata file).
+    :return:
+    """
+
+    offset = hdf5['offsets'][index]
+    length = hdf5['lengths'][index]
+    data = hdf5['jpeg'][offset:offset + length]
+    image = Image.open(io.BytesIO(data.tobytes()))
+
+    return image
+
+
 def resize_image(input_file, output_file, resize_dimension=256):
     command = f'convert "{input_file}" -resize x{resize_dimension} "{output_file}"'
     os.system(command)
@@ -153,8 +208,15 @@ def read_tsv(tsv_file):
     return df
 
 
-def read_csv(csv_file):
-    df = pd.read_csv(csv_file)
+def read_csv(csv_file, consumer=None, engine=None):
+    """
+    Read a .csv metadata file, parsing the columns with the dtypes of the schema registry.
+    :param csv_file: Path to the .csv file.
+    :param consumer: Name of the consumer, to read only its columns (see bioscan_schema.CONSUMERS). All columns if None.
+    :param engine: CSV parser engine: c, python, pyarrow or auto.
+    :return: DataFrame
+    """
+    df = bioscan_schema.read_metadata(csv_file, consumer=consumer, engine=engine)
     return df
 
 def read_tsv_large(tsv_file):
@@ -191,3 +253,316 @@ def sort_dict_list(data_dict):
         sorted_data_dict[name] = data_dict[name]
 
     return sorted_data_dict
+
+
+class ClassGroups:
+    def __init__(self, data_list):
+        """
+        Group the samples of a data list by class, with vectorized passes over integer class codes.
+        Classes are sorted by number of samples in descending order, and ties are kept in order of first
+        appearance, as sort_dict_list does. The classes are those of a dictionary keyed by the values, as
+        make_data_dict made: missing text values (NaN/None) are grouped into one np.nan class, but each NaN of
+        numeric data, and each [lat, lon] pair holding one, is a class of its own, since NaN is not equal to itself.
+        :param data_list: Class name of each sample, as a list, numpy array, pandas Categorical or Series
+        (categorical is fastest).
+        Items which are lists (exe., [lat, lon]) are grouped as tuples.
+        """
+
+        distinct = None
+        if not isinstance(data_list, (pd.Series, np.ndarray, pd.api.extensions.ExtensionArray)):
+            if any(isinstance(item, list) for item in data_list):
+                data_list = [tuple(item) if isinstance(item, list) else item for item in data_list]
+                distinct = np.array([isinstance(item, tuple) and any(v != v for v in item) for item in data_list],
+                                    dtype=bool)
+            data_list = pd.Series(data_list)
+        if pd.api.types.is_float_dtype(getattr(data_list, 'dtype', None)):
+            distinct = pd.isna(data_list)
+        codes, uniques = pd.factorize(data_list, use_na_sentinel=False)
+        uniques = list(np.asarray(uniques, dtype=object))
+        uniques = [np.nan if pd.isna(name) is True else name for name in uniques]
+        if distinct is not None and distinct.any():
+            # Give each of these samples a class of its own
+            positions = np.flatnonzero(distinct)
+            codes = codes.copy()
+            codes[positions] = len(uniques) + np.arange(len(positions))
+            names = np.asarray(data_list, dtype=object)[positions]
+            uniques += [float('nan') if pd.isna(name) is True else name for name in names]
+            # Drop the class the samples were grouped in before
+            used = np.flatnonzero(np.bincount(codes, minlength=len(uniques)))
+            remap = np.zeros(len(uniques), dtype=np.int64)
+            remap[used] = np.arange(len(used))
+            codes = remap[codes]
+            uniques = [uniques[i] for i in used]
+        counts = np.bincount(codes, minlength=len(uniques))
+
+        # Sort classes by size, keeping first appearance order for ties
+        first = np.full(len(uniques), len(codes), dtype=np.int64)
+        np.minimum.at(first, codes, np.arange(len(codes)))
+        order = np.lexsort((first, -counts))
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+
+        self.classes = [uniques[i] for i in order]
+        self.counts = counts[order]
+        self.labels = rank[codes]
+        self.indices = np.argsort(self.labels, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(self.counts)])
+
+    def __len__(self):
+        return len(self.classes)
+
+    def get_ids(self, label):
+        """
+        Get the sample ids of a class, in ascending order.
+        :param label: Numeric id of the class.
+        :return: numpy array of sample ids.
+        """
+        return self.indices[self.offsets[label]:self.offsets[label + 1]]
+
+    def class_to_ids(self):
+        """ Dictionary of class names to their numeric ids. """
+        return dict(zip(self.classes, range(len(self.classes))))
+
+    def to_dict(self):
+        """ Dictionary of class names to lists of sample ids, as make_data_dict returns. """
+        ids = np.split(self.indices, self.offsets[1:-1])
+        return {name: class_ids.tolist() for name, class_ids in zip(self.classes, ids)}
+
+
+class ColumnMapping(Mapping):
+    def __init__(self, df, columns, derived=None):
+        """
+        Read-only dictionary of DataFrame columns, giving each column as an array view only when it is accessed,
+        instead of copying every column into a list up front.
+        Columns are numpy arrays, or pandas Categorical for categorical columns. Names which are not columns of the
+        DataFrame give an empty array.
+        :param df: DataFrame holding the columns.
+        :param columns: Column names in the mapping.
+        :param derived: Dictionary of extra names to functions computing their values from the DataFrame.
+        These are computed on first access and kept.
+        """
+        self.df = df
+        self.names = list(columns) + [name for name in (derived or {}) if name not in columns]
+        self.derived = dict(derived or {})
+        self._derived_values = {}
+
+    def __getitem__(self, name):
+        if name in self.derived:
+            if name not in self._derived_values:
+                self._derived_values[name] = self.derived[name](self.df)
+            return self._derived_values[name]
+        if name not in self.names:
+            raise KeyError(name)
+        if name not in self.df.columns:
+            return np.array([], dtype=object)
+        return self.df[name].values
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+def default_cache_dir(metadata):
+    """ Default directory to cache indexes and results of a metadata file in: a "cache" directory next to it. """
+    return os.path.join(os.path.dirname(os.path.abspath(metadata)), 'cache')
+
+
+class TaxonomyIndex:
+    def __init__(self, metadata, cache_dir=None):
+        """
+        Inverted index from each (taxonomic level, name) pair to the sorted ids of its rows in the metadata file.
+        The index of a level is built from the full metadata the first time it is queried, and saved to disk as
+        memory-mappable arrays, keyed by the fingerprint of the metadata file, so later queries and runs only read
+        the rows they select.
+        :param metadata: Path to the Metadata file (.csv)
+        :param cache_dir: Directory to save the index in. Default is a "cache" directory next to the metadata file.
+        If False, the index is only held in memory.
+        """
+        self.metadata = metadata
+        if cache_dir is None:
+            cache_dir = default_cache_dir(metadata)
+        self.index_dir = None
+        if cache_dir:
+            self.index_dir = os.path.join(cache_dir, file_fingerprint(metadata), 'taxonomy_index')
+        self.levels = {}
+
+    def _paths(self, level):
+        prefix = os.path.join(self.index_dir, level)
+        return prefix + '.names.json', prefix + '.offsets.npy', prefix + '.rows.npy'
+
+    def load_level(self, level, df=None):
+        """
+        Load the index of a taxonomic level, building it if it is not saved yet.
+        :param level: Taxonomic level, exe., order.
+        :param df: Full metadata, in the order of the metadata file, to build the index from. Read if needed.
+        :return: Tuple of a dictionary of names to their positions, the CSR offsets, and the sorted row ids.
+        """
+        if level in self.levels:
+            return self.levels[level]
+        if self.index_dir is not None and all(os.path.isfile(path) for path in self._paths(level)):
+            names_path, offsets_path, rows_path = self._paths(level)
+            with open(names_path) as f:
+                names = json.load(f)
+            offsets, rows = load_array(offsets_path), load_array(rows_path)
+        else:
+            if df is None:
+                df = bioscan_schema.read_metadata(self.metadata, usecols=[level])
+            if level not in df.keys():
+                raise ValueError(f'\t\t\tERROR: Taxonomic level {level} is NOT available.')
+            groups = ClassGroups(df[level].values)
+            keep = [not (isinstance(name, float) and np.isnan(name)) for name in groups.classes]
+            names = [str(name) for name, k in zip(groups.classes, keep) if k]
+            # Drop the unknown (NaN) class, and sort each class by row id
+            counts = groups.counts[np.array(keep, dtype=bool)]
+            offsets = np.concatenate([[0], np.cumsum(counts)])
+            rows = np.concatenate([groups.get_ids(i) for i, k in enumerate(keep) if k] or [np.zeros(0, np.int64)])
+            if self.index_dir is not None:
+                try:
+                    os.makedirs(self.index_dir, exist_ok=True)
+                    names_path, offsets_path, rows_path = self._paths(level)
+                    save_array(offsets_path, offsets)
+                    save_array(rows_path, rows)
+                    tmp_path = f'{names_path}.{os.getpid()}.tmp'
+                    with open(tmp_path, 'w') as f:
+                        json.dump(names, f)
+                    os.replace(tmp_path, names_path)
+                except OSError as err:
+                    print(f'WARNING: Unable to save the taxonomy index to {self.index_dir}: {err}')
+        self.levels[level] = ({name: i for i, name in enumerate(names)}, offsets, rows)
+        return self.levels[level]
+
+    def get_rows(self, level, name, df=None):
+        """
+        Get the row ids of the samples with a name at a taxonomic level.
+        :param level: Taxonomic level, exe., class.
+        :param name: Name under the level, exe., Insecta.
+        :param df: Full metadata to build the index from, if it is not saved yet.
+        :return: Sorted array of row ids, empty if there are no such samples.
+        """
+        names, offsets, rows = self.load_level(level, df=df)
+        i = names.get(name)
+        if i is None:
+            return np.zeros(0, dtype=np.int64)
+        return rows[offsets[i]:offsets[i + 1]]
+
+    def select(self, level_names, how='union', df=None):
+        """
+        Get the row ids of the samples matching several (level, name) pairs.
+        :param level_names: List of [level, name] pairs, exe., [['order', 'Diptera'], ['family', 'Apidae']].
+        :param how: union, to match any of the pairs, or intersection, to match all of them.
+        :param df: Full metadata to build the index from, if it is not saved yet.
+        :return: Sorted array of row ids.
+        """
+        row_lists = sorted((self.get_rows(level, name, df=df) for level, name in level_names), key=len)
+        if how == 'union':
+            rows = np.unique(np.concatenate(row_lists)) if row_lists else np.zeros(0, dtype=np.int64)
+        elif how == 'intersection':
+            # Look up the rows of the smallest set in the others, so the cost follows the size of the result
+            rows = row_lists[0] if row_lists else np.zeros(0, dtype=np.int64)
+            for other in row_lists[1:]:
+                pos = np.minimum(np.searchsorted(other, rows), len(other) - 1)
+                rows = rows[other[pos] == rows] if len(other) else other
+        else:
+            raise ValueError(f'ERROR: how must be union or intersection, not {how}.')
+        return np.asarray(rows)
+
+
+RESULT_CACHE_VERSION = 2
+
+
+def _encode_result(value):
+    """ Convert a result to JSON serializable values, keeping tuples (exe., lat-lon classes) apart from lists. """
+    if isinstance(value, dict):
+        return {str(k): _encode_result(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return {'__tuple__': [_encode_result(v) for v in value]}
+    if isinstance(value, list):
+        return [_encode_result(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _decode_result(value):
+    if '__tuple__' in value:
+        return tuple(value['__tuple__'])
+    return value
+
+
+class ResultCache:
+    def __init__(self, metadata, backend, level_name, cache_dir=None, engine=None, downcast=True):
+        """
+        Cache of computed statistics, saved to disk as small JSON files.
+        Results are keyed by the fingerprint of the metadata file, so they are recomputed whenever the file changes,
+        by the way the file is parsed (CSV engine, downcast and schema version), by the backend computing them,
+        the taxonomic subset (level_name) and a key such as the attribute name.
+        If the cache directory can not be written to, exe., next to a read-only metadata file, results are computed
+        without being saved.
+        :param metadata: Path to the Metadata file (.csv)
+        :param backend: Name of the code computing the results, exe., statistics or distribution.
+        :param level_name: Taxonomic level and name of the subset, or a list of such pairs.
+        :param cache_dir: Directory to save the results in. Default is a "cache" directory next to the metadata file.
+        If False, nothing is cached, and results are always computed.
+        :param engine: CSV parser engine the metadata is read with: c, python, pyarrow or auto.
+        :param downcast: If the numeric columns of the metadata are downcast when read.
+        """
+        if cache_dir is None:
+            cache_dir = default_cache_dir(metadata)
+        self.cache_dir = None
+        if cache_dir:
+            subset = '-'.join(quote(str(item), safe='') for item in np.ravel(level_name))
+            reader = (f'{bioscan_schema.resolve_engine(engine)}-{"downcast" if downcast else "raw"}'
+                      f'-schema{bioscan_schema.SCHEMA_VERSION}')
+            self.cache_dir = os.path.join(cache_dir, file_fingerprint(metadata), 'results',
+                                          f'v{RESULT_CACHE_VERSION}', reader, backend, subset)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, quote(str(key), safe='') + '.json')
+
+    def get(self, key):
+        """
+        Get a cached result.
+        :param key: Name of the result, exe., attribute name.
+        :return: The result, or None if it is not cached.
+        """
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f, object_hook=_decode_result)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, key, value):
+        """
+        Save a result to the cache.
+        :param key: Name of the result, exe., attribute name.
+        :param value: Result made of dicts, lists, tuples, strings and numbers.
+        """
+        if self.cache_dir is None:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(f'{path}.{os.getpid()}.tmp', 'w') as f:
+                json.dump(_encode_result(value), f)
+            os.replace(f'{path}.{os.getpid()}.tmp', path)
+        except OSError as err:
+            print(f'WARNING: Unable to save the statistics cache to {self.cache_dir}, results are not cached: {err}')
+            self.cache_dir = None
+
+    def get_or_compute(self, key, compute):
+        """
+        Get a cached result, or compute it and save it to the cache.
+        Results are cached per metadata file, subset and attribute, so repeated reports skip reading the metadata.
+        :param key: Name of the result, exe., attribute name.
+        :param compute: Function without arguments computing the result, only called if it is not cached.
+        :return: The result.
+        """
+        value = self.get(key)
+        if value is None:
+            value = compute()
+            self.put(key, value)
+        return value
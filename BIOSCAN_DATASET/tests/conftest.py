@@ -0,0 +1,47 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import PIL.Image
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def dataset_root(tmp_path):
+    """A BIOSCAN-5M root directory with a small metadata file and no images."""
+    n = 40
+    df = pd.DataFrame(
+        {
+            "processid": [f"P{i:05d}" for i in range(n)],
+            "chunk": [f"c{i}" for i in range(n)],
+            "phylum": "Arthropoda",
+            "class": "Insecta",
+            "order": ["Diptera", "Hymenoptera"] * (n // 2),
+            "family": ["F1", "F2", "F3", "F4"] * (n // 4),
+            "subfamily": None,
+            "genus": ["G1", "G2", "G3", "G4", "G5"] * (n // 5),
+            "species": [f"s{i % 10}" for i in range(n)],
+            "dna_bin": [f"B{i % 8}" for i in range(n)],
+            "dna_barcode": ["ACGT" * 5 + "ACGT"[i % 4] * 4 for i in range(n)],
+            "split": "pretrain",
+        }
+    )
+    os.makedirs(tmp_path / "metadata" / "csv")
+    df.to_csv(tmp_path / "metadata" / "csv" / "BIOSCAN_5M_Insect_Dataset_metadata.csv", index=False)
+    return str(tmp_path)
+
+
+@pytest.fixture
+def image_root(dataset_root):
+    """The root directory of :func:`dataset_root`, with a small JPEG image for each sample."""
+    df = pd.read_csv(os.path.join(dataset_root, "metadata", "csv", "BIOSCAN_5M_Insect_Dataset_metadata.csv"))
+    rng = np.random.default_rng(0)
+    for _, row in df.iterrows():
+        image_dir = os.path.join(dataset_root, "images", "cropped_256", row["split"], row["chunk"])
+        os.makedirs(image_dir, exist_ok=True)
+        pixels = rng.integers(0, 256, (16, 8 + len(row["processid"]) % 5, 3), dtype=np.uint8)
+        PIL.Image.fromarray(pixels).save(os.path.join(image_dir, row["processid"] + ".jpg"))
+    return dataset_root
@@ -0,0 +1,116 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from bioscan_http import HTTPClient, HTTPError
+
+BODY = bytes(range(256)) * 4
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        if self.path == "/missing":
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/chunked":
+            self.send_response(200)
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(BODY), 300):
+                chunk = BODY[start : start + 300]
+                self.wfile.write(b"%x;name=value\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\nX-Trailer: 1\r\n\r\n")
+        else:
+            # Ignores any Range header, and sends the whole object
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+            if self.path == "/stale":
+                # Close the connection without telling the client, as an idle timeout on the server would
+                self.close_connection = True
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Server(ThreadingHTTPServer):
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.requests = []
+        self.n_connections = 0
+
+    def process_request(self, request, client_address):
+        self.n_connections += 1
+        super().process_request(request, client_address)
+
+
+@pytest.fixture
+def server():
+    server = Server()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client():
+    client = HTTPClient(max_connections=1, timeout=5)
+    yield client
+    client.close()
+
+
+def url(server, path):
+    return f"http://127.0.0.1:{server.server_address[1]}{path}"
+
+
+def test_keep_alive(server, client):
+    assert client.get(url(server, "/object")) == BODY
+    assert client.get(url(server, "/object")) == BODY
+    assert server.n_connections == 1
+
+
+def test_retry_on_connection_closed_by_server(server, client):
+    assert client.get(url(server, "/stale")) == BODY
+    # The idle connection was closed by the server, so the request is retried on a new one
+    assert client.get(url(server, "/stale")) == BODY
+    assert server.n_connections == 2
+
+
+def test_range_ignored_by_server(server, client):
+    assert client.get(url(server, "/object"), byte_range=(10, 30)) == BODY[10:30]
+    assert server.requests[-1] == ("/object", "bytes=10-29")
+
+
+def test_chunked_response(server, client):
+    assert client.get(url(server, "/chunked")) == BODY
+    # The connection is reused after the chunked body and its trailers
+    assert client.get_many([url(server, "/chunked"), url(server, "/object")]) == [BODY, BODY]
+    assert server.n_connections == 1
+
+
+def test_error_status(server, client):
+    with pytest.raises(HTTPError) as excinfo:
+        client.get(url(server, "/missing"))
+    assert excinfo.value.status == 404
+    assert excinfo.value.url == url(server, "/missing")
+    # The connection is still usable after an error response
+    assert client.get(url(server, "/object")) == BODY
+    assert server.n_connections == 1
+
+
+def test_close(server, client):
+    assert client.get(url(server, "/object")) == BODY
+    loop, thread = client._loop, client._thread
+    client.close()
+    assert loop.is_closed() and not thread.is_alive()
+    # The client starts a new event loop when it is used again
+    assert client.get(url(server, "/object")) == BODY
+    assert server.n_connections == 2
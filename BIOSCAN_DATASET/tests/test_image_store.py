@@ -0,0 +1,126 @@
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote
+
+import numpy as np
+import pytest
+
+from bioscan_dataloader import BIOSCAN5M
+from bioscan_http import HTTPClient
+from bioscan_image_store import SHARD_INDEX, HTTPShardImageStore, write_shards
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    """Serves the files of a directory, honouring single byte ranges as an object store does."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.path, self.headers.get("Range")))
+        path = os.path.join(self.server.directory, unquote(self.path).lstrip("/"))
+        if not os.path.isfile(path):
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        match = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range") or "")
+        if match:
+            start, stop = int(match.group(1)), int(match.group(2)) + 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{stop - 1}/{len(data)}")
+            data = data[start:stop]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def image_server(image_root):
+    dataset = BIOSCAN5M(image_root, split="pretrain", modality="image", target_type=[], metadata_cache=False)
+    write_shards(dataset, shard_size=8000, verbose=0)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FileHandler)
+    server.directory = os.path.join(image_root, "images")
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def file_dataset(image_root):
+    return BIOSCAN5M(image_root, split="pretrain", modality="image", target_type=[], metadata_cache=False)
+
+
+def http_dataset(image_root, image_server, image_storage):
+    return BIOSCAN5M(
+        image_root,
+        split="pretrain",
+        modality="image",
+        target_type=[],
+        metadata_cache=False,
+        image_storage=image_storage,
+        image_url=f"http://127.0.0.1:{image_server.server_address[1]}",
+        image_http_options={"max_connections": 2, "timeout": 5},
+    )
+
+
+@pytest.mark.parametrize("image_storage", ["http", "http_shards"])
+def test_http_store_matches_files(image_root, image_server, file_dataset, image_storage):
+    dataset = http_dataset(image_root, image_server, image_storage)
+    rows = np.asarray(file_dataset.rows)[[7, 0, 31, 3, 3, 19]]
+    try:
+        assert dataset.image_store.read_many(rows) == file_dataset.image_store.read_many(rows)
+        assert dataset.image_store.read_bytes(rows[2]) == file_dataset.image_store.read_bytes(rows[2])
+        for image, expected in zip(dataset.image_store.open_images(rows), file_dataset.image_store.open_images(rows)):
+            assert np.array_equal(np.asarray(image), np.asarray(expected))
+    finally:
+        dataset.image_store.client.close()
+
+
+def test_shard_store_index_lookup(image_root, image_server, file_dataset):
+    client = HTTPClient(max_connections=1, timeout=5)
+    base_url = f"http://127.0.0.1:{image_server.server_address[1]}/shards/cropped_256/pretrain"
+    try:
+        store = HTTPShardImageStore(base_url, client=client)
+    finally:
+        client.close()
+    shard_dir = os.path.join(image_server.directory, "shards", "cropped_256", "pretrain")
+    index = np.load(os.path.join(shard_dir, SHARD_INDEX))
+    # The rows of the index are in shard order, not in metadata order
+    assert not np.array_equal(index[:, 0], np.sort(index[:, 0]))
+    for row, shard_id, offset, length in index:
+        position = store._locate([row])[0]
+        location = store.shard_ids[position], store.offsets[position], store.lengths[position]
+        assert location == (shard_id, offset, length)
+    assert store.get_urls([index[0, 0]]) == [f"{base_url}/shard-{index[0, 1]:06d}.tar"]
+    with pytest.raises(KeyError):
+        store._locate([len(file_dataset.table)])
+
+
+@pytest.mark.parametrize("max_gap, n_requests", [(0, 4), (1 << 20, 2)])
+def test_shard_store_merges_nearby_ranges(image_root, image_server, file_dataset, max_gap, n_requests):
+    client = HTTPClient(max_connections=2, timeout=5)
+    base_url = f"http://127.0.0.1:{image_server.server_address[1]}/shards/cropped_256/pretrain"
+    try:
+        store = HTTPShardImageStore(base_url, client=client, max_gap=max_gap)
+        index = np.load(os.path.join(image_server.directory, "shards", "cropped_256", "pretrain", SHARD_INDEX))
+        # Two images apart from each other in each of the first two shards, in an interleaved order
+        first, second = (np.flatnonzero(index[:, 1] == shard_id) for shard_id in (0, 1))
+        rows = index[[first[0], second[-1], first[-1], second[0]], 0]
+        del image_server.requests[:]
+        assert store.read_many(rows) == file_dataset.image_store.read_many(rows)
+        assert len(image_server.requests) == n_requests
+        assert all(byte_range is not None for _, byte_range in image_server.requests)
+    finally:
+        client.close()
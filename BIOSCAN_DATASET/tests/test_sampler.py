@@ -0,0 +1,112 @@
+import numpy as np
+import pytest
+
+from bioscan_dataloader import BIOSCAN5M
+from bioscan_sampler import ChunkLocalitySampler, LookaheadBatchSampler, PerClassBatchSampler
+from bioscan_table import StringColumn
+
+
+def test_chunk_locality_sampler_from_dataset_without_images(dataset_root):
+    dataset = BIOSCAN5M(dataset_root, split="pretrain", modality="dna", target_type=[], metadata_cache=False)
+    assert dataset.image_paths is None
+    sampler = ChunkLocalitySampler.from_dataset(dataset, window_size=8)
+    # Every chunk is distinct, so the column is not stored as categories
+    assert isinstance(dataset.table["chunk"], StringColumn)
+    assert sampler.n_groups == len(dataset)
+    assert sorted(sampler) == list(range(len(dataset)))
+    labels = dataset.get_labels("chunk")
+    np.testing.assert_array_equal(labels, np.arange(len(dataset)))
+
+
+def resume(sampler, make_sampler, n_consumed):
+    """Resume a new sampler after ``n_consumed`` items of epoch 1 of ``sampler``, and get the rest of the epoch."""
+    sampler.set_epoch(1)
+    iterator = iter(sampler)
+    for _ in range(n_consumed):
+        next(iterator)
+    resumed = make_sampler()
+    resumed.load_state_dict(sampler.state_dict())
+    assert len(resumed) == len(sampler) - n_consumed
+    rest = list(resumed)
+    # Iterating again starts the epoch from the beginning
+    assert len(resumed) == len(sampler)
+    return rest
+
+
+@pytest.mark.parametrize("num_replicas", [1, 2])
+def test_per_class_batch_sampler_resume(num_replicas):
+    labels = np.repeat(np.arange(10), 7)
+    for rank in range(num_replicas):
+
+        def make_sampler():
+            return PerClassBatchSampler(labels, 3, 2, seed=1, num_replicas=num_replicas, rank=rank)
+
+        sampler = make_sampler()
+        sampler.set_epoch(1)
+        batches = list(sampler)
+        assert all(len(batch) == 6 for batch in batches)
+        assert resume(sampler, make_sampler, 4) == batches[4:]
+
+
+@pytest.mark.parametrize("num_replicas", [1, 3])
+def test_chunk_locality_sampler_resume(num_replicas):
+    groups = np.arange(100) // 10
+    for rank in range(num_replicas):
+
+        def make_sampler():
+            return ChunkLocalitySampler(groups, window_size=16, seed=1, num_replicas=num_replicas, rank=rank)
+
+        sampler = make_sampler()
+        sampler.set_epoch(1)
+        indices = list(sampler)
+        assert resume(sampler, make_sampler, 5) == indices[5:]
+
+
+@pytest.mark.parametrize("sampler_class", [ChunkLocalitySampler, PerClassBatchSampler])
+def test_resume_with_other_replicas(sampler_class):
+    labels = np.arange(120) // 8
+
+    def make_sampler(num_replicas, rank):
+        if sampler_class is PerClassBatchSampler:
+            return PerClassBatchSampler(
+                labels, 3, 2, num_batches=12 // num_replicas, num_replicas=num_replicas, rank=rank
+            )
+        return ChunkLocalitySampler(labels, window_size=16, num_replicas=num_replicas, rank=rank)
+
+    def as_key(item):
+        return tuple(item) if isinstance(item, list) else item
+
+    full = [as_key(item) for item in make_sampler(1, 0)]
+    # Two replicas take 3 items each, then training resumes on three replicas
+    consumed, state = [], None
+    for rank in range(2):
+        sampler = make_sampler(2, rank)
+        iterator = iter(sampler)
+        consumed += [as_key(next(iterator)) for _ in range(3)]
+        state = sampler.state_dict()
+    rest = []
+    for rank in range(3):
+        sampler = make_sampler(3, rank)
+        sampler.load_state_dict(state)
+        rest += [as_key(item) for item in sampler]
+    # Every item of the epoch is used exactly once
+    assert sorted(consumed + rest) == sorted(full)
+
+
+def test_lookahead_batch_sampler():
+    batches = [[i, i + 100] for i in range(7)]
+    # Two workers take the batches in turn, so each is told about its own next batch
+    sampler = LookaheadBatchSampler(batches, num_workers=2, lookahead=2)
+    out = list(sampler)
+    assert out == batches
+    assert [batch.upcoming for batch in out] == [
+        [2, 102, 4, 104],
+        [3, 103, 5, 105],
+        [4, 104, 6, 106],
+        [5, 105],
+        [6, 106],
+        [],
+        [],
+    ]
+    assert len(sampler) == 7
+    assert [batch.upcoming for batch in LookaheadBatchSampler(batches[:3])] == [[1, 101], [2, 102], []]
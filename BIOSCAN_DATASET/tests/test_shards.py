@@ -0,0 +1,34 @@
+import types
+
+import pytest
+
+import bioscan_dataloader
+from bioscan_dataloader import BIOSCAN5M, BIOSCAN5MShards
+from bioscan_image_store import write_shards
+
+
+@pytest.fixture
+def shard_root(image_root):
+    dataset = BIOSCAN5M(image_root, split="pretrain", modality="image", target_type=[], metadata_cache=False)
+    manifest = write_shards(dataset, shard_size=8000, verbose=0)
+    assert 1 < len(manifest["shards"]) < 12
+    return image_root
+
+
+@pytest.mark.parametrize("shuffle_buffer", [0, 5])
+def test_ranks_yield_equal_samples(shard_root, monkeypatch, shuffle_buffer):
+    dataset = BIOSCAN5MShards(
+        shard_root, split="pretrain", modality="dna", target_type="species", shuffle_buffer=shuffle_buffer
+    )
+    world_size, num_workers = 3, 4
+    assert world_size * num_workers > len(dataset.shards)
+    for rank in range(world_size):
+        monkeypatch.setattr(dataset, "_get_world", lambda rank=rank: (world_size, rank))
+        assert len(dataset) == dataset.num_samples // world_size
+        samples = []
+        for worker_id in range(num_workers):
+            worker_info = types.SimpleNamespace(num_workers=num_workers, id=worker_id)
+            monkeypatch.setattr(bioscan_dataloader.torch.utils.data, "get_worker_info", lambda info=worker_info: info)
+            samples += list(dataset)
+        # Every rank takes the same number of steps, however the shards are divided
+        assert len(samples) == len(dataset)